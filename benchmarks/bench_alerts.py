@@ -0,0 +1,93 @@
+"""Measures the per-tick cost of evaluating prices against many alerts.
+
+Run from the repository root:
+    python -m benchmarks.bench_alerts --alerts 100000 --ticks 100000
+"""
+import argparse
+import random
+from time import perf_counter
+from cogs.cryptocurrencies._alerts import ABOVE, BELOW, DOWN, UP, AlertEngine
+
+PRODUCTS = [f"COIN{i}-USD" for i in range(10)]
+
+
+def make_alerts(count: int) -> list:
+    """Spreads alerts over PRODUCTS with levels within 20% of 100 and a
+    tenth of them percentage moves over 15 minutes or an hour."""
+    alerts = list()
+    for i in range(count):
+        product = PRODUCTS[i % len(PRODUCTS)]
+        if i % 10 == 0:
+            alerts.append({"product": product,
+                           "kind": random.choice((UP, DOWN)),
+                           "value": random.uniform(0.01, 0.10),
+                           "window": random.choice((900, 3600))})
+        else:
+            level = random.uniform(80.0, 120.0)
+            alerts.append({"product": product,
+                           "kind": ABOVE if level > 100.0 else BELOW,
+                           "value": level})
+    return alerts
+
+
+def make_ticks(count: int) -> list:
+    """Random walk prices starting at 100, one tick per product a second."""
+    prices = {product: 100.0 for product in PRODUCTS}
+    ticks = list()
+    for i in range(count):
+        product = PRODUCTS[i % len(PRODUCTS)]
+        prices[product] *= 1.0 + random.gauss(0.0, 0.0005)
+        ticks.append((product, prices[product], i / len(PRODUCTS)))
+    return ticks
+
+
+def naive(alerts: list, ticks: list) -> float:
+    """Per-tick cost of scanning every alert of the product, for scale."""
+    by_product = dict()
+    for alert in alerts:
+        by_product.setdefault(alert["product"], list()).append(alert)
+    start = perf_counter()
+    for product, price, _ in ticks:
+        for alert in by_product[product]:
+            if alert["kind"] == ABOVE and price >= alert["value"]:
+                pass
+            elif alert["kind"] == BELOW and price <= alert["value"]:
+                pass
+    return (perf_counter() - start) / len(ticks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--alerts", type=int, default=100000)
+    parser.add_argument("--ticks", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    alerts = make_alerts(args.alerts)
+    ticks = make_ticks(args.ticks)
+
+    engine = AlertEngine()
+    start = perf_counter()
+    for alert in alerts:
+        engine.add(dict(alert))
+    add_cost = (perf_counter() - start) / len(alerts)
+
+    triggered = 0
+    start = perf_counter()
+    for product, price, timestamp in ticks:
+        triggered += len(engine.evaluate(product, price, timestamp))
+    tick_cost = (perf_counter() - start) / len(ticks)
+    # Scanning is far slower, so only time a slice of the ticks
+    scan_cost = naive(alerts, ticks[:max(1, len(ticks) // 100)])
+
+    print(f"alerts:          {len(alerts)} on {len(PRODUCTS)} products")
+    print(f"add:             {add_cost * 1e6:.2f} us per alert")
+    print(f"evaluate:        {tick_cost * 1e6:.2f} us per tick "
+          f"({len(ticks)} ticks, {triggered} alerts triggered)")
+    print(f"full scan:       {scan_cost * 1e6:.2f} us per tick")
+    print(f"still waiting:   {len(engine)} alerts")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measures latency and concurrency of CoinbaseClient against a local stand-in.
+
+Run from the repository root:
+    python -m benchmarks.bench_coinbase --requests 500 --concurrency 50
+"""
+import argparse
+import asyncio
+from time import perf_counter
+from benchmarks.stubs import CoinbaseStub
+from cogs.cryptocurrencies._coinbase import CoinbaseClient
+
+
+async def _loop_lag(stop: asyncio.Event, interval=0.01) -> float:
+    """Returns the worst event loop lag seen while the benchmark ran."""
+    worst = 0.0
+    while not stop.is_set():
+        start = perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, perf_counter() - start - interval)
+    return worst
+
+
+async def run(requests: int, concurrency: int, latency: float) -> None:
+    stub = CoinbaseStub(latency=latency)
+    url = await stub.start()
+    client = CoinbaseClient(api_url=url, pool_size=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            if i % 2:
+                await client.get_product_24hr_stats("BTC-USD")
+            else:
+                await client.get_product_historic_rates(
+                    "BTC-USD", granularity=300)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(_loop_lag(stop))
+    start = perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = perf_counter() - start
+    stop.set()
+    worst_lag = await lag_task
+    await client.close()
+    await stub.stop()
+
+    percentiles = client.latency.percentiles(50, 95, 99)
+    print(f"requests:        {requests} ({concurrency} concurrent)")
+    print(f"stub latency:    {latency * 1000:.1f} ms")
+    print(f"throughput:      {requests / elapsed:.1f} req/s")
+    print("latency:         " + ", ".join(
+        f"p{p}={ms:.1f} ms" for p, ms in percentiles.items()))
+    print(f"peak in flight:  {client.stats['peak_in_flight']}")
+    print(f"tcp connections: {len(stub.connections)}")
+    print(f"retries:         {client.stats['retries']}")
+    print(f"worst loop lag:  {worst_lag * 1000:.1f} ms")
+    return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="stand-in response latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.concurrency, args.latency))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""Drives real command callbacks against fake discord objects and stubs.
+
+Builds the whole DiscordBot with its cogs, points the crypto cog at local
+Coinbase and CoinMarketCap stand-ins and calls the commands with fake
+contexts, guilds, members and channels from benchmarks/fakes.py. Every
+scenario reports throughput, p50/p99 latency and the memory a command
+allocates and keeps. Results are saved in benchmarks/results/ and compared
+with the previous run, or with --baseline.
+
+Run from the repository root:
+    python -m benchmarks.bench_commands --latency 0.05
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import glob
+import json
+import os
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+from benchmarks.fakes import FakeChannel, FakeContext, FakeGuild, FakeMessage
+from benchmarks.stubs import CoinbaseStub, CoinMarketCapStub
+from discordbot import DiscordBot
+
+RESULTS_DIRECTORY = os.path.join("benchmarks", "results")
+SYMBOLS = ["BTC", "ETH", "USDT", "USDC", "SOL", "ADA", "XRP", "DOGE", "DOT",
+           "LTC", "LINK", "MATIC"]
+# name -> (iterations, concurrency). send_message is paced by discord's 50
+# requests a second, so it gets fewer.
+SCENARIOS = {
+    "cbpro": (400, 20),
+    "cbpro table": (200, 20),
+    "plot_crypto": (20, 4),
+    "plot_crypto cached": (200, 20),
+    "tod_join": (200, 10),
+    "tod_roll": (400, 1),
+    "purge": (100, 10),
+    "purge bulk": (20, 5),
+    "send_message": (40, 10),
+}
+
+
+def _percentile(values: list, percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+    return ordered[index]
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Bench:
+    """The bot, its cogs, the stubs and a guild to run commands in."""
+
+    def __init__(self, bot, coinbase, cmc, discord_latency: float):
+        self.bot = bot
+        self.coinbase = coinbase
+        self.cmc = cmc
+        self.discord_latency = discord_latency
+        self.crypto = bot.get_cog("CryptoCmd")
+        self.tod = bot.get_cog("TruthOrDareCmd")
+        self.admin = bot.get_cog("AdminCmd")
+        self.guild = FakeGuild(latency=discord_latency)
+        self.author = self.guild.add_member("benchmark")
+        self.channel = self.guild.add_text_channel("general")
+        return
+
+    def context(self, channel=None, author=None, guild=None) -> FakeContext:
+        return FakeContext(self.bot, guild or self.guild,
+                           channel or self.channel, author or self.author)
+
+    # Each prepare_* method returns `count` ready to run calls, so the work
+    # of setting up fake state is not timed
+
+    async def prepare_cbpro(self, count: int) -> list:
+        return [lambda i=i: self.crypto.cbpro(
+            self.context(), SYMBOLS[i % len(SYMBOLS)]) for i in range(count)]
+
+    async def prepare_cbpro_table(self, count: int) -> list:
+        # Tables go through send_message, paced per channel, so each call
+        # gets a channel of its own
+        return [lambda i=i, channel=FakeChannel(
+            f"table{i}", self.guild, self.discord_latency):
+            self.crypto.cbpro(self.context(channel), *(
+                SYMBOLS[(i + j) % len(SYMBOLS)] for j in range(5)))
+            for i in range(count)]
+
+    async def prepare_plot_crypto(self, count: int) -> list:
+        # A symbol nobody asked for yet, so every chart is downloaded and
+        # rendered
+        prefix = f"P{perf_counter():.0f}"
+        return [lambda i=i: self.crypto.plot_crypto(
+            self.context(), f"{prefix}X{i}") for i in range(count)]
+
+    async def prepare_plot_crypto_cached(self, count: int) -> list:
+        # Draws the chart once, later calls send the uploaded one
+        await self.crypto.plot_crypto(self.context(), "BTC")
+        return [lambda: self.crypto.plot_crypto(self.context(), "BTC")
+                for _ in range(count)]
+
+    async def prepare_tod_join(self, count: int) -> list:
+        # Five players per guild, so a fifth of the joins start a game
+        calls = list()
+        for i in range(count):
+            if i % 5 == 0:
+                guild = FakeGuild(latency=self.discord_latency)
+                channel = guild.add_text_channel("general")
+            member = guild.add_member(f"player{i}")
+            context = self.context(channel, member, guild)
+            calls.append(lambda context=context: self.tod.tod_join(context))
+        return calls
+
+    async def prepare_tod_roll(self, count: int) -> list:
+        guild = FakeGuild(latency=self.discord_latency)
+        channel = guild.add_text_channel("general")
+        players = [guild.add_member(f"player{i}") for i in range(5)]
+        for player in players:
+            await self.tod.tod_join(self.context(channel, player, guild))
+        table = self.tod.text_channel[guild.id]
+        return [lambda i=i: self.tod.tod_roll(self.context(
+            table, players[i % len(players)], guild)) for i in range(count)]
+
+    async def prepare_purge(self, count: int) -> list:
+        # Channels of 500 messages by five members, purging 20 by one
+        calls = list()
+        for _ in range(count):
+            channel = self.guild.add_text_channel("spam")
+            members = [self.guild.add_member(f"spammer{i}") for i in range(5)]
+            channel.messages = [FakeMessage(channel, members[i % 5], "spam")
+                                for i in range(500)]
+            context = self.context(channel)
+            calls.append(lambda context=context, target=members[0]:
+                         self.admin.purge(context, target, 20))
+        return calls
+
+    async def prepare_purge_bulk(self, count: int) -> list:
+        # Channels of 1000 messages, purging 250 of those matching a regex,
+        # which takes three bulk deletes
+        calls = list()
+        for _ in range(count):
+            channel = self.guild.add_text_channel("spam")
+            member = self.guild.add_member("spammer")
+            channel.messages = [FakeMessage(channel, member, f"spam {i}")
+                                for i in range(1000)]
+            context = self.context(channel)
+            calls.append(lambda context=context: self.admin.purge(
+                context, None, 250, r"contains=^spam \d+$"))
+        return calls
+
+    async def prepare_send_message(self, count: int) -> list:
+        # Three messages worth of text, each call to a channel of its own
+        text = "\n".join(f"line {i}: " + "x" * 80 for i in range(50))
+        return [lambda channel=FakeChannel(
+            f"output{i}", self.guild, self.discord_latency):
+            self.bot.send_message(self.context(channel), text)
+            for i in range(count)]
+
+    async def run(self, name: str, iterations: int,
+                  concurrency: int) -> dict:
+        """Times iterations calls of a scenario, then measures memory over
+        a second, traced batch."""
+        prepare = getattr(self, "prepare_" + name.replace(" ", "_"))
+        calls = await prepare(iterations)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = list()
+
+        async def one(call):
+            async with semaphore:
+                start = perf_counter()
+                await call()
+                latencies.append(perf_counter() - start)
+
+        requests = self.coinbase.requests + self.cmc.requests
+        start = perf_counter()
+        await asyncio.gather(*(one(call) for call in calls))
+        elapsed = perf_counter() - start
+        requests = self.coinbase.requests + self.cmc.requests - requests
+        # tracemalloc slows allocations down, so memory gets its own pass
+        traced = max(1, iterations // 4)
+        calls = await prepare(traced)
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        await asyncio.gather(*(one(call) for call in calls))
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "iterations": iterations,
+            "concurrency": concurrency,
+            "per_second": iterations / elapsed,
+            "p50_ms": _percentile(latencies[:iterations], 50) * 1000,
+            "p99_ms": _percentile(latencies[:iterations], 99) * 1000,
+            "upstream_requests": requests,
+            "retained_kib": (after - before) / traced / 1024,
+            "peak_kib": (peak - before) / 1024,
+        }
+
+
+def build_bot(directory: str) -> DiscordBot:
+    """Builds the bot with its files in directory and a silent console."""
+    quiet = open(os.devnull, "w")
+    with contextlib.redirect_stderr(quiet):
+        bot = DiscordBot(
+            slow_extension_seconds=float("inf"),
+            extension_times_path=os.path.join(directory, "times.json"),
+            database_path=os.path.join(directory, "bot.db"),
+            log_path=os.path.join(directory, "bot.log"),
+            metrics_path=os.path.join(directory, "metrics.prom"))
+    return bot
+
+
+def use_stubs(bot: DiscordBot, coinbase_url: str, cmc_url: str,
+              directory: str) -> None:
+    """Points the crypto cog at the stubs and its files at directory. Call
+    it before the loop runs the cogs' startup tasks, like the logo
+    prefetch, so nothing reaches the real upstreams."""
+    crypto = bot.get_cog("CryptoCmd")
+    crypto.coinbase_client.api_url = coinbase_url
+    crypto.logo_index.api_url = f"{cmc_url}/v1/cryptocurrency/info"
+    crypto.logo_index.path = os.path.join(directory, "logos.json")
+    crypto.logo_index.entries.clear()
+    crypto.candle_store.directory = os.path.join(directory, "candles")
+    return
+
+
+async def close_bot(bot: DiscordBot) -> None:
+    for extension in list(bot.extensions):
+        bot.unload_extension(extension)
+    await asyncio.sleep(0.1)  # Let the cogs' closing tasks finish
+    await bot.close()
+    # Whatever is left, like a delayed logo index save, writes to the
+    # temporary directory that is about to go
+    leftovers = [task for task in asyncio.all_tasks()
+                 if task is not asyncio.current_task()]
+    for task in leftovers:
+        task.cancel()
+    await asyncio.gather(*leftovers, return_exceptions=True)
+    return
+
+
+def _print_results(results: dict, baseline) -> None:
+    old = baseline["scenarios"] if baseline else dict()
+    if baseline:
+        options = baseline["options"]
+        print(f"Compared with {baseline['revision']} from {baseline['time']}"
+              f" (latency {options['latency']} s, discord latency "
+              f"{options['discord_latency']} s, scale {options['scale']})")
+    print(f"{'Scenario':<20} {'Cmd/s':>8} {'p50':>9} {'p99':>9} "
+          f"{'Upstream':>8} {'Kept':>9} {'Peak':>10}")
+    for name, result in results.items():
+        print(f"{name:<20} {result['per_second']:>8.1f} "
+              f"{result['p50_ms']:>6.1f} ms {result['p99_ms']:>6.1f} ms "
+              f"{result['upstream_requests']:>8} "
+              f"{result['retained_kib']:>5.1f} KiB "
+              f"{result['peak_kib']:>6.0f} KiB")
+        if name in old:
+            changes = [
+                f"{key} {(result[key] / old[name][key] - 1) * 100:+.0f}%"
+                for key in ("per_second", "p50_ms", "p99_ms")
+                if old[name][key]]
+            print(f"{'':<20} {', '.join(changes)}")
+    return
+
+
+def _load_baseline(path):
+    """Returns the results at path or, without one, the newest saved."""
+    if path is None:
+        saved = sorted(glob.glob(
+            os.path.join(RESULTS_DIRECTORY, "commands-*.json")))
+        if not saved:
+            return None
+        path = saved[-1]
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+async def run(args) -> dict:
+    coinbase = CoinbaseStub(latency=args.latency, jitter=args.jitter)
+    cmc = CoinMarketCapStub(latency=args.latency, jitter=args.jitter)
+    coinbase_url = await coinbase.start()
+    cmc_url = await cmc.start()
+    with tempfile.TemporaryDirectory() as directory:
+        bot = build_bot(directory)
+        use_stubs(bot, coinbase_url, cmc_url, directory)
+        bench = Bench(bot, coinbase, cmc, args.discord_latency)
+        await asyncio.sleep(0.5)  # Let the prefetch and cog setup settle
+        results = dict()
+        try:
+            for name in args.scenarios:
+                iterations, concurrency = SCENARIOS[name]
+                iterations = max(1, int(iterations * args.scale))
+                results[name] = await bench.run(name, iterations, concurrency)
+        finally:
+            await close_bot(bot)
+            await coinbase.stop()
+            await cmc.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="upstream stand-in latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01,
+                        help="random extra upstream latency, up to this")
+    parser.add_argument("--discord-latency", type=float, default=0.0,
+                        help="latency of every fake discord API call")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplies every scenario's iterations")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--baseline",
+                        help="results file to compare with, by default the "
+                             "newest in benchmarks/results")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    baseline = _load_baseline(args.baseline)
+    # discord.py's Bot runs on the loop that is current when it's built
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(run(args))
+    finally:
+        loop.close()
+    _print_results(results, baseline)
+    if not args.no_save:
+        now = datetime.now()
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        path = os.path.join(
+            RESULTS_DIRECTORY, f"commands-{now:%Y%m%d-%H%M%S}.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({
+                "time": now.isoformat(timespec="seconds"),
+                "revision": _git_revision(),
+                "options": vars(args),
+                "scenarios": results,
+            }, file, indent=2)
+        print(f"Saved to {path}")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Measures database writes per second under concurrent command load.
+
+Run from the repository root:
+    python -m benchmarks.bench_database --handlers 100 --writes 200
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+from time import perf_counter
+from database import Database
+from cogs.cryptocurrencies._resilience import LatencyTracker
+
+
+async def batched(path: str, handlers: int, writes: int) -> None:
+    """Every handler stores a value per 'command' and reads one back now
+    and then, the way cogs use bot.db."""
+    db = Database(path, logger=logging.getLogger(__name__))
+    latency = LatencyTracker(handlers * writes)
+
+    async def handler(user):
+        for i in range(writes):
+            start = perf_counter()
+            db.set("bench", f"{user}:{i % 10}", {"count": i})
+            if i % 10 == 0:
+                await db.get("bench", f"{user}:{i % 10}")
+            latency.add(perf_counter() - start)
+            await asyncio.sleep(0)  # Let the other handlers run
+
+    start = perf_counter()
+    await asyncio.gather(*(handler(user) for user in range(handlers)))
+    await db.flush()
+    elapsed = perf_counter() - start
+    await db.close()
+    total = handlers * writes
+    print(f"write-behind:    {total / elapsed:,.0f} writes/s, handler " +
+          ", ".join(f"p{p}={ms * 1000:.0f} us" for p, ms in
+                    latency.percentiles(50, 99).items()) +
+          f", {db.stats['batches']} batches, "
+          f"{db.stats['cache_hits']} cache hits")
+    return
+
+
+async def per_write(path: str, handlers: int, writes: int) -> None:
+    """The same load with one committed transaction per write, awaited by
+    the handler, for comparison."""
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("CREATE TABLE IF NOT EXISTS kv "
+                       "(key TEXT PRIMARY KEY, value TEXT)")
+    loop = asyncio.get_event_loop()
+    lock = asyncio.Lock()
+    latency = LatencyTracker(handlers * writes)
+
+    def write(key, value):
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?)", (key, value))
+
+    async def handler(user):
+        for i in range(writes):
+            start = perf_counter()
+            async with lock:
+                await loop.run_in_executor(None, write, f"{user}:{i % 10}",
+                                           str(i))
+            latency.add(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*(handler(user) for user in range(handlers)))
+    elapsed = perf_counter() - start
+    connection.close()
+    total = handlers * writes
+    print(f"commit per write: {total / elapsed:,.0f} writes/s, handler " +
+          ", ".join(f"p{p}={ms:.1f} ms" for p, ms in
+                    latency.percentiles(50, 99).items()))
+    return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--handlers", type=int, default=100)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--baseline-writes", type=int, default=10,
+                        help="writes per handler for the slow comparison")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(batched(os.path.join(directory, "batched.db"),
+                            args.handlers, args.writes))
+        asyncio.run(per_write(os.path.join(directory, "per_write.db"),
+                              args.handlers, args.baseline_writes))
+    return
+
+
+if __name__ == "__main__":
+    main()
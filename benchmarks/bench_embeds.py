@@ -0,0 +1,70 @@
+"""Measures building embeds from a template and laying out large ones.
+
+Run from the repository root:
+    python -m benchmarks.bench_embeds --fields 300
+"""
+import argparse
+from time import perf_counter
+import discord
+from embeds import EmbedPages, EmbedTemplate
+
+
+def stats(fields: int) -> dict:
+    """A stats response with many keys, like a verbose exchange answer."""
+    return {f"key_{i}": f"{i * 1234.5678:,.4f} " * 8 for i in range(fields)}
+
+
+def by_hand(data: dict) -> discord.Embed:
+    """Styles an embed one attribute at a time, the way cogs did."""
+    embed = discord.Embed(title="BTC-USD", type="rich",
+                          colour=discord.Color.blue())
+    embed.set_footer(text="Coinbase")
+    embed.set_author(name="since open: +1.00%")
+    for key in data:
+        embed.add_field(name=f"**{key.capitalize()}**", value=data[key])
+    return embed
+
+
+def from_template(template: EmbedTemplate, data: dict) -> discord.Embed:
+    embed = template.new(title="BTC-USD")
+    for key in data:
+        embed.add_field(name=f"**{key.capitalize()}**", value=data[key])
+    return embed
+
+
+def timed(function, repeat: int) -> float:
+    """Returns the mean microseconds of function()."""
+    start = perf_counter()
+    for _ in range(repeat):
+        function()
+    return (perf_counter() - start) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fields", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    template = EmbedTemplate(colour=discord.Color.blue(), footer="Coinbase",
+                             author="since open: +1.00%")
+    small = stats(8)
+    hand = timed(lambda: by_hand(small), args.repeat * 10)
+    styled = timed(lambda: from_template(template, small), args.repeat * 10)
+    print(f"styled embed, 8 fields: by hand {hand:.1f} us, "
+          f"template {styled:.1f} us")
+    embed = from_template(template, stats(args.fields))
+    pages = EmbedPages(embed)
+    print(f"{args.fields} fields, {len(embed)} characters: {len(pages)} pages,"
+          f" largest {max(len(pages.page(i)) for i in range(len(pages)))}"
+          f" characters")
+    eager = timed(lambda: [EmbedPages(embed).page(i)
+                           for i in range(len(pages))], args.repeat)
+    lazy = timed(lambda: EmbedPages(embed).page(0), args.repeat)
+    turn = timed(lambda: pages.page(len(pages) // 2), args.repeat)
+    print(f"every page built: {eager:.0f} us, first page only: {lazy:.0f} us,"
+          f" one page turn: {turn:.0f} us")
+    return
+
+
+if __name__ == "__main__":
+    main()
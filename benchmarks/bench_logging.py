@@ -0,0 +1,97 @@
+"""Measures what logging costs a command on the event loop thread.
+
+Compares the old pipeline (unbounded queue, f-strings, records formatted
+before queueing) with the json pipeline in logs.py (lazy %-style arguments,
+formatting on the listener thread, bounded queue, sampled debug logger).
+
+Run from the repository root:
+    python -m benchmarks.bench_logging --commands 20000
+"""
+import argparse
+import logging
+import os
+import tempfile
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+from time import perf_counter
+from logs import LogPipeline
+
+
+def old_pipeline(name: str, path: str):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    queue = Queue(-1)
+    logger.addHandler(QueueHandler(queue))
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s:%(name)s:%(levelname)s:\n\t%(message)s\n"))
+    listener = QueueListener(queue, handler)
+    listener.start()
+    return logger, queue, listener.stop
+
+
+def new_pipeline(name: str, path: str, queue_size: int):
+    logger = logging.getLogger(name)
+    pipeline = LogPipeline(logger, path, queue_size=queue_size,
+                           sampling={"requests": 10})
+    pipeline.handlers[0].setLevel(logging.CRITICAL)  # Keep the console quiet
+    pipeline.start()
+    return logger, pipeline
+
+
+def old_command(logger, i: int) -> None:
+    """What a $cbpro command logged: f-strings, formatted every time."""
+    symbol = "BTC"
+    logger.info(f"Searching for {symbol}-USD on cbpro.")
+    logger.debug(f"Quote for {symbol}-USD served from cache, request {i}.")
+    logger.debug(f"Embed for {symbol}-USD built with {8} fields.")
+    return
+
+
+def new_command(logger, requests, i: int) -> None:
+    symbol = "BTC"
+    requests.debug("Searching for %s-USD on cbpro.", symbol)
+    logger.debug("Quote for %s-USD served from cache, request %d.", symbol, i)
+    logger.debug("Embed for %s-USD built with %d fields.", symbol, 8)
+    return
+
+
+def timed(function, commands: int) -> float:
+    """Returns the mean microseconds per command."""
+    start = perf_counter()
+    for i in range(commands):
+        function(i)
+    return (perf_counter() - start) / commands * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=20000)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for level in (logging.INFO, logging.DEBUG):
+            old, queue, stop = old_pipeline(
+                f"old{level}", os.path.join(directory, f"old{level}.log"))
+            old.setLevel(level)
+            old_us = timed(lambda i: old_command(old, i), args.commands)
+            backlog = queue.qsize()
+            stop()
+            new, pipeline = new_pipeline(
+                f"new{level}", os.path.join(directory, f"new{level}.log"),
+                args.queue_size)
+            new.setLevel(level)
+            requests = new.getChild("requests")
+            new_us = timed(lambda i: new_command(new, requests, i),
+                           args.commands)
+            report = pipeline.report()
+            pipeline.stop()
+            print(f"{logging.getLevelName(level):<5} old: {old_us:.1f} us "
+                  f"per command, {backlog} records queued at the end")
+            print(f"{logging.getLevelName(level):<5} new: {new_us:.1f} us "
+                  f"per command, {report}")
+    return
+
+
+if __name__ == "__main__":
+    main()
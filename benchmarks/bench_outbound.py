@@ -0,0 +1,105 @@
+"""Compares the outbound scheduler with plain 2000 character slicing.
+
+Run from the repository root:
+    python -m benchmarks.bench_outbound --outputs 20
+"""
+import argparse
+import asyncio
+import logging
+import random
+from collections import deque
+from time import monotonic
+from outbound import FENCE, OutboundScheduler
+
+
+class FakeChannel:
+    """Records sends and counts the ones discord would answer with a 429
+    under a limit of `rate` messages every `per` seconds."""
+
+    def __init__(self, rate: int, per: float, latency=0.02):
+        self.id = 1
+        self.rate = rate
+        self.per = per
+        self.latency = latency
+        self.messages = list()
+        self.rate_limited = 0
+        self._recent = deque()
+        return
+
+    async def send(self, text: str) -> None:
+        await asyncio.sleep(self.latency)
+        now = monotonic()
+        while self._recent and now - self._recent[0] >= self.per:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate:
+            self.rate_limited += 1
+            # discord.py would sleep out the rest of the window and retry
+            await asyncio.sleep(self.per - (now - self._recent[0]))
+            return await self.send(text)
+        self._recent.append(now)
+        self.messages.append(text)
+        return
+
+
+def make_outputs(count: int) -> list:
+    """A burst like $reload_all and $test_message produce: short status
+    lines, long digit runs and long code blocks."""
+    random.seed(1)
+    outputs = list()
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            outputs.append(f"cogs.extension_{i} successfully reloaded.")
+        elif kind == 1:
+            outputs.append("".join(str(n % 10) for n in range(2500)))
+        else:
+            rows = "\n".join(f"BTC {random.uniform(1, 9e4):>14,.4f}"
+                             for _ in range(120))
+            outputs.append(f"```\n{rows}\n```")
+    return outputs
+
+
+def broken_code_blocks(messages: list) -> int:
+    """Returns how many messages open or close a code block unmatched."""
+    return sum(
+        1 for text in messages
+        if sum(1 for line in text.split("\n") if FENCE.match(line)) % 2)
+
+
+async def sliced(outputs: list, rate: int, per: float) -> FakeChannel:
+    channel = FakeChannel(rate, per)
+    for msg in outputs:
+        for i in range(0, len(msg), 2000):
+            await channel.send(msg[i:i + 2000])
+    return channel
+
+
+async def scheduled(outputs: list, rate: int, per: float) -> FakeChannel:
+    channel = FakeChannel(rate, per)
+    scheduler = OutboundScheduler(logging.getLogger(__name__),
+                                  channel_rate=rate, channel_per=per)
+    await asyncio.gather(*(scheduler.send(channel, msg) for msg in outputs))
+    print(f"  {scheduler.report()}")
+    return channel
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--outputs", type=int, default=20)
+    parser.add_argument("--per", type=float, default=0.5,
+                        help="rate limit window, discord's is 5 seconds")
+    args = parser.parse_args()
+    outputs = make_outputs(args.outputs)
+    for name, run in (("sliced", sliced), ("scheduled", scheduled)):
+        start = monotonic()
+        channel = asyncio.run(run(outputs, 5, args.per))
+        elapsed = monotonic() - start
+        unbalanced = broken_code_blocks(channel.messages)
+        print(f"{name + ':':<11} {len(channel.messages)} requests, "
+              f"{channel.rate_limited} rate limited, {unbalanced} with "
+              f"broken code blocks, {elapsed:.2f}s")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Renders many charts concurrently and measures event loop lag meanwhile.
+
+Run from the repository root:
+    python -m benchmarks.bench_render --charts 20 --workers 2
+"""
+import argparse
+import asyncio
+import numpy as np
+from time import perf_counter
+from benchmarks.bench_coinbase import _loop_lag
+from cogs.cryptocurrencies._render import ChartRenderer, render_price_line
+
+
+async def run(charts: int, workers: int) -> None:
+    renderer = ChartRenderer(workers=workers, max_pending=charts)
+    x = np.arange(288, dtype=float)
+    y = 100.0 + np.cumsum(np.random.randn(288))
+    # The first chart pays for spawning the workers, so keep it out
+    await renderer.render(render_price_line, x, y, "BTC", "Time", "USD")
+    renderer.render_times.samples.clear()
+
+    stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(_loop_lag(stop))
+    start = perf_counter()
+    pngs = await asyncio.gather(*(
+        renderer.render(render_price_line, x, y, "BTC", "Time", "USD")
+        for _ in range(charts)))
+    elapsed = perf_counter() - start
+    stop.set()
+    worst_lag = await lag_task
+    renderer.close()
+
+    print(f"charts:         {charts} ({workers} workers)")
+    print(f"throughput:     {charts / elapsed:.1f} charts/s")
+    print(f"png size:       {sum(map(len, pngs)) / len(pngs) / 1024:.1f} KiB")
+    print(f"renderer:       {renderer.report()}")
+    print(f"worst loop lag: {worst_lag * 1000:.1f} ms")
+    return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--charts", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.charts, args.workers))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Measures hedging and the circuit breaker against a slow, then broken, stand-in.
+
+Run from the repository root:
+    python -m benchmarks.bench_resilience --requests 400 --tail 0.05
+"""
+import argparse
+import asyncio
+from time import perf_counter
+from benchmarks.stubs import CoinbaseStub
+from cogs.cryptocurrencies._coinbase import CoinbaseClient, CoinbaseError
+from cogs.cryptocurrencies._resilience import LatencyTracker
+
+
+async def _timed_calls(client, requests: int, concurrency: int):
+    """Returns (caller latencies, errors) for a burst of stats requests."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latency = LatencyTracker(requests)
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = perf_counter()
+            try:
+                await client.get_product_24hr_stats("BTC-USD")
+            except CoinbaseError:
+                errors += 1
+            latency.add(perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latency, errors
+
+
+def _line(label: str, latency: LatencyTracker, extra="") -> str:
+    return f"{label:<16} " + ", ".join(
+        f"p{p}={ms:.0f} ms" for p, ms in latency.percentiles(
+            50, 95, 99).items()) + extra
+
+
+async def run(requests: int, concurrency: int, tail: float) -> None:
+    stub = CoinbaseStub(latency=0.02, jitter=0.01, tail=tail,
+                        tail_latency=1.0)
+    url = await stub.start()
+    for hedge_ratio in (0.0, 0.1):
+        client = CoinbaseClient(api_url=url, retries=0)
+        upstream = client.upstreams["stats"]
+        upstream.hedge_ratio = hedge_ratio
+        await _timed_calls(client, 50, concurrency)  # learn the p95
+        latency, errors = await _timed_calls(client, requests, concurrency)
+        label = "hedged:" if hedge_ratio else "not hedged:"
+        print(_line(label, latency, f" ({errors} errors, "
+                    f"{upstream.stats['hedges']} hedges, "
+                    f"{upstream.stats['hedge_wins']} won)"))
+        await client.close()
+
+    # Outage: the breaker should open and later calls fail in microseconds
+    client = CoinbaseClient(api_url=url, retries=0)
+    stub.failing = True
+    latency, errors = await _timed_calls(client, requests, 1)
+    print(_line("outage:", latency, f" ({errors} errors, "
+                f"{client.breaker.stats['rejected']} failed fast, "
+                f"{stub.requests} reached the stand-in in total)"))
+    # Recovery: after reset_after the trial call closes the breaker again
+    stub.failing = False
+    client.breaker.reset_after = 0.0
+    latency, errors = await _timed_calls(client, 10, 1)
+    print(_line("recovered:", latency, f" ({errors} errors, "
+                f"circuit {client.breaker.state})"))
+    await client.close()
+    await stub.stop()
+    return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--tail", type=float, default=0.05,
+                        help="fraction of requests that take a second longer")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.concurrency, args.tail))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import datetime
+import itertools
+
+# Stand-ins for the discord objects command callbacks touch: contexts,
+# guilds, members, roles, channels and messages. They keep just enough state
+# for the cogs to run and answer every API call after `latency` seconds, like
+# discord's REST API would, so commands can be benchmarked without a gateway.
+
+_ids = itertools.count(10 ** 17)
+
+
+async def _api(latency: float) -> None:
+    """Stands in for one REST round trip."""
+    if latency:
+        await asyncio.sleep(latency)
+    else:
+        await asyncio.sleep(0)
+    return
+
+
+class FakeRole:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+        return
+
+
+class FakeMember:
+    def __init__(self, name: str, roles=()):
+        self.id = next(_ids)
+        self.name = name
+        self.discriminator = "0001"
+        self.mention = f"<@{self.id}>"
+        self.roles = list(roles)
+        self.bot = False
+        return
+
+    def __str__(self) -> str:
+        return f"{self.name}#{self.discriminator}"
+
+    def __eq__(self, other) -> bool:
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+
+class FakeAttachment:
+    def __init__(self, filename: str):
+        self.id = next(_ids)
+        self.filename = filename
+        self.url = f"https://cdn.example.invalid/{self.id}/{filename}"
+        return
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content=None, embed=None,
+                 files=()):
+        self.id = next(_ids)
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.embed = embed
+        self.attachments = [FakeAttachment(file.filename) for file in files]
+        self.reactions = list()
+        self.deleted = False
+        # Naive UTC, like discord.py's
+        self.created_at = datetime.datetime.utcnow()
+        return
+
+    async def delete(self, delay=None) -> None:
+        await _api(self.channel.latency)
+        self.deleted = True
+        if self in self.channel.messages:
+            self.channel.messages.remove(self)
+        return
+
+    async def edit(self, **fields) -> None:
+        await _api(self.channel.latency)
+        self.content = fields.get("content", self.content)
+        self.embed = fields.get("embed", self.embed)
+        return
+
+    async def add_reaction(self, emoji) -> None:
+        await _api(self.channel.latency)
+        self.reactions.append(emoji)
+        return
+
+    async def clear_reactions(self) -> None:
+        await _api(self.channel.latency)
+        self.reactions.clear()
+        return
+
+
+class FakeChannel:
+    """A text or voice channel. Sent messages are kept, up to `keep` of
+    them, newest last, as history() reads them."""
+
+    def __init__(self, name: str, guild=None, latency=0.0, keep=1000):
+        self.id = next(_ids)
+        self.name = name
+        self.guild = guild
+        self.latency = latency
+        self.keep = keep
+        self.mention = f"<#{self.id}>"
+        self.messages = list()
+        self.sent = 0
+        self.overwrites = dict()
+        return
+
+    async def send(self, content=None, *, embed=None, file=None, files=None,
+                   delete_after=None, author=None) -> FakeMessage:
+        await _api(self.latency)
+        files = files or ([file] if file is not None else [])
+        message = FakeMessage(self, author, content, embed, files)
+        self.messages.append(message)
+        if len(self.messages) > self.keep:
+            del self.messages[:-self.keep]
+        self.sent += 1
+        return message
+
+    async def history(self, limit=100, before=None, after=None,
+                      oldest_first=False):
+        """Yields the newest messages first, a page of 100 per round
+        trip. before and after are messages or naive UTC datetimes."""
+        def when(point):
+            if isinstance(point, datetime.datetime):
+                return point
+            return point.created_at
+
+        messages = [m for m in reversed(self.messages)
+                    if (before is None or m.created_at < when(before))
+                    and (after is None or m.created_at > when(after))]
+        for index, message in enumerate(messages):
+            if limit is not None and index >= limit:
+                return
+            if index % 100 == 0:
+                await _api(self.latency)
+            yield message
+
+    async def delete_messages(self, messages) -> None:
+        await _api(self.latency)
+        doomed = {message.id for message in messages}
+        self.messages = [m for m in self.messages if m.id not in doomed]
+        return
+
+    async def purge(self, limit=100) -> list:
+        deleted = self.messages[-limit:] if limit else list()
+        await self.delete_messages(deleted)
+        return deleted
+
+    async def set_permissions(self, target, **permissions) -> None:
+        await _api(self.latency)
+        self.overwrites[target] = permissions
+        return
+
+    async def delete(self) -> None:
+        await _api(self.latency)
+        if self.guild is not None:
+            self.guild.remove_channel(self)
+        return
+
+
+class FakeGuild:
+    def __init__(self, name="Benchmark", latency=0.0):
+        self.id = next(_ids)
+        self.name = name
+        self.latency = latency
+        self.default_role = FakeRole("@everyone")
+        self.text_channels = list()
+        self.voice_channels = list()
+        self.members = list()
+        return
+
+    @property
+    def channels(self) -> list:
+        return self.text_channels + self.voice_channels
+
+    def add_member(self, name: str, roles=()) -> FakeMember:
+        member = FakeMember(name, roles)
+        self.members.append(member)
+        return member
+
+    def add_text_channel(self, name: str) -> FakeChannel:
+        channel = FakeChannel(name, self, self.latency)
+        self.text_channels.append(channel)
+        return channel
+
+    async def create_text_channel(self, name: str, overwrites=None):
+        await _api(self.latency)
+        channel = self.add_text_channel(name)
+        channel.overwrites.update(overwrites or dict())
+        return channel
+
+    async def create_voice_channel(self, name: str, overwrites=None):
+        await _api(self.latency)
+        channel = FakeChannel(name, self, self.latency)
+        channel.overwrites.update(overwrites or dict())
+        self.voice_channels.append(channel)
+        return channel
+
+    def remove_channel(self, channel: FakeChannel) -> None:
+        for channels in (self.text_channels, self.voice_channels):
+            if channel in channels:
+                channels.remove(channel)
+        return
+
+    async def ban(self, member, reason=None, delete_message_days=0) -> None:
+        await _api(self.latency)
+        return
+
+
+class FakeContext:
+    """What a command callback gets as ctx: the invoking message, its
+    author, channel and guild, and send() into that channel."""
+
+    def __init__(self, bot, guild: FakeGuild, channel: FakeChannel,
+                 author: FakeMember, command=None):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.command = command
+        self.command_failed = False
+        self.message = FakeMessage(channel, author, "$benchmark")
+        return
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
@@ -0,0 +1,366 @@
+"""Replays MESSAGE_CREATE events through the bot's command dispatch and finds
+the event rate at which it saturates.
+
+Events go through the same path the gateway feeds: json decoding, the
+connection state's MESSAGE_CREATE parser, on_message, prefix parsing and
+command invocation. Guilds are created in the bot's cache, discord's REST
+API is a local stand-in that captures what commands send, and the crypto
+cog talks to the Coinbase and CoinMarketCap stand-ins. Each step feeds
+events open loop at a fixed rate, the way the gateway does whether or not
+the bot keeps up, and reports:
+
+- dispatch overhead, the time the parser holds the event loop per event,
+- queueing delay, from an event's arrival until on_message runs, and until
+  its command starts and completes,
+- event loop lag and the rate actually fed, which falls behind the target
+  once the loop is saturated.
+
+Run from the repository root:
+    python -m benchmarks.replay_gateway --guilds 500 --rates 500 1000 2000
+    python -m benchmarks.replay_gateway --save events.jsonl --events 20000
+    python -m benchmarks.replay_gateway --replay events.jsonl
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import tempfile
+from time import perf_counter
+import discord
+from benchmarks.bench_commands import build_bot, close_bot, use_stubs
+from benchmarks.stubs import CoinbaseStub, CoinMarketCapStub, DiscordApiStub
+from metrics import COMMAND_BUCKETS, LAG_BUCKETS, Histogram
+
+# Message content -> share of the traffic. Most messages aren't commands,
+# but every one of them is parsed and checked for the prefix.
+MIX = {
+    "hello there, how is everyone doing today?": 80,
+    "$tod_status": 10,
+    "$tod_players": 5,
+    "$cbpro BTC": 4,
+    "$no_such_command": 1,
+}
+TIMESTAMP = "2021-06-01T12:00:00.000000+00:00"
+
+
+def _guild_data(guild_id: int, channel_ids, member_count: int) -> dict:
+    """Returns a GUILD_CREATE payload with one text channel per id."""
+    return {
+        "id": str(guild_id), "name": f"guild{guild_id}",
+        "owner_id": str(guild_id), "member_count": member_count,
+        "roles": [{"id": str(guild_id), "name": "@everyone",
+                   "permissions": "104324673", "position": 0, "color": 0,
+                   "hoist": False, "managed": False,
+                   "mentionable": False}],
+        "channels": [{"id": str(channel_id), "type": 0,
+                      "name": f"channel{channel_id}", "position": index,
+                      "permission_overwrites": []}
+                     for index, channel_id in enumerate(channel_ids)],
+        "members": [], "emojis": [], "features": [],
+    }
+
+
+def _message_data(guild_id: int, channel_id: int, user_id: int,
+                  content: str) -> dict:
+    return {
+        "id": "0", "type": 0, "content": content,
+        "guild_id": str(guild_id), "channel_id": str(channel_id),
+        "author": {"id": str(user_id), "username": f"user{user_id}",
+                   "discriminator": "0001", "avatar": None},
+        "member": {"roles": [], "joined_at": TIMESTAMP, "deaf": False,
+                   "mute": False},
+        "timestamp": TIMESTAMP, "edited_timestamp": None, "tts": False,
+        "mention_everyone": False, "mentions": [], "mention_roles": [],
+        "attachments": [], "embeds": [], "pinned": False,
+    }
+
+
+def synthetic_events(guilds: int, members: int, count: int,
+                     mix: dict) -> list:
+    """Returns count MESSAGE_CREATE gateway frames, as json text, spread
+    over guilds with one channel and `members` members each."""
+    contents = list(mix)
+    weights = [mix[content] for content in contents]
+    frames = list()
+    for _ in range(count):
+        guild_id = (random.randrange(guilds) + 1) * 10 ** 6
+        data = _message_data(
+            guild_id, guild_id + 1,
+            guild_id + 10 + random.randrange(members),
+            random.choices(contents, weights)[0])
+        frames.append(json.dumps(
+            {"op": 0, "t": "MESSAGE_CREATE", "s": None, "d": data}))
+    return frames
+
+
+def read_events(path: str) -> list:
+    """Returns the MESSAGE_CREATE frames in a file of gateway frames, one
+    json object per line. Other events are skipped."""
+    frames = list()
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip() and json.loads(line).get("t") == \
+                    "MESSAGE_CREATE":
+                frames.append(line)
+    return frames
+
+
+def _guilds_of(frames: list) -> dict:
+    """Returns guild id -> (channel ids, member ids) seen in frames."""
+    guilds = dict()
+    for frame in frames:
+        data = json.loads(frame)["d"]
+        channels, members = guilds.setdefault(
+            int(data["guild_id"]), (set(), set()))
+        channels.add(int(data["channel_id"]))
+        members.add(int(data["author"]["id"]))
+    return guilds
+
+
+def _quantiles(values: list) -> tuple:
+    """Returns the mean, p50 and p99 of values."""
+    if not values:
+        return 0.0, 0.0, 0.0
+    ordered = sorted(values)
+    return (sum(ordered) / len(ordered), ordered[len(ordered) // 2],
+            ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))])
+
+
+class Replay:
+    """Feeds frames into the bot and times where each event spends its
+    time. Timings are keyed by message id, which is unique per event."""
+
+    def __init__(self, bot, frames: list):
+        self.bot = bot
+        self.frames = frames
+        self._ids = itertools.count(10 ** 18)
+        # message id -> when the event was due to arrive
+        self.arrivals = dict()
+        self.in_flight = 0
+        self.reset()
+        bot.add_listener(self.on_message, "on_message")
+        bot.add_listener(self.on_command, "on_command")
+        bot.add_listener(self.on_command_completion, "on_command_completion")
+        bot.add_listener(self.on_command_error, "on_command_error")
+        return
+
+    def reset(self) -> None:
+        self.dispatch = list()
+        # Waiting for the loop takes milliseconds until it saturates
+        self.message_delay = Histogram(LAG_BUCKETS)
+        self.command_delay = Histogram(LAG_BUCKETS)
+        self.command_latency = Histogram(COMMAND_BUCKETS)
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.commands = 0
+        self.errors = 0
+        return
+
+    def _since_arrival(self, message) -> float:
+        return perf_counter() - self.arrivals.get(message.id, perf_counter())
+
+    async def on_message(self, message) -> None:
+        self.message_delay.observe(self._since_arrival(message))
+        return
+
+    async def on_command(self, ctx) -> None:
+        self.in_flight += 1
+        self.command_delay.observe(self._since_arrival(ctx.message))
+        return
+
+    async def on_command_completion(self, ctx) -> None:
+        self._finish(ctx)
+        return
+
+    async def on_command_error(self, ctx, error) -> None:
+        self.errors += 1
+        # Unknown commands fail before on_command, so never started
+        if ctx.command is not None:
+            self._finish(ctx)
+        return
+
+    def _finish(self, ctx) -> None:
+        self.in_flight -= 1
+        self.commands += 1
+        self.command_latency.observe(self._since_arrival(ctx.message))
+        self.arrivals.pop(ctx.message.id, None)
+        return
+
+    async def _watch_loop(self, interval=0.01) -> None:
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(
+                max(0.0, perf_counter() - start - interval))
+
+    async def feed(self, rate: float, seconds: float) -> float:
+        """Feeds rate events a second for seconds, open loop, and returns
+        the rate actually fed."""
+        parse = self.bot._connection.parse_message_create
+        total = max(1, int(rate * seconds))
+        frames = itertools.cycle(self.frames)
+        start = perf_counter()
+        sent = 0
+        while sent < total:
+            # Everything that is due arrives at once, as if it had piled
+            # up in the socket while the loop was busy
+            due = min(total, int((perf_counter() - start) * rate) + 1)
+            while sent < due:
+                began = perf_counter()
+                data = json.loads(next(frames))["d"]
+                data["id"] = str(next(self._ids))
+                self.arrivals[int(data["id"])] = start + sent / rate
+                parse(data)
+                self.dispatch.append(perf_counter() - began)
+                sent += 1
+            await asyncio.sleep(max(0.0, start + sent / rate - perf_counter()))
+        return total / (perf_counter() - start)
+
+    async def step(self, rate: float, seconds: float,
+                   drain_timeout: float) -> dict:
+        """Runs one step at rate and waits for its commands to finish."""
+        self.reset()
+        self.arrivals.clear()
+        watcher = asyncio.ensure_future(self._watch_loop())
+        start = perf_counter()
+        fed = await self.feed(rate, seconds)
+        deadline = perf_counter() + drain_timeout
+        while self.in_flight > 0 and perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = perf_counter() - start
+        watcher.cancel()
+        mean, _, p99 = _quantiles(self.dispatch)
+        return {
+            "rate": rate, "fed": fed,
+            "dispatch_us": mean * 1e6, "dispatch_p99_us": p99 * 1e6,
+            "message_delay": self.message_delay,
+            "command_delay": self.command_delay,
+            "command_latency": self.command_latency,
+            "loop_lag": self.loop_lag,
+            "commands_per_second": self.commands / elapsed,
+            "errors": self.errors, "unfinished": self.in_flight,
+        }
+
+
+def _print_step(result: dict, sends: int) -> None:
+    def ms(histogram, percent):
+        return f"{histogram.percentile(percent) * 1000:.1f}"
+
+    print(f"{result['rate']:.0f} events/s (fed {result['fed']:.0f}): "
+          f"dispatch {result['dispatch_us']:.0f} us mean, "
+          f"{result['dispatch_p99_us']:.0f} us p99")
+    print(f"    on_message delay p50/p99: "
+          f"{ms(result['message_delay'], 50)}/"
+          f"{ms(result['message_delay'], 99)} ms, command start p50/p99: "
+          f"{ms(result['command_delay'], 50)}/"
+          f"{ms(result['command_delay'], 99)} ms")
+    print(f"    command done p50/p99: {ms(result['command_latency'], 50)}/"
+          f"{ms(result['command_latency'], 99)} ms, "
+          f"{result['commands_per_second']:.0f} commands/s, "
+          f"{sends} messages sent, {result['errors']} errors, "
+          f"{result['unfinished']} unfinished")
+    lag = result["loop_lag"]
+    print(f"    loop lag p50/p99/max: {ms(lag, 50)}/{ms(lag, 99)}/"
+          f"{lag.max * 1000:.1f} ms")
+    return
+
+
+def _saturated(result: dict, max_delay: float) -> bool:
+    """The loop can't keep up once it falls behind the gateway or events
+    or their commands wait longer than max_delay to start."""
+    return (result["fed"] < 0.95 * result["rate"]
+            or result["message_delay"].percentile(99) > max_delay
+            or result["command_delay"].percentile(99) > max_delay
+            or result["unfinished"] > 0)
+
+
+async def run(args, frames: list) -> None:
+    discord_api = DiscordApiStub(latency=args.discord_latency)
+    coinbase = CoinbaseStub(latency=args.latency)
+    cmc = CoinMarketCapStub(latency=args.latency)
+    discord_url = await discord_api.start()
+    coinbase_url = await coinbase.start()
+    cmc_url = await cmc.start()
+    base = discord.http.Route.BASE
+    discord.http.Route.BASE = f"{discord_url}/api/v7"
+    with tempfile.TemporaryDirectory() as directory:
+        bot = build_bot(directory)
+        use_stubs(bot, coinbase_url, cmc_url, directory)
+        try:
+            # What login and the READY event would set up
+            user = await bot.http.static_login("replay", bot=True)
+            state = bot._connection
+            state.user = discord.ClientUser(state=state, data=user)
+            bot.metrics.start(bot.loop)
+            for guild_id, (channels, members) in _guilds_of(frames).items():
+                state._add_guild_from_data(
+                    _guild_data(guild_id, sorted(channels), len(members)))
+            replay = Replay(bot, frames)
+            print(f"{len(frames)} events over {len(bot.guilds)} guilds")
+            healthy = None
+            for rate in args.rates:
+                sent = discord_api.sent
+                result = await replay.step(
+                    rate, args.seconds, args.drain_timeout)
+                _print_step(result, discord_api.sent - sent)
+                if _saturated(result, args.max_delay):
+                    print(f"Saturated at {rate:.0f} events/s, last "
+                          f"healthy rate: {healthy or 'none'}")
+                    break
+                healthy = f"{rate:.0f} events/s"
+            else:
+                print(f"Not saturated up to {args.rates[-1]:.0f} events/s")
+            print(bot.metrics.report())
+        finally:
+            await close_bot(bot)
+            discord.http.Route.BASE = base
+            await discord_api.stop()
+            await coinbase.stop()
+            await cmc.stop()
+    return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--members", type=int, default=50,
+                        help="members talking in each guild")
+    parser.add_argument("--events", type=int, default=20000,
+                        help="synthetic events to generate and cycle through")
+    parser.add_argument("--rates", type=float, nargs="+",
+                        default=[250, 500, 1000, 2000, 4000, 8000],
+                        help="events per second, one step each")
+    parser.add_argument("--seconds", type=float, default=5.0,
+                        help="how long each step feeds events")
+    parser.add_argument("--max-delay", type=float, default=0.25,
+                        help="p99 wait to start that counts as saturated")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Coinbase and CoinMarketCap stand-in latency")
+    parser.add_argument("--discord-latency", type=float, default=0.02,
+                        help="discord REST stand-in latency")
+    parser.add_argument("--replay", help="file of gateway frames to replay")
+    parser.add_argument("--save", help="write the synthetic frames here")
+    args = parser.parse_args()
+    if args.replay:
+        frames = read_events(args.replay)
+    else:
+        frames = synthetic_events(
+            args.guilds, args.members, args.events, MIX)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            file.writelines(frame + "\n" for frame in frames)
+        print(f"Wrote {len(frames)} events to {args.save}")
+        return
+    # discord.py's Bot runs on the loop that is current when it's built
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run(args, frames))
+    finally:
+        loop.close()
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Replays recorded or synthetic ticks through TickerFeed over a local
+websocket stand-in and reports feed throughput and reconnect behaviour.
+
+Run from the repository root:
+    python -m benchmarks.replay_ticker --ticks 20000 --drop-after 5000
+    python -m benchmarks.replay_ticker --record ticks.jsonl --ticks 500
+    python -m benchmarks.replay_ticker --replay ticks.jsonl
+"""
+import argparse
+import asyncio
+import json
+from time import perf_counter
+import aiohttp
+from benchmarks.stubs import TickerFeedStub, synthetic_ticks
+from cogs.cryptocurrencies._ticker_feed import (
+    DEFAULT_WS_URL,
+    TickerFeed,
+    ticks_to_candles
+)
+
+PRODUCTS = ["BTC-USD", "ETH-USD", "SOL-USD"]
+
+
+class _Logger:
+    def info(self, msg, *args) -> None:
+        return
+
+    def warning(self, msg, *args) -> None:
+        print(f"warning: {msg % args}")
+        return
+
+
+async def record(path: str, count: int) -> None:
+    """Writes count ticker messages from the live Coinbase feed to path."""
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(DEFAULT_WS_URL) as socket:
+            await socket.send_json({"type": "subscribe",
+                                    "product_ids": PRODUCTS,
+                                    "channels": ["ticker"]})
+            with open(path, "w", encoding="utf-8") as file:
+                written = 0
+                async for message in socket:
+                    data = json.loads(message.data)
+                    if data.get("type") == "ticker":
+                        file.write(json.dumps(data) + "\n")
+                        written += 1
+                        if written >= count:
+                            break
+    print(f"recorded {count} ticks to {path}")
+    return
+
+
+async def replay(ticks: list, rate: float, drop_after) -> None:
+    products = sorted({tick["product_id"] for tick in ticks})
+    stub = TickerFeedStub(ticks, rate=rate, drop_after=drop_after)
+    url = await stub.start()
+    session = aiohttp.ClientSession()
+    feed = TickerFeed(products, lambda: session, _Logger(), url=url,
+                      capacity=4096)
+    expected = len(ticks) if drop_after is None else None
+    start = perf_counter()
+    feed.start()
+    # Wait until every tick arrived, or until the stub has gone quiet
+    last_seen, quiet_since = -1, perf_counter()
+    while feed.stats["ticks"] != expected:
+        await asyncio.sleep(0.05)
+        if feed.stats["ticks"] != last_seen:
+            last_seen, quiet_since = feed.stats["ticks"], perf_counter()
+        elif perf_counter() - quiet_since > 3.0:
+            break
+    elapsed = perf_counter() - start
+    await feed.stop()
+    await session.close()
+    await stub.stop()
+
+    lookups = 100000
+    lookup_start = perf_counter()
+    for i in range(lookups):
+        feed.latest_stats(products[i % len(products)])
+    lookup_cost = (perf_counter() - lookup_start) / lookups
+    builds = 1000
+    build_start = perf_counter()
+    for i in range(builds):
+        ticks = feed.buffers[products[i % len(products)]].ticks()
+        ticks_to_candles(ticks, 60)
+    build_cost = (perf_counter() - build_start) / builds
+
+    print(f"ticks received:  {feed.stats['ticks']} of {stub.sent} sent")
+    print(f"throughput:      {feed.stats['ticks'] / elapsed:.0f} ticks/s")
+    print(f"connects:        {feed.stats['connects']} "
+          f"({stub.subscriptions} subscriptions)")
+    print(f"quote lookup:    {lookup_cost * 1e6:.2f} us from memory")
+    print(f"candle build:    {build_cost * 1e6:.0f} us for a full buffer")
+    for product in products:
+        buffer = feed.buffers[product]
+        latest = buffer.latest()
+        print(f"{product:<16} {len(buffer)} buffered, last "
+              f"{latest['price'] if latest is not None else None}")
+    return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=20000,
+                        help="number of synthetic ticks, or ticks to record")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="ticks per second to replay, 0 for unthrottled")
+    parser.add_argument("--drop-after", type=int, default=None,
+                        help="drop the connection after this many ticks")
+    parser.add_argument("--replay", help="jsonl file of recorded ticks")
+    parser.add_argument("--record", help="record live ticks to this file")
+    args = parser.parse_args()
+    if args.record:
+        asyncio.run(record(args.record, args.ticks))
+        return
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as file:
+            ticks = [json.loads(line) for line in file if line.strip()]
+    else:
+        ticks = synthetic_ticks(PRODUCTS, args.ticks)
+    asyncio.run(replay(ticks, args.rate, args.drop_after))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from datetime import datetime
+from aiohttp import web
+
+# Local HTTP stand-ins for the upstream APIs the bot talks to. Every handler
+# sleeps for the configured latency before answering so benchmarks can model
+# a slow exchange without touching the real one.
+
+UNKNOWN_SYMBOLS = {"FAKE", "NOPE"}
+# Products /products lists. Stats and candles answer for any other symbol.
+LISTED_SYMBOLS = ["BTC", "ETH", "USDT", "USDC", "SOL", "ADA", "XRP", "DOGE",
+                  "DOT", "LTC", "LINK", "MATIC"]
+
+
+def _timestamp(value: str) -> int:
+    """Parses the unix or ISO 8601 timestamps Coinbase accepts."""
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+class CoinbaseStub:
+    """Serves /products, /products/{id}/stats and /products/{id}/candles
+    like the Coinbase Exchange REST API. A `tail` fraction of requests
+    takes an extra tail_latency seconds and every request fails with 503
+    while `failing` is set, to model a slow or broken exchange."""
+
+    def __init__(self, latency=0.05, jitter=0.0, tail=0.0, tail_latency=1.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tail = tail
+        self.tail_latency = tail_latency
+        self.failing = False
+        self.requests = 0
+        self.connections = set()
+        self.app = web.Application()
+        self.app.router.add_get("/products", self.products)
+        self.app.router.add_get("/products/{product}/stats", self.stats)
+        self.app.router.add_get("/products/{product}/candles", self.candles)
+        self._runner = None
+        self.url = None
+        return
+
+    async def _delay(self, request) -> None:
+        self.requests += 1
+        self.connections.add(request.transport)
+        delay = self.latency + random.uniform(0, self.jitter)
+        if random.random() < self.tail:
+            delay += self.tail_latency
+        await asyncio.sleep(delay)
+        return
+
+    async def products(self, request):
+        await self._delay(request)
+        if self.failing:
+            return web.json_response({"message": "Unavailable"}, status=503)
+        return web.json_response([{"id": f"{symbol}-USD"}
+                                  for symbol in LISTED_SYMBOLS])
+
+    async def stats(self, request):
+        await self._delay(request)
+        if self.failing:
+            return web.json_response({"message": "Unavailable"}, status=503)
+        product = request.match_info["product"]
+        if product.split("-")[0] in UNKNOWN_SYMBOLS:
+            return web.json_response({"message": "NotFound"}, status=404)
+        price = 100.0 + random.random()
+        return web.json_response({
+            "open": "100.00", "high": f"{price + 1:.2f}",
+            "low": "99.00", "volume": "1234.5", "last": f"{price:.2f}",
+            "volume_30day": "45678.9",
+        })
+
+    async def candles(self, request):
+        await self._delay(request)
+        product = request.match_info["product"]
+        if product.split("-")[0] in UNKNOWN_SYMBOLS:
+            return web.json_response({"message": "NotFound"}, status=404)
+        granularity = int(request.query.get("granularity", 300))
+        end = int(time.time()) // granularity * granularity
+        if "end" in request.query:
+            end = min(end, _timestamp(request.query["end"]))
+            end = end // granularity * granularity
+        start = end - 299 * granularity
+        if "start" in request.query:
+            start = max(start, _timestamp(request.query["start"]))
+        candles = []
+        for t in range(end, start - 1, -granularity):
+            mid = 100.0 + 5.0 * ((t // granularity) % 50) / 50.0
+            candles.append([t, mid - 1.0, mid + 1.0, mid - 0.5, mid + 0.5,
+                            10.0])
+        return web.json_response(candles)
+
+    async def start(self, host="127.0.0.1", port=0) -> str:
+        return await _serve(self, host, port)
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+        return
+
+
+class CoinMarketCapStub:
+    """Serves /v1/cryptocurrency/info like the CoinMarketCap API, including
+    its 400 response when any requested symbol is invalid."""
+
+    def __init__(self, latency=0.05, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/v1/cryptocurrency/info", self.info)
+        self._runner = None
+        self.url = None
+        return
+
+    async def info(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        symbols = request.query.get("symbol", "").upper().split(",")
+        invalid = [s for s in symbols if s in UNKNOWN_SYMBOLS or not s]
+        if invalid:
+            message = f'Invalid value for "symbol": "{",".join(invalid)}"'
+            return web.json_response({"status": {
+                "error_code": 400, "error_message": message}}, status=400)
+        return web.json_response({"data": {s: {
+            "name": s.title(),
+            "slug": s.lower(),
+            "logo": f"https://example.invalid/logos/{s.lower()}.png",
+        } for s in symbols}})
+
+    async def start(self, host="127.0.0.1", port=0) -> str:
+        return await _serve(self, host, port)
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+        return
+
+
+class DiscordApiStub:
+    """Answers the discord REST API calls commands make, under /api/v7 like
+    discord.http.Route.BASE. Sent messages are counted and echoed back as
+    message objects; anything else succeeds with an empty response."""
+
+    def __init__(self, latency=0.0, user_id=1):
+        self.latency = latency
+        self.user = {"id": str(user_id), "username": "Benchmark",
+                     "discriminator": "0001", "avatar": None, "bot": True}
+        self.sent = 0
+        self.requests = 0
+        self._ids = itertools.count(10 ** 18)
+        self.app = web.Application()
+        self.app.router.add_get("/api/v7/users/@me", self.me)
+        self.app.router.add_post(
+            "/api/v7/channels/{channel}/messages", self.send)
+        self.app.router.add_route("*", "/api/v7/{path:.*}", self.other)
+        self._runner = None
+        self.url = None
+        return
+
+    async def _delay(self) -> None:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return
+
+    @staticmethod
+    def _json(data) -> web.Response:
+        # discord.py only decodes an exact "application/json" content type
+        return web.Response(body=json.dumps(data).encode(),
+                            content_type="application/json")
+
+    async def me(self, request):
+        await self._delay()
+        return self._json(self.user)
+
+    async def send(self, request):
+        await self._delay()
+        self.sent += 1
+        content = None
+        if request.content_type == "application/json":
+            content = (await request.json()).get("content")
+        else:
+            await request.read()  # Multipart with files
+        return self._json({
+            "id": str(next(self._ids)),
+            "channel_id": request.match_info["channel"],
+            "author": self.user, "content": content or "",
+            "timestamp": datetime.utcnow().isoformat() + "+00:00",
+            "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [],
+            "attachments": [], "embeds": [], "pinned": False, "type": 0,
+        })
+
+    async def other(self, request):
+        await self._delay()
+        await request.read()
+        return web.Response(status=204)
+
+    async def start(self, host="127.0.0.1", port=0) -> str:
+        return await _serve(self, host, port)
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+        return
+
+
+class TickerFeedStub:
+    """Websocket stand-in for the Coinbase feed. After a subscribe message
+    it replays the given ticker messages for the subscribed products at
+    `rate` messages per second, restamped with the current time. If
+    drop_after is set, the connection is closed after that many messages so
+    clients have to reconnect and resubscribe; the replay then continues
+    where it stopped."""
+
+    def __init__(self, ticks, rate=1000.0, drop_after=None):
+        self.ticks = list(ticks)
+        self.rate = rate
+        self.drop_after = drop_after
+        self.subscriptions = 0
+        self.sent = 0
+        self._cursor = 0
+        self.app = web.Application()
+        self.app.router.add_get("/", self.feed)
+        self._runner = None
+        self.url = None
+        return
+
+    async def feed(self, request):
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        message = await socket.receive_json()
+        self.subscriptions += 1
+        products = set(message.get("product_ids", []))
+        await socket.send_json({"type": "subscriptions", "channels": [
+            {"name": "ticker", "product_ids": sorted(products)}]})
+        sent = 0
+        while self._cursor < len(self.ticks):
+            tick = self.ticks[self._cursor]
+            self._cursor += 1
+            if tick.get("product_id") not in products:
+                continue
+            tick = dict(tick, time=datetime.utcnow().isoformat() + "Z")
+            await socket.send_json(tick)
+            sent += 1
+            self.sent += 1
+            if self.drop_after is not None and sent >= self.drop_after:
+                break
+            if self.rate:
+                await asyncio.sleep(1.0 / self.rate)
+        await socket.close()
+        return socket
+
+    async def start(self, host="127.0.0.1", port=0) -> str:
+        url = await _serve(self, host, port)
+        self.url = url.replace("http://", "ws://") + "/"
+        return self.url
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+        return
+
+
+def synthetic_ticks(products, count: int) -> list:
+    """Returns count ticker messages alternating between products with a
+    random walk price, shaped like the Coinbase ticker channel."""
+    prices = {product: 100.0 for product in products}
+    ticks = list()
+    for i in range(count):
+        product = products[i % len(products)]
+        prices[product] *= 1.0 + random.gauss(0.0, 0.001)
+        price = f"{prices[product]:.2f}"
+        ticks.append({
+            "type": "ticker", "sequence": i, "product_id": product,
+            "price": price, "open_24h": "100.00", "volume_24h": "1234.5",
+            "low_24h": "95.00", "high_24h": "105.00",
+            "volume_30d": "45678.9", "best_bid": price, "best_ask": price,
+            "side": "buy", "trade_id": i, "last_size": "0.01",
+        })
+    return ticks
+
+
+async def _serve(stub, host: str, port: int) -> str:
+    """Starts serving stub.app and returns the base url."""
+    stub._runner = web.AppRunner(stub.app)
+    await stub._runner.setup()
+    site = web.TCPSite(stub._runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    stub.url = f"http://{host}:{port}"
+    return stub.url
@@ -0,0 +1,200 @@
+import asyncio
+import hmac
+import json
+import os
+import aiohttp
+
+# Clustering support for DiscordBot. A cluster is one process running a
+# contiguous range of shards. main.py starts the clusters; ClusterIPC lets
+# them ask each other to run a named handler, e.g. to fan owner commands out
+# to every cluster. Each cluster listens on its own localhost port, base port
+# plus cluster id, and requests are one line of json each way, signed with
+# a secret the launcher hands to every cluster.
+
+GATEWAY_BOT_URL = "https://discord.com/api/v7/gateway/bot"
+# A request or a reply can't be longer than this
+IPC_LINE_LIMIT = 1024 * 1024
+
+
+class IPCError(Exception):
+    """A cluster did not answer, or its handler failed."""
+
+
+def shard_ranges(shard_count: int, clusters: int) -> list:
+    """Splits shards 0 to shard_count - 1 into contiguous ranges, one per
+    cluster, differing in size by one at most."""
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+    ranges = list()
+    start = 0
+    for cluster in range(clusters):
+        end = start + size + (1 if cluster < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def cluster_path(path: str, cluster_id: int, clusters: int) -> str:
+    """Returns path with the cluster id before the extension, e.g.
+    bot-cluster1.log, so clusters don't write each other's files. Left
+    alone without clustering."""
+    if clusters <= 1:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-cluster{cluster_id}{extension}"
+
+
+async def recommended_shards(token: str) -> tuple:
+    """Asks discord how many shards the bot should run. Returns (shards,
+    max_concurrency), the latter being how many shards may identify at
+    once every 5 seconds."""
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async with session.get(GATEWAY_BOT_URL) as response:
+            response.raise_for_status()
+            data = await response.json()
+    limit = data.get("session_start_limit", dict())
+    return data["shards"], limit.get("max_concurrency", 1)
+
+
+class ClusterIPC:
+    """Runs named handlers on every cluster and collects the replies.
+
+    Handlers are coroutine functions taking json values and returning one.
+    Cogs register theirs when loaded and unregister them when unloaded. A
+    request to this cluster calls the handler directly, so everything works
+    the same in a single process, where no server is started."""
+
+    def __init__(self, cluster_id: int, clusters: int, logger, port=None,
+                 secret=None, host="127.0.0.1", timeout=30.0):
+        self.cluster_id = cluster_id
+        self.clusters = clusters
+        self.logger = logger
+        self.port = port
+        self.secret = secret or ""
+        self.host = host
+        self.timeout = timeout
+        # name -> handler
+        self.handlers = dict()
+        self._server = None
+        self.stats = {
+            "served": 0,
+            "sent": 0,
+            "failed": 0,
+            "rejected": 0,
+        }
+        return
+
+    def register(self, name: str, handler) -> None:
+        self.handlers[name] = handler
+        return
+
+    def unregister(self, name: str) -> None:
+        self.handlers.pop(name, None)
+        return
+
+    async def start(self) -> None:
+        """Starts answering the other clusters, if there are any."""
+        if self.clusters > 1 and self._server is None:
+            if self.port is None:
+                raise IPCError("Clustering needs an IPC port.")
+            self._server = await asyncio.start_server(
+                self._serve, self.host, self.port + self.cluster_id,
+                limit=IPC_LINE_LIMIT)
+            self.logger.info("Cluster %d answering IPC on port %d.",
+                             self.cluster_id, self.port + self.cluster_id)
+        return
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        return
+
+    async def _run(self, name: str, args: list):
+        handler = self.handlers.get(name)
+        if handler is None:
+            raise IPCError(f"No IPC handler named {name}.")
+        return await handler(*args)
+
+    async def _serve(self, reader, writer) -> None:
+        try:
+            request = json.loads(await reader.readline())
+            if not hmac.compare_digest(
+                    str(request.get("secret", "")), self.secret):
+                self.stats["rejected"] += 1
+                self.logger.warning("Rejected an unsigned IPC request.")
+                return
+            self.stats["served"] += 1
+            try:
+                reply = {"result": await self._run(
+                    request["name"], request.get("args", []))}
+            except IPCError as e:
+                reply = {"error": f"{e}"}
+            except Exception as e:
+                self.logger.exception("IPC handler %s failed.",
+                                      request.get("name"))
+                reply = {"error": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+        except (ValueError, KeyError, ConnectionError) as e:
+            self.logger.warning("Bad IPC request: %r", e)
+        finally:
+            writer.close()
+        return
+
+    async def request(self, cluster_id: int, name: str, *args):
+        """Runs handler name on a cluster and returns its result. Raises
+        IPCError if the cluster doesn't answer or the handler fails."""
+        if cluster_id == self.cluster_id:
+            return await self._run(name, list(args))
+        self.stats["sent"] += 1
+        try:
+            return await asyncio.wait_for(
+                self._send(cluster_id, name, list(args)), self.timeout)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            self.stats["failed"] += 1
+            raise IPCError(f"Cluster {cluster_id} did not answer: "
+                           f"{type(e).__name__}") from e
+        except IPCError:
+            self.stats["failed"] += 1
+            raise
+
+    async def _send(self, cluster_id: int, name: str, args: list):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port + cluster_id, limit=IPC_LINE_LIMIT)
+        try:
+            writer.write(json.dumps({"secret": self.secret, "name": name,
+                                     "args": args}).encode() + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+        finally:
+            writer.close()
+        if not line:
+            raise IPCError(f"Cluster {cluster_id} closed the connection.")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise IPCError(f"Cluster {cluster_id}: {reply['error']}")
+        return reply["result"]
+
+    async def broadcast(self, name: str, *args) -> dict:
+        """Runs handler name on every cluster at once. Returns cluster id ->
+        result, or the IPCError of clusters that failed."""
+        async def one(cluster_id):
+            try:
+                return await self.request(cluster_id, name, *args)
+            except IPCError as e:
+                return e
+            except Exception as e:  # A local handler failed
+                return IPCError(f"Cluster {cluster_id}: "
+                                f"{type(e).__name__}: {e}")
+
+        results = await asyncio.gather(
+            *(one(cluster_id) for cluster_id in range(self.clusters)))
+        return dict(enumerate(results))
+
+    def report(self) -> str:
+        """Returns a one line summary of the IPC counters."""
+        return (f"cluster {self.cluster_id + 1}/{self.clusters}, "
+                + ", ".join(f"{k}={v}" for k, v in self.stats.items()))
@@ -0,0 +1,26 @@
+import importlib.util
+import sys
+
+# Deferred imports for heavy libraries. lazy_import hands back a module object
+# right away but only executes the module the first time one of its attributes
+# is used, so loading a cog doesn't pay for libraries that only a few of its
+# commands need. Like the other underscore modules in cogs, this is a helper
+# and is skipped by the extension loader.
+
+
+def lazy_import(name: str):
+    """Returns the module called name, executing it on first attribute
+    access. Modules that are already imported are returned as they are.
+    Raises ModuleNotFoundError right away if the module doesn't exist."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,192 @@
+import cProfile
+import io
+import linecache
+import marshal
+import os
+import pstats
+import sys
+import sysconfig
+import threading
+import tracemalloc
+from collections import Counter
+
+# Profilers behind DevCmd's $profile and $memory commands. They run inside the
+# live bot, so the numbers come from real traffic, and each returns plain text
+# ready to be attached to a message.
+
+_STDLIB = sysconfig.get_paths()["stdlib"]
+
+
+def _where(filename: str, lineno: int, name=None) -> str:
+    """Formats a code location with the path shortened to the bot's tree or
+    the part after site-packages."""
+    marker = f"site-packages{os.sep}"
+    if marker in filename:
+        filename = filename.split(marker, 1)[1]
+    elif filename.startswith(_STDLIB):
+        filename = os.path.relpath(filename, _STDLIB)
+    elif filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    if name is None:
+        return f"{filename}:{lineno}"
+    return f"{name} ({filename}:{lineno})"
+
+
+class StackSampler:
+    """Samples the stack of one thread, normally the event loop's, from a
+    background thread every interval seconds. Cheap enough to leave on for
+    minutes: the profiled thread only pays for the GIL hand over."""
+
+    def __init__(self, thread_id: int, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        # Stack as a tuple of locations, outermost first -> samples
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        return
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_where(
+                    code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+        return
+
+    def report(self, top=30) -> str:
+        """Returns the functions the thread was in most often, by samples
+        spent in the function itself and anywhere below it."""
+        own = Counter()
+        total = Counter()
+        idle = 0
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for location in set(stack):
+                total[location] += count
+            if "selectors.py" in stack[-1]:
+                idle += count  # Waiting for events, the loop had no work
+        samples = max(1, self.samples)
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f} "
+                 f"ms, {idle / samples:.0%} idle in select()", ""]
+        for title, counter in (("Own time", own), ("Total time", total)):
+            lines.append(f"{title:<10} Location")
+            for location, count in counter.most_common(top):
+                lines.append(f"{count / samples:>9.1%}  {location}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def collapsed(self) -> str:
+        """Returns the stacks in the collapsed format flame graph tools
+        read, one "outer;inner count" line per stack."""
+        return "\n".join(f"{';'.join(stack)} {count}"
+                         for stack, count in self.stacks.most_common()) + "\n"
+
+
+class CallProfiler:
+    """cProfile around whatever runs on the thread that starts it. Every
+    call is counted, which makes it precise but slows that thread down
+    noticeably while it runs."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        return
+
+    def start(self) -> None:
+        self.profile.enable()
+        return
+
+    def stop(self) -> None:
+        self.profile.disable()
+        return
+
+    def report(self, top=30) -> str:
+        """Returns the top functions by cumulative and by own time."""
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.strip_dirs()
+        for key in ("cumulative", "tottime"):
+            stats.sort_stats(key).print_stats(top)
+        return stream.getvalue()
+
+    def dump(self) -> bytes:
+        """Returns the raw stats in the marshal format pstats, snakeviz and
+        friends load."""
+        # What Profile.dump_stats() writes, without the file
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+class MemoryTracker:
+    """Takes tracemalloc snapshots and reports what grew since the first
+    one. tracemalloc slows allocations down while it traces, so it only
+    runs between start() and stop()."""
+
+    def __init__(self):
+        self.baseline = None
+        return
+
+    @property
+    def running(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=10) -> None:
+        """Starts tracing and takes the baseline snapshot. Blocking."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = self._snapshot()
+        return
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        # The profiler's own allocations are not what we are looking for
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    def diff(self, top=25) -> str:
+        """Returns the allocation sites that grew most since the baseline,
+        with the stack that led to the largest ones. Blocking."""
+        snapshot = self._snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced: {current / 2 ** 20:.1f} MiB now, "
+                 f"{peak / 2 ** 20:.1f} MiB peak", ""]
+        by_line = snapshot.compare_to(self.baseline, "lineno")
+        lines.append(f"{'Growth':>12} {'Blocks':>8}  Location")
+        for stat in by_line[:top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:>9.1f} KiB "
+                         f"{stat.count_diff:>+8}  "
+                         f"{_where(frame.filename, frame.lineno)}")
+        lines.append("")
+        for stat in snapshot.compare_to(self.baseline, "traceback")[:5]:
+            lines.append(f"{stat.size_diff / 1024:.1f} KiB from:")
+            lines += [f"    {line}" for line in stat.traceback.format()]
+            lines.append("")
+        return "\n".join(lines)
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self.baseline = None
+        return
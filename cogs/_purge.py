@@ -0,0 +1,218 @@
+import asyncio
+import datetime
+import re
+from time import monotonic
+import discord
+
+# Streaming purge engine behind AdminCmd's $purge. Messages are read newest
+# first and deleted as they are found: in bulk requests of up to 100 while
+# they are young enough for discord's bulk delete, then one at a time, paced,
+# once the scan reaches messages older than 14 days.
+
+# Most messages discord deletes in one bulk request
+BULK_SIZE = 100
+# Discord refuses to bulk delete messages older than 14 days. The margin
+# covers clock skew and the time a batch waits to fill up.
+BULK_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=10)
+# Seconds between single deletes, which share a tight per-channel rate limit
+SINGLE_DELETE_SECONDS = 1.0
+# Messages read at most unless the command asks for another budget
+SCAN_BUDGET = 5000
+# Seconds between progress updates
+PROGRESS_SECONDS = 3.0
+# Suffixes of the durations purge options take
+_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days",
+          "w": "weeks"}
+
+
+def parse_duration(text: str) -> datetime.timedelta:
+    """Parses durations like 45s, 30m, 12h, 7d or 2w."""
+    match = re.fullmatch(r"(\d+)([smhdw])", text.strip().lower())
+    if match is None:
+        raise ValueError(f"{text} is not a duration like 30m, 12h or 7d.")
+    return datetime.timedelta(**{_UNITS[match[2]]: int(match[1])})
+
+
+class PurgeFilter:
+    """Which messages a purge deletes. Every given condition must hold:
+    the author, a regex searched in the content, having attachments and
+    being sent within the after and before datetimes, in UTC."""
+
+    def __init__(self, author=None, pattern=None, attachments=False,
+                 after=None, before=None):
+        self.author = author
+        self.pattern = pattern
+        self.attachments = attachments
+        self.after = after
+        self.before = before
+        return
+
+    @classmethod
+    def from_options(cls, author, options) -> tuple:
+        """Builds a filter from the words after $purge's limit and returns
+        (filter, scan budget). Words are contains=<regex>, files,
+        after=<duration>, before=<duration> and scan=<messages>, durations
+        counting back from now. Raises ValueError for anything else."""
+        now = datetime.datetime.utcnow()
+        purge_filter = cls(author)
+        budget = SCAN_BUDGET
+        for option in options:
+            name, _, value = option.partition("=")
+            name = name.lower()
+            if name == "files" and not value:
+                purge_filter.attachments = True
+            elif name == "contains" and value:
+                try:
+                    purge_filter.pattern = re.compile(value, re.IGNORECASE)
+                except re.error as e:
+                    raise ValueError(f"Bad regex {value}: {e}") from e
+            elif name == "after" and value:
+                purge_filter.after = now - parse_duration(value)
+            elif name == "before" and value:
+                purge_filter.before = now - parse_duration(value)
+            elif name == "scan" and value.isdigit() and int(value) > 0:
+                budget = int(value)
+            else:
+                raise ValueError(f"Unknown purge option {option}.")
+        return purge_filter, budget
+
+    def matches(self, message) -> bool:
+        if self.author is not None and message.author != self.author:
+            return False
+        if self.attachments and not message.attachments:
+            return False
+        if self.pattern is not None and \
+                not self.pattern.search(message.content or ""):
+            return False
+        if self.after is not None and message.created_at <= self.after:
+            return False
+        if self.before is not None and message.created_at >= self.before:
+            return False
+        return True
+
+
+class Purger:
+    """Deletes up to `limit` messages of a channel that match a filter,
+    reading at most `budget` messages older than `start`.
+
+    `progress` is awaited with the stats every PROGRESS_SECONDS while the
+    purge runs. discord.Forbidden ends the purge and is raised to the
+    caller, the stats still telling what was deleted before it."""
+
+    def __init__(self, channel, purge_filter: PurgeFilter, limit: int,
+                 budget=SCAN_BUDGET, start=None, progress=None, logger=None,
+                 single_delete_seconds=SINGLE_DELETE_SECONDS):
+        self.channel = channel
+        self.filter = purge_filter
+        self.limit = limit
+        self.budget = budget
+        self.start = start
+        self.progress = progress
+        self.logger = logger
+        self.single_delete_seconds = single_delete_seconds
+        self._next_single = 0.0
+        self._next_progress = monotonic() + PROGRESS_SECONDS
+        self.stats = {
+            "scanned": 0,
+            "matched": 0,
+            "deleted": 0,
+            "bulk_requests": 0,
+            "single_requests": 0,
+            "failed": 0,
+        }
+        return
+
+    @property
+    def budget_spent(self) -> bool:
+        """Whether the purge stopped because it read `budget` messages."""
+        return self.stats["scanned"] >= self.budget and \
+            self.stats["matched"] < self.limit
+
+    async def run(self) -> dict:
+        """Purges and returns the stats."""
+        batch = list()
+        # The time window is also handed to discord, so the scan skips
+        # what lies outside it instead of reading it
+        before = self.filter.before or self.start
+        history = self.channel.history(
+            limit=self.budget, before=before, after=self.filter.after,
+            oldest_first=False)
+        async for message in history:
+            self.stats["scanned"] += 1
+            if self.filter.matches(message):
+                self.stats["matched"] += 1
+                cutoff = datetime.datetime.utcnow() - BULK_MAX_AGE
+                if message.created_at > cutoff:
+                    batch.append(message)
+                    if len(batch) == BULK_SIZE:
+                        await self.__delete_bulk(batch)
+                        batch = list()
+                else:
+                    # History is newest first, so the batch is flushed
+                    # before any old message and all later ones are old
+                    await self.__delete_bulk(batch)
+                    batch = list()
+                    await self.__delete_single(message)
+                if self.stats["matched"] >= self.limit:
+                    break
+            await self.__report_progress()
+        await self.__delete_bulk(batch)
+        return self.stats
+
+    async def __delete_bulk(self, messages: list) -> None:
+        """Deletes up to BULK_SIZE young messages in one request, or one by
+        one if discord refuses the batch."""
+        if len(messages) < 2:
+            for message in messages:
+                await self.__delete_single(message)
+            return
+        self.stats["bulk_requests"] += 1
+        try:
+            await self.channel.delete_messages(messages)
+        except discord.Forbidden:
+            raise
+        except discord.HTTPException as e:
+            if self.logger is not None:
+                self.logger.warning("Bulk delete of %s messages failed, "
+                                    "deleting them one by one: %s",
+                                    len(messages), e)
+            for message in messages:
+                await self.__delete_single(message)
+            return
+        self.stats["deleted"] += len(messages)
+        return
+
+    async def __delete_single(self, message) -> None:
+        """Deletes one message, at most one every single_delete_seconds.
+        Messages someone else deleted meanwhile don't count."""
+        wait = self._next_single - monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._next_single = monotonic() + self.single_delete_seconds
+        self.stats["single_requests"] += 1
+        try:
+            await message.delete()
+        except discord.NotFound:
+            return
+        except discord.Forbidden:
+            raise
+        except discord.HTTPException as e:
+            self.stats["failed"] += 1
+            if self.logger is not None:
+                self.logger.warning("Could not delete message %s: %s",
+                                    message.id, e)
+            return
+        self.stats["deleted"] += 1
+        await self.__report_progress()
+        return
+
+    async def __report_progress(self) -> None:
+        if self.progress is None or monotonic() < self._next_progress:
+            return
+        self._next_progress = monotonic() + PROGRESS_SECONDS
+        await self.progress(self.stats)
+        return
+
+    def report(self) -> str:
+        """Returns a one line summary of the purge counters."""
+        return ", ".join(f"{k}={v}" for k, v in self.stats.items())
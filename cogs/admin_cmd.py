@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands
 import logging
 import typing
+from cogs._purge import PurgeFilter, Purger
 
 
 # Contains commands useful to server administration
@@ -34,35 +35,47 @@ class AdminCmd(commands.Cog):
 
     @commands.command()
     @commands.has_permissions(manage_messages = True)
-    async def purge(self,ctx,target: typing.Optional[discord.Member] = None, limit: int = 0):
+    async def purge(self, ctx, target: typing.Optional[discord.Member] = None,
+                    limit: int = 0, *options):
         """
         target: The member who's messages you want to delete (optional)
-        limit: the amount of messages to search through
+        limit: the amount of messages to delete
+        options: contains=<regex>, files (only messages with attachments),
+        after=<duration> and before=<duration> (like 30m, 12h or 7d ago)
+        and scan=<n> (messages to search through, 5000 by default)
         """
+        try:
+            purge_filter, budget = PurgeFilter.from_options(target, options)
+        except ValueError as e:
+            return await ctx.send(f"{e}", delete_after=5)
+        if limit <= 0:
+            return await ctx.send("You did not specify the amount.", delete_after=5)
+        status = None
         try:
             # Delete the message that calls this command
             await ctx.message.delete()
+            status = await ctx.send("Purging...")
 
-            msg = []
-            channel = ctx.channel
+            async def progress(stats):
+                try:
+                    await status.edit(content=f"Purging... deleted "
+                                              f"{stats['deleted']} of "
+                                              f"{stats['scanned']} scanned.")
+                except discord.HTTPException:
+                    pass
 
-            if target == None:
-                await ctx.channel.purge(limit=limit)
-                return await ctx.send(f"Purged {limit} messages", delete_after=3)
-            
-            if limit == 0: 
-                return await ctx.send("You did not specify the amount.", delete_after=5)
-            
-            async for m in channel.history():
-                if len(msg) == limit:
-                    # End of loop condition
-                    break
-                if m.author == target:
-                    # Keep adding messages authored by this member until end of loop condition
-                    msg.append(m)
-            await ctx.channel.delete_messages(msg)
-            await ctx.send(f"Deleted {limit} message(s) of {target.mention}", delete_after=3)
-            #TODO logger.debug("Successfully deleted {} message(s) from {}".format(len(deleted),target)
+            purger = Purger(ctx.channel, purge_filter, limit, budget,
+                            start=ctx.message, progress=progress,
+                            logger=self.bot)
+            await purger.run()
+            self.bot.info("Purged #%s for %s: %s", ctx.channel, ctx.author,
+                          purger.report())
+            whose = f" of {target.mention}" if target is not None else ""
+            note = " Stopped at the scan budget." if purger.budget_spent else ""
+            await status.edit(content=f"Deleted {purger.stats['deleted']} "
+                                      f"message(s){whose} after scanning "
+                                      f"{purger.stats['scanned']}.{note}",
+                              delete_after=5)
         except discord.Forbidden as Forbidden:
             await ctx.send("You do not have permissions to do the actions required.")
         except discord.HTTPException as HTTPException:
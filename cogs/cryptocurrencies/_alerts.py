@@ -0,0 +1,197 @@
+from bisect import bisect_left, bisect_right
+
+# Price alert engine. Alerts are kept in sorted per-product ladders so a new
+# price only touches the alerts it crosses: finding them is a binary search
+# and removing them is a slice off the end of a list, however many alerts are
+# waiting on the same product.
+
+# Alert kinds. Thresholds are prices for ABOVE and BELOW and fractions
+# (0.05 for 5%) for UP and DOWN, which compare against the price `window`
+# seconds earlier.
+ABOVE = "above"
+BELOW = "below"
+UP = "up"
+DOWN = "down"
+KINDS = (ABOVE, BELOW, UP, DOWN)
+
+
+class _Ladder:
+    """Alert ids sorted by key. pop_from(key) removes and returns every id
+    whose key is >= key, which always sit at the end of the lists."""
+    __slots__ = ("keys", "ids")
+
+    def __init__(self):
+        self.keys = list()
+        self.ids = list()
+        return
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, key: float, alert_id: int) -> None:
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.ids.insert(index, alert_id)
+        return
+
+    def remove(self, key: float, alert_id: int) -> bool:
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.ids[index] == alert_id:
+                del self.keys[index]
+                del self.ids[index]
+                return True
+            index += 1
+        return False
+
+    def pop_from(self, key: float) -> list:
+        index = bisect_left(self.keys, key)
+        if index == len(self.keys):
+            return []
+        triggered = self.ids[index:]
+        del self.keys[index:]
+        del self.ids[index:]
+        return triggered
+
+
+class _History:
+    """Recent prices of one product, at most one sample per `resolution`
+    seconds, for looking up the price some window ago."""
+    __slots__ = ("times", "prices", "start", "resolution")
+
+    def __init__(self, resolution=1.0):
+        self.times = list()
+        self.prices = list()
+        self.start = 0
+        self.resolution = resolution
+        return
+
+    def add(self, timestamp: float, price: float, keep: float) -> None:
+        if self.times and timestamp - self.times[-1] < self.resolution:
+            self.prices[-1] = price
+        else:
+            self.times.append(timestamp)
+            self.prices.append(price)
+        # Forget samples older than the longest window, compacting the lists
+        # only once the dead prefix is as long as the live part.
+        self.start = bisect_left(self.times, timestamp - keep, self.start)
+        self.start = min(self.start, len(self.times) - 1)
+        if self.start > len(self.times) // 2:
+            del self.times[:self.start]
+            del self.prices[:self.start]
+            self.start = 0
+        return
+
+    def price_at(self, timestamp: float) -> float:
+        """Returns the first price sampled at or after timestamp, or the
+        oldest price known if the history doesn't reach back that far."""
+        index = bisect_left(self.times, timestamp, self.start)
+        return self.prices[min(index, len(self.prices) - 1)]
+
+
+class AlertEngine:
+    """Holds every alert and evaluates new prices against them."""
+
+    def __init__(self, id_step=1, id_offset=0):
+        # alert id -> alert dict with at least product, kind, value, window
+        self.alerts = dict()
+        # product -> {(kind, window): _Ladder}
+        self._ladders = dict()
+        # product -> _History, only for products with UP or DOWN alerts
+        self._history = dict()
+        # New ids are id_offset modulo id_step, so engines in different
+        # processes sharing the saved alerts never hand out the same id
+        self.id_step = id_step
+        self.id_offset = id_offset
+        self._next_id = 1
+        self.stats = {"ticks": 0, "triggered": 0}
+        return
+
+    def __len__(self) -> int:
+        return len(self.alerts)
+
+    @staticmethod
+    def _key(alert: dict) -> float:
+        """Ladder key for an alert. pop_from(x) on the ladder triggers the
+        alert exactly when its condition holds for x (see evaluate)."""
+        if alert["kind"] == BELOW:
+            return alert["value"]
+        return -alert["value"]
+
+    def add(self, alert: dict) -> dict:
+        """Registers an alert, assigning it an id unless it already has one
+        (as when reloading saved alerts), and returns it."""
+        if "id" not in alert:
+            alert["id"] = self._next_id + \
+                (self.id_offset - self._next_id) % self.id_step
+        self.reserve(alert["id"])
+        window = alert.get("window") or 0
+        alert["window"] = window
+        self.alerts[alert["id"]] = alert
+        ladders = self._ladders.setdefault(alert["product"], dict())
+        ladder = ladders.setdefault((alert["kind"], window), _Ladder())
+        ladder.add(self._key(alert), alert["id"])
+        if window and alert["product"] not in self._history:
+            self._history[alert["product"]] = _History()
+        return alert
+
+    def reserve(self, alert_id: int) -> None:
+        """Makes sure new alerts get ids above alert_id, for saved alerts
+        this engine doesn't hold."""
+        self._next_id = max(self._next_id, alert_id + 1)
+        return
+
+    def remove(self, alert_id: int):
+        """Removes and returns an alert, or None if there is no such id."""
+        alert = self.alerts.pop(alert_id, None)
+        if alert is None:
+            return None
+        ladders = self._ladders.get(alert["product"], dict())
+        ladder = ladders.get((alert["kind"], alert["window"]))
+        if ladder is not None:
+            ladder.remove(self._key(alert), alert_id)
+            if not len(ladder):
+                del ladders[(alert["kind"], alert["window"])]
+        if not ladders:
+            self._ladders.pop(alert["product"], None)
+            self._history.pop(alert["product"], None)
+        return alert
+
+    def products(self) -> list:
+        """Returns every product some alert is waiting on."""
+        return list(self._ladders)
+
+    def evaluate(self, product: str, price: float, timestamp: float) -> list:
+        """Feeds a new price and returns the alerts it triggered, which are
+        removed from the engine."""
+        ladders = self._ladders.get(product)
+        if not ladders:
+            return []
+        self.stats["ticks"] += 1
+        history = self._history.get(product)
+        if history is not None:
+            longest = max(window for _, window in ladders)
+            history.add(timestamp, price, longest)
+        triggered = list()
+        for (kind, window), ladder in list(ladders.items()):
+            if kind == ABOVE:  # key -value >= -price  <=>  value <= price
+                ids = ladder.pop_from(-price)
+            elif kind == BELOW:  # key value >= price
+                ids = ladder.pop_from(price)
+            else:
+                reference = history.price_at(timestamp - window)
+                change = price / reference - 1.0 if reference else 0.0
+                if kind == UP:  # key -value >= -change  <=>  value <= change
+                    ids = ladder.pop_from(-change)
+                else:  # key -value >= change  <=>  value <= -change
+                    ids = ladder.pop_from(change)
+            if not ids:
+                continue
+            if not len(ladder):
+                del ladders[(kind, window)]
+            triggered.extend(self.alerts.pop(alert_id) for alert_id in ids)
+        if not ladders:
+            del self._ladders[product]
+            self._history.pop(product, None)
+        self.stats["triggered"] += len(triggered)
+        return triggered
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+# On-disk candle store. Each product and granularity gets one file of fixed
+# width little-endian records sorted by time, which np.memmap can map straight
+# into a structured array. Only closed candles are written; the candle still
+# forming is fetched on every request and returned alongside them, unless a
+# live source like the ticker feed can build the newest candles instead.
+
+CANDLE_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("low", "<f8"),
+    ("high", "<f8"),
+    ("open", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+# Coinbase returns at most this many candles per request
+PAGE_SIZE = 300
+
+
+class UnknownProduct(Exception):
+    """Raised when Coinbase doesn't know the requested product."""
+
+
+def _iso(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _to_array(rows) -> np.ndarray:
+    """Converts Coinbase candle lists into a structured array."""
+    array = np.empty(len(rows), dtype=CANDLE_DTYPE)
+    if rows:
+        columns = np.asarray(rows, dtype=np.float64)
+        for index, name in enumerate(CANDLE_DTYPE.names):
+            array[name] = columns[:, index]
+    return array
+
+
+class CandleStore:
+    """Serves candles for any time range, downloading only the ranges that
+    are not on disk yet. Missing ranges are split into pages of PAGE_SIZE
+    candles and fetched concurrently. Each file holds one run of candles
+    without holes, so only its ends ever need filling.
+
+    recent(product, granularity, since), if given, returns the candles from
+    since until now built from live data, or None if it can't vouch for
+    all of them. They answer for the newest gap instead of Coinbase and are
+    never stored."""
+
+    def __init__(self, client, directory, logger, max_concurrency=4,
+                 recent=None):
+        self.client = client
+        self.directory = directory
+        self.logger = logger
+        self.recent = recent
+        self._fetch_slots = asyncio.Semaphore(max_concurrency)
+        # (product, granularity) -> lock serializing updates of its file
+        self._locks = dict()
+        # (product, granularity) -> time before which coinbase has no data
+        self._floors = dict()
+        self.stats = {"requests": 0, "candles_fetched": 0, "reads": 0,
+                      "resets": 0, "live_tails": 0}
+        return
+
+    def path(self, product: str, granularity: int) -> str:
+        return os.path.join(self.directory, f"{product}_{granularity}.bin")
+
+    def _map(self, product: str, granularity: int) -> np.ndarray:
+        """Memory-maps the stored candles, or returns an empty array."""
+        path = self.path(product, granularity)
+        try:
+            if os.path.getsize(path) < CANDLE_DTYPE.itemsize:
+                return np.empty(0, dtype=CANDLE_DTYPE)
+        except OSError:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return np.memmap(path, dtype=CANDLE_DTYPE, mode="r")
+
+    def read(self, product: str, granularity: int, start: int,
+             end: int) -> np.ndarray:
+        """Returns a copy of the stored candles with start <= time <= end
+        without touching the network."""
+        self.stats["reads"] += 1
+        candles = self._map(product, granularity)
+        first = np.searchsorted(candles["time"], start, "left")
+        last = np.searchsorted(candles["time"], end, "right")
+        result = np.array(candles[first:last])
+        del candles  # Drop the map so the file can be replaced
+        return result
+
+    def _write(self, product: str, granularity: int, new: np.ndarray,
+               append: bool) -> None:
+        """Appends sorted records after the stored ones, or rewrites the file
+        atomically when records land before the stored ones."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(product, granularity)
+        if append:
+            with open(path, "ab") as file:
+                file.write(new.tobytes())
+            return
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(new.tobytes())
+        os.replace(temp_path, path)
+        return
+
+    async def get(self, product: str, granularity: int, start: int,
+                  end=None) -> np.ndarray:
+        """Returns candles with start <= time <= end sorted by time. The
+        newest candle may still be forming and is never stored."""
+        now = int(time.time())
+        end = now if end is None else min(end, now)
+        start = start // granularity * granularity
+        end = end // granularity * granularity
+        key = (product, granularity)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            stored = self._map(product, granularity)
+            times = stored["time"]
+            floor = max(start, self._floors.get(key, start))
+            # A window that doesn't touch the stored candles, e.g. after
+            # the bot was idle, replaces them. Filling the space between
+            # would download far more than the window asks for.
+            reset = bool(len(times)) and (floor > times[-1] + granularity
+                                    or end < times[0] - granularity)
+            gaps = list()
+            if not len(times) or reset:
+                gaps.append((floor, end))
+            else:
+                if floor < times[0]:
+                    gaps.append((floor, int(times[0]) - granularity))
+                if end > times[-1]:
+                    gaps.append((int(times[-1]) + granularity, end))
+            live = None
+            if self.recent is not None and gaps and gaps[-1][1] == end:
+                live = self.recent(product, granularity, gaps[-1][0])
+                if live is not None:
+                    gaps.pop()
+                    self.stats["live_tails"] += 1
+            fetched = await self._fetch_gaps(product, granularity, gaps)
+            # The current candle is still open, keep it out of the file
+            current = now // granularity * granularity
+            closed = fetched[fetched["time"] < current]
+            forming = fetched[fetched["time"] >= current]
+            if len(closed):
+                if reset:
+                    self.stats["resets"] += 1
+                    merged, append = closed, False
+                elif not len(times) or closed["time"][0] > times[-1]:
+                    merged, append = closed, True
+                else:
+                    append = False
+                    merged = np.concatenate([closed, np.array(stored)])
+                    merged = merged[np.unique(
+                        merged["time"], return_index=True)[1]]
+                del stored, times  # Drop the map before rewriting the file
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(
+                    None, self._write, product, granularity, merged, append)
+            else:
+                del stored, times
+            result = self.read(product, granularity, start, end)
+        if live is not None:
+            result = np.concatenate([result, live])
+        elif len(forming):
+            result = np.concatenate([result, forming[-1:]])
+        return result
+
+    async def _fetch_gaps(self, product: str, granularity: int,
+                          gaps: list) -> np.ndarray:
+        """Downloads every gap in PAGE_SIZE pages concurrently and returns
+        the candles sorted by time without duplicates."""
+        span = (PAGE_SIZE - 1) * granularity
+        pages = [(page_start, min(page_start + span, gap_end))
+                 for gap_start, gap_end in gaps if gap_start <= gap_end
+                 for page_start in range(gap_start, gap_end + 1, span + 1)]
+        if not pages:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        results = await asyncio.gather(*(
+            self._fetch_page(product, granularity, page_start, page_end)
+            for page_start, page_end in pages))
+        # Pages are in time order. If the oldest one is empty, coinbase has
+        # no data that old and the range need not be asked for again.
+        oldest_end = pages[0][1]
+        if not len(results[0]) and oldest_end < time.time() - granularity:
+            key = (product, granularity)
+            self._floors[key] = max(
+                self._floors.get(key, 0), oldest_end + granularity)
+        candles = np.concatenate(results)
+        self.stats["candles_fetched"] += len(candles)
+        return candles[np.unique(candles["time"], return_index=True)[1]]
+
+    async def _fetch_page(self, product: str, granularity: int, start: int,
+                          end: int) -> np.ndarray:
+        async with self._fetch_slots:
+            self.stats["requests"] += 1
+            rows = await self.client.get_product_historic_rates(
+                product, start=_iso(start), end=_iso(end),
+                granularity=granularity)
+        if isinstance(rows, dict):
+            raise UnknownProduct(rows.get("message", product))
+        return _to_array(rows)
+
+    def report(self) -> str:
+        """Returns a one line summary of the store counters."""
+        counters = ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        return f"{len(self._locks)} series, {counters}"
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+# LRU cache of rendered chart pngs, bounded by the total size of the images.
+# Keys are (product, granularity, candle bucket) so a cached chart expires
+# naturally once a new candle starts.
+
+
+class CachedChart:
+    """A rendered png and, once it has been uploaded, its attachment url."""
+    __slots__ = ("png", "url")
+
+    def __init__(self, png: bytes):
+        self.png = png
+        self.url = None
+        return
+
+
+class ChartCache:
+    """Keeps the most recently used charts until max_bytes is reached."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._charts = OrderedDict()
+        self.stats = {"hits": 0, "url_hits": 0, "misses": 0, "evictions": 0}
+        return
+
+    def get(self, key):
+        """Returns the CachedChart for key, or None."""
+        chart = self._charts.get(key)
+        if chart is None:
+            self.stats["misses"] += 1
+            return None
+        self._charts.move_to_end(key)
+        self.stats["url_hits" if chart.url else "hits"] += 1
+        return chart
+
+    def put(self, key, png: bytes) -> CachedChart:
+        """Stores a freshly rendered png, evicting the least recently used
+        charts until the cache fits in max_bytes again."""
+        old = self._charts.pop(key, None)
+        if old is not None:
+            self.size -= len(old.png)
+        chart = CachedChart(png)
+        if len(png) > self.max_bytes:
+            return chart  # Too big to ever fit, don't flush everything else
+        self._charts[key] = chart
+        self.size += len(png)
+        while self.size > self.max_bytes:
+            _, evicted = self._charts.popitem(last=False)
+            self.size -= len(evicted.png)
+            self.stats["evictions"] += 1
+        return chart
+
+    def report(self) -> str:
+        """Returns a one line summary of the cache counters."""
+        counters = ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        return (f"{len(self._charts)} charts, {self.size / 1024:.0f} KiB of "
+                f"{self.max_bytes / 1024:.0f} KiB, {counters}")
@@ -0,0 +1,157 @@
+import asyncio
+import random
+from time import perf_counter
+import aiohttp
+from cogs.cryptocurrencies._resilience import (
+    CircuitBreaker,
+    CircuitOpen,
+    LatencyTracker,
+    Upstream
+)
+
+# Async Coinbase Exchange client used by the crypto cogs. Module names starting
+# with an underscore are helpers and are skipped by the extension loader.
+
+DEFAULT_API_URL = "https://api.exchange.coinbase.com"
+# Status codes that are worth retrying. Anything else is returned as is so the
+# caller sees the same {"message": ...} dicts that cbpro used to hand back.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CoinbaseError(Exception):
+    """Raised when Coinbase could not be reached after every retry, did not
+    answer within the endpoint's budget or is being skipped while its circuit
+    breaker is open."""
+
+
+class CoinbaseClient:
+    """Minimal asyncio-native replacement for cbpro.PublicClient. Requests go
+    through one persistent connection pool and every request gets a timeout
+    and an exponential backoff between retries.
+
+    session_getter is an optional callable returning a borrowed session, e.g.
+    the bot's shared one. Without it the client owns a private pool.
+
+    Each endpoint is an Upstream with its own latency budget and hedging,
+    and both share one circuit breaker since they fail together."""
+
+    def __init__(self, api_url=DEFAULT_API_URL, timeout=5.0, retries=2,
+                 backoff=0.25, pool_size=20, session_getter=None,
+                 stats_budget=4.0, candles_budget=10.0, logger=None):
+        self.api_url = api_url.rstrip("/")
+        self.session_getter = session_getter
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        # Latency of single HTTP requests, while each Upstream tracks whole
+        # calls, retries and hedges included
+        self.latency = LatencyTracker()
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+        }
+        self.breaker = CircuitBreaker("Coinbase", logger=logger)
+        self.upstreams = {
+            "stats": Upstream("Coinbase stats", stats_budget, self.breaker),
+            "candles": Upstream(
+                "Coinbase candles", candles_budget, self.breaker),
+            "products": Upstream(
+                "Coinbase products", stats_budget, self.breaker),
+        }
+        return
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Returns the pooled session, creating it on first use. This must be
+        called from inside the running event loop."""
+        if self.session_getter is not None:
+            return self.session_getter()
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self) -> None:
+        """Closes the connection pool if the client owns it."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        return
+
+    async def _get(self, path: str, params=None):
+        """Performs a GET request and returns the decoded json. Connection
+        errors, timeouts and retryable statuses are retried with backoff."""
+        url = f"{self.api_url}{path}"
+        session = self._get_session()
+        self.stats["in_flight"] += 1
+        self.stats["peak_in_flight"] = max(
+            self.stats["peak_in_flight"], self.stats["in_flight"])
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.stats["retries"] += 1
+                    delay = self.backoff * 2 ** (attempt - 1)
+                    await asyncio.sleep(delay + random.uniform(0, delay))
+                self.stats["requests"] += 1
+                start = perf_counter()
+                try:
+                    async with session.get(
+                        url,
+                        params=params,
+                        headers={"Accept": "application/json"},
+                        timeout=self.timeout
+                    ) as response:
+                        if response.status in RETRY_STATUSES:
+                            error = CoinbaseError(
+                                f"{url} returned {response.status}")
+                            continue
+                        data = await response.json(content_type=None)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = CoinbaseError(f"{url} failed: {e!r}")
+                    continue
+                self.latency.add(perf_counter() - start)
+                return data
+            self.stats["failures"] += 1
+            raise error
+        finally:
+            self.stats["in_flight"] -= 1
+
+    async def _call(self, endpoint: str, path: str, params=None):
+        """Performs a GET through the endpoint's Upstream, turning a blown
+        budget or an open circuit into a CoinbaseError."""
+        upstream = self.upstreams[endpoint]
+        try:
+            return await upstream.call(lambda: self._get(path, params))
+        except CircuitOpen as e:
+            raise CoinbaseError(f"{e}") from e
+        except asyncio.TimeoutError as e:
+            raise CoinbaseError(
+                f"{path} took longer than {upstream.budget}s") from e
+
+    async def get_product_24hr_stats(self, product_id: str):
+        """Returns the 24 hour stats for a product, e.g. BTC-USD."""
+        return await self._call("stats", f"/products/{product_id}/stats")
+
+    async def get_products(self):
+        """Returns every product Coinbase lists, as dicts whose "id" is
+        like BTC-USD."""
+        return await self._call("products", "/products")
+
+    async def get_product_historic_rates(self, product_id: str, start=None,
+                                         end=None, granularity=None):
+        """Returns candles as [time, low, high, open, close, volume] lists,
+        newest first. Coinbase caps a single response at 300 candles."""
+        params = dict()
+        if start is not None:
+            params["start"] = start
+        if end is not None:
+            params["end"] = end
+        if granularity is not None:
+            params["granularity"] = granularity
+        return await self._call(
+            "candles", f"/products/{product_id}/candles", params)
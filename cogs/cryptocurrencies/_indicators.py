@@ -0,0 +1,70 @@
+import numpy as np
+from cogs._lazy import lazy_import
+
+# Vectorized chart indicators and downsampling. Every function takes and
+# returns whole arrays, so the cost is a handful of NumPy passes no matter how
+# many candles a range holds.
+
+# pandas takes longer to import than the rest of the cog and is only needed
+# once somebody draws a chart with an EMA
+pd = lazy_import("pandas")
+
+
+def sma(values: np.ndarray, window: int) -> np.ndarray:
+    """Simple moving average. The first window - 1 values are NaN."""
+    result = np.full(len(values), np.nan)
+    if window <= 0 or len(values) < window:
+        return result
+    sums = np.cumsum(np.insert(values.astype(np.float64), 0, 0.0))
+    result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    """Exponential moving average seeded with the first value."""
+    series = pd.Series(values, dtype=np.float64)
+    return series.ewm(span=span, adjust=False).mean().to_numpy()
+
+
+def vwap(candles: np.ndarray) -> np.ndarray:
+    """Volume weighted average of the typical price, anchored at the first
+    candle. Stretches without volume carry the last value forward."""
+    typical = (candles["high"] + candles["low"] + candles["close"]) / 3.0
+    volume = np.cumsum(candles["volume"])
+    weighted = np.cumsum(typical * candles["volume"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = np.where(volume > 0, weighted / volume, typical)
+    return result
+
+
+def bucket_edges(length: int, max_points: int) -> np.ndarray:
+    """Returns the start index of each bucket when length samples are split
+    into at most max_points buckets of near equal size."""
+    if length <= max_points:
+        return np.arange(length)
+    return np.unique(np.linspace(0, length, max_points, endpoint=False)
+                     .astype(np.int64))
+
+
+def downsample_ohlc(candles: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Merges the candles of each bucket into one candle. Highs and lows are
+    kept, so spikes survive downsampling unlike with plain decimation."""
+    if len(edges) == len(candles):
+        return candles
+    last = np.append(edges[1:], len(candles)) - 1
+    result = np.empty(len(edges), dtype=candles.dtype)
+    result["time"] = candles["time"][edges]
+    result["open"] = candles["open"][edges]
+    result["close"] = candles["close"][last]
+    result["high"] = np.maximum.reduceat(candles["high"], edges)
+    result["low"] = np.minimum.reduceat(candles["low"], edges)
+    result["volume"] = np.add.reduceat(candles["volume"], edges)
+    return result
+
+
+def downsample_line(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Samples an indicator at the close of each bucket so it lines up with
+    the candles from downsample_ohlc."""
+    if len(edges) == len(values):
+        return values
+    return values[np.append(edges[1:], len(values)) - 1]
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import re
+import time
+from cogs.cryptocurrencies._resilience import (
+    CircuitBreaker,
+    CircuitOpen,
+    Upstream
+)
+
+# Persistent CoinMarketCap logo and metadata index. Lookups that miss are
+# batched into one multi-symbol request and unknown symbols are remembered for
+# a while so they don't cost an HTTP call on every invocation.
+
+INVALID_SYMBOLS = re.compile(r'"symbol":? ?"([^"]+)"')
+
+
+class LogoIndex:
+    """Maps ticker symbols to CoinMarketCap metadata, persisted as json.
+    Requests run under a latency budget and stop while CMC is failing."""
+
+    def __init__(self, path, session_getter, api_url, api_key, logger,
+                 missing_ttl=86400.0, batch_size=100, batch_delay=0.05,
+                 budget=3.0):
+        self.path = path
+        self.session_getter = session_getter
+        self.api_url = api_url
+        self.api_key = api_key
+        self.logger = logger
+        self.missing_ttl = missing_ttl
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # symbol -> {"logo": ..., "name": ..., "slug": ...}
+        self.entries = dict()
+        # symbol -> unix time the symbol was found to be unknown
+        self.missing = dict()
+        # symbol -> future resolved when the pending batch completes
+        self._pending = dict()
+        self._flush_handle = None
+        # Batches being resolved, kept so their errors get logged
+        self._resolving = set()
+        self._save_task = None
+        self.upstream = Upstream("CoinMarketCap", budget, CircuitBreaker(
+            "CoinMarketCap", logger=logger))
+        self.stats = {"requests": 0, "symbols_fetched": 0, "negative_hits": 0}
+        return
+
+    def load(self) -> None:
+        """Loads the index from disk. A missing or corrupt file just starts
+        an empty index."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            self.logger.info("No logo index at %s, starting empty.", self.path)
+            return
+        except (OSError, ValueError) as e:
+            self.logger.warning("Could not read logo index %s: %s",
+                                self.path, e)
+            return
+        self.entries = data.get("entries", dict())
+        self.missing = data.get("missing", dict())
+        self.logger.info("Loaded %s logos from %s.", len(self.entries),
+                         self.path)
+        return
+
+    def _write(self, data: dict) -> None:
+        """Writes the index atomically so a crash never leaves half a file."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(temp_path, self.path)
+        return
+
+    def save_soon(self) -> None:
+        """Schedules one write of the index off the event loop. Calls made
+        while a write is pending are folded into it."""
+        if self._save_task is not None and not self._save_task.done():
+            return
+        self._save_task = asyncio.ensure_future(self._save())
+        return
+
+    async def _save(self) -> None:
+        await asyncio.sleep(1.0)
+        data = {"entries": dict(self.entries), "missing": dict(self.missing)}
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._write, data)
+        except OSError as e:
+            self.logger.warning("Could not save logo index: %s", e)
+        return
+
+    def get(self, symbol: str):
+        """Returns the logo url for symbol, or None if it isn't indexed."""
+        entry = self.entries.get(symbol)
+        return entry["logo"] if entry else None
+
+    def is_missing(self, symbol: str) -> bool:
+        """True if symbol was recently found not to exist on CoinMarketCap."""
+        since = self.missing.get(symbol)
+        return since is not None and time.time() - since < self.missing_ttl
+
+    async def lookup(self, symbol: str):
+        """Returns the logo url for symbol, fetching it if needed. Lookups
+        arriving within batch_delay of each other share one request."""
+        if symbol in self.entries:
+            return self.get(symbol)
+        if self.is_missing(symbol):
+            self.stats["negative_hits"] += 1
+            return None
+        future = self._pending.get(symbol)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._pending[symbol] = future
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = asyncio.get_event_loop().call_later(
+                    self.batch_delay, self._flush)
+        await asyncio.shield(future)
+        return self.get(symbol)
+
+    def _flush(self) -> None:
+        """Sends every pending symbol in one request."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, dict()
+        if pending:
+            task = asyncio.ensure_future(self._resolve(pending))
+            self._resolving.add(task)
+            task.add_done_callback(self._resolve_done)
+        return
+
+    def _resolve_done(self, task: asyncio.Future) -> None:
+        self._resolving.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error("Logo batch failed: %r", task.exception())
+        return
+
+    async def _resolve(self, pending: dict) -> None:
+        try:
+            await self.fetch(list(pending))
+        finally:
+            for future in pending.values():
+                if not future.done():
+                    future.set_result(None)
+        return
+
+    async def prefetch(self, symbols) -> None:
+        """Warms the index with every symbol that isn't known yet, in
+        batch_size chunks that are requested concurrently."""
+        symbols = [s for s in dict.fromkeys(symbols)
+                   if s not in self.entries and not self.is_missing(s)]
+        if not symbols:
+            return
+        self.logger.info("Prefetching %s logos.", len(symbols))
+        chunks = [symbols[i:i + self.batch_size]
+                  for i in range(0, len(symbols), self.batch_size)]
+        await asyncio.gather(*(self.fetch(chunk) for chunk in chunks))
+        return
+
+    async def fetch(self, symbols: list) -> None:
+        """Requests metadata for several symbols at once. Symbols a 400
+        response names as invalid are negatively cached and the rest are
+        retried once. Any other error is taken as transient and caches
+        nothing, so a quota or key problem doesn't hide logos for a day."""
+        for attempt in range(2):
+            if not symbols:
+                return
+            status, data = await self._request(symbols)
+            if status is None:
+                return  # Network trouble, try again on a later lookup
+            if status == 200:
+                self._store(symbols, data.get("data", dict()))
+                return
+            error = data.get("status", dict()).get("error_message", "")
+            invalid = set()
+            if status == 400:
+                for match in INVALID_SYMBOLS.findall(error):
+                    invalid.update(s.strip().upper() for s in match.split(","))
+            if not invalid:
+                self.logger.warning("CoinMarketCap lookup failed with status "
+                                    "%s: %s", status, error)
+                return
+            self._mark_missing(invalid)
+            symbols = [s for s in symbols if s not in invalid]
+        return
+
+    async def _request(self, symbols: list):
+        """Returns (status, json) for one info request or (None, None) if
+        CMC failed, ran over budget or is skipped while its circuit is open.
+        """
+        parameters = {"symbol": ",".join(symbols)}
+        try:
+            return await self.upstream.call(lambda: self._get(parameters))
+        except CircuitOpen as e:
+            self.logger.debug("Skipping CoinMarketCap lookup: %s", e)
+        except asyncio.TimeoutError:
+            self.logger.warning("CoinMarketCap lookup took longer than %ss.",
+                                self.upstream.budget)
+        except Exception as e:
+            self.logger.warning("CoinMarketCap lookup failed: %r", e)
+        return None, None
+
+    async def _get(self, parameters: dict):
+        self.stats["requests"] += 1
+        headers = {
+            "Accepts": "application/json",
+            "X-CMC_PRO_API_KEY": self.api_key
+        }
+        self.logger.info("Looking for %s on cmc.", parameters["symbol"])
+        async with self.session_getter().get(
+            url=self.api_url,
+            headers=headers,
+            params=parameters
+        ) as response:
+            # Client errors carry the invalid symbols, only these are failures
+            if response.status == 429 or response.status >= 500:
+                response.raise_for_status()
+            return response.status, await response.json(content_type=None)
+
+    def _store(self, symbols: list, data: dict) -> None:
+        for symbol, info in data.items():
+            # v2 of the endpoint returns a list of coins per symbol
+            if isinstance(info, list):
+                if not info:
+                    continue
+                info = info[0]
+            self.entries[symbol.upper()] = {
+                "logo": info.get("logo"),
+                "name": info.get("name"),
+                "slug": info.get("slug"),
+            }
+            self.stats["symbols_fetched"] += 1
+        self._mark_missing(s for s in symbols if s not in self.entries)
+        self.save_soon()
+        return
+
+    def _mark_missing(self, symbols) -> None:
+        now = time.time()
+        for symbol in symbols:
+            self.missing[symbol] = now
+        self.save_soon()
+        return
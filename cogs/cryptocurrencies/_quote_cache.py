@@ -0,0 +1,116 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+
+# TTL cache for upstream quotes. Concurrent misses for the same key share one
+# upstream fetch and slightly old entries are served while a refresh runs.
+
+
+class QuoteCache:
+    """Caches the results of an async fetch(key) coroutine function.
+
+    Entries younger than fresh_for seconds are returned as is. Entries younger
+    than fresh_for + stale_for seconds are returned immediately while a single
+    background fetch revalidates them. Anything older is fetched again, and
+    every caller asking for the same key meanwhile waits on that same fetch."""
+
+    def __init__(self, fetch, fresh_for=5.0, stale_for=55.0, max_entries=1024):
+        self.fetch = fetch
+        self.fresh_for = fresh_for
+        self.stale_for = stale_for
+        self.max_entries = max_entries
+        # key -> (monotonic time stored, value)
+        self._entries = OrderedDict()
+        # key -> task of the upstream fetch currently running for it
+        self._in_flight = dict()
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "upstream_calls": 0,
+            "upstream_errors": 0,
+            "served_on_error": 0,
+        }
+        return
+
+    @property
+    def hit_ratio(self) -> float:
+        """Fraction of lookups answered without waiting on upstream."""
+        served = self.stats["hits"] + self.stats["stale_hits"]
+        total = served + self.stats["misses"]
+        return served / total if total else 0.0
+
+    async def get(self, key):
+        """Returns the cached value for key, fetching it if needed."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = monotonic() - entry[0]
+            if age < self.fresh_for:
+                self.stats["hits"] += 1
+                return entry[1]
+            if age < self.fresh_for + self.stale_for:
+                self.stats["stale_hits"] += 1
+                self._refresh(key)
+                return entry[1]
+        self.stats["misses"] += 1
+        # Shield the shared fetch so one cancelled caller doesn't cancel it
+        # for everybody else waiting on the same key.
+        return await asyncio.shield(self._refresh(key))
+
+    def peek(self, key):
+        """Returns (age in seconds, value) for key without fetching, or None
+        if nothing has been cached for it."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return monotonic() - entry[0], entry[1]
+
+    def fallback(self, key):
+        """Returns (age in seconds, value) of the last value stored for key
+        however old it is, for answering while upstream is failing, or None
+        if nothing has been cached for it."""
+        entry = self.peek(key)
+        if entry is not None:
+            self.stats["served_on_error"] += 1
+        return entry
+
+    def put(self, key, value) -> None:
+        """Stores a value obtained elsewhere, e.g. from a streaming feed."""
+        self._entries[key] = (monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return
+
+    def _refresh(self, key) -> asyncio.Task:
+        """Starts an upstream fetch for key unless one is already running and
+        returns the task that will hold its result."""
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return task
+        self.stats["upstream_calls"] += 1
+        task = asyncio.ensure_future(self._fetch_and_store(key))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda t: self._fetch_done(key, t))
+        return task
+
+    async def _fetch_and_store(self, key):
+        value = await self.fetch(key)
+        self.put(key, value)
+        return value
+
+    def _fetch_done(self, key, task: asyncio.Task) -> None:
+        self._in_flight.pop(key, None)
+        # Retrieve the exception so background refreshes that fail are
+        # counted instead of reported as never retrieved.
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["upstream_errors"] += 1
+        return
+
+    def report(self) -> str:
+        """Returns a one line summary of the cache counters."""
+        counters = ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        return (f"{len(self._entries)} entries, hit ratio "
+                f"{self.hit_ratio:.1%}, {counters}")
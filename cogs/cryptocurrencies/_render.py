@@ -0,0 +1,172 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from time import perf_counter
+from cogs.cryptocurrencies._resilience import LatencyTracker
+
+# Chart rendering engine. Figures are drawn with matplotlib's object-oriented
+# Agg API inside a bounded pool of worker processes, so neither the CPU time
+# nor pyplot's global state ever touch the bot's event loop.
+
+
+class RendererBusy(Exception):
+    """Raised when too many charts are already waiting to be rendered."""
+
+
+def _init_worker() -> None:
+    """Imports matplotlib once per worker instead of once per chart."""
+    import matplotlib.backends.backend_agg  # noqa: F401
+    import matplotlib.figure  # noqa: F401
+    return
+
+
+def _new_figure(width=6.4, height=4.8):
+    """Returns a figure attached to its own Agg canvas, bypassing pyplot."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(width, height))
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _to_png(figure) -> bytes:
+    """Encodes the figure as png and releases everything it holds."""
+    buffer = BytesIO()
+    try:
+        figure.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        figure.clear()
+        buffer.close()
+
+
+def render_price_line(x, y, title: str, xlabel: str, ylabel: str):
+    """Draws a single price line. Runs in a worker process and returns the
+    png bytes together with the time spent rendering."""
+    start = perf_counter()
+    figure = _new_figure()
+    axes = figure.add_subplot()
+    axes.plot(x, y)
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+    axes.set_xticks([])
+    figure.tight_layout()
+    png = _to_png(figure)
+    return png, perf_counter() - start
+
+
+def render_candlesticks(candles, overlays: dict, title: str):
+    """Draws OHLC candlesticks with volume bars underneath and a line for
+    each overlay in the {label: values} dict. Candles are placed by index so
+    gaps without trades don't stretch the chart. Runs in a worker process
+    and returns the png bytes together with the time spent rendering."""
+    import numpy as np
+    from datetime import datetime, timezone
+    start = perf_counter()
+    figure = _new_figure(8.0, 5.0)
+    grid = figure.add_gridspec(2, 1, height_ratios=(4, 1), hspace=0.05,
+                               left=0.1, right=0.97, top=0.93, bottom=0.07)
+    price_axes = figure.add_subplot(grid[0])
+    volume_axes = figure.add_subplot(grid[1], sharex=price_axes)
+    x = np.arange(len(candles))
+    up = candles["close"] >= candles["open"]
+    colors = np.where(up, "#26a69a", "#ef5350")
+    price_axes.vlines(x, candles["low"], candles["high"], colors=colors,
+                      linewidth=0.8)
+    body_low = np.minimum(candles["open"], candles["close"])
+    body_height = np.abs(candles["close"] - candles["open"])
+    # Keep flat candles visible as a thin line
+    body_height = np.maximum(body_height, (candles["high"].max()
+                                           - candles["low"].min()) * 1e-3)
+    price_axes.bar(x, body_height, bottom=body_low, width=0.6, color=colors)
+    for label, values in overlays.items():
+        price_axes.plot(x, values, linewidth=1.0, label=label)
+    if overlays:
+        price_axes.legend(loc="upper left", fontsize="small")
+    price_axes.set_title(title)
+    price_axes.set_ylabel("USD")
+    price_axes.tick_params(labelbottom=False)
+    volume_axes.bar(x, candles["volume"], width=0.6, color=colors)
+    volume_axes.set_ylabel("Vol")
+    ticks = np.linspace(0, len(candles) - 1, min(6, len(candles)))
+    ticks = ticks.astype(np.int64)
+    span = candles["time"][-1] - candles["time"][0] if len(candles) else 0
+    time_format = "%H:%M" if span <= 86400 else "%b %d"
+    volume_axes.set_xticks(ticks)
+    volume_axes.set_xticklabels([
+        datetime.fromtimestamp(int(t), timezone.utc).strftime(time_format)
+        for t in candles["time"][ticks]])
+    png = _to_png(figure)
+    return png, perf_counter() - start
+
+
+class ChartRenderer:
+    """Runs chart functions from this module in a process pool. At most
+    `workers` charts render at once and at most `max_pending` may wait."""
+
+    def __init__(self, workers=2, max_pending=16):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = None
+        self._slots = None
+        self.pending = 0
+        # Render time of the last few charts inside the workers, in seconds
+        self.render_times = LatencyTracker(500)
+        self.stats = {
+            "rendered": 0,
+            "rejected": 0,
+            "failed": 0,
+            "peak_pending": 0,
+        }
+        return
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned workers don't inherit the bot's threads or sockets
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._pool
+
+    async def render(self, function, *args) -> bytes:
+        """Renders a chart with function(*args) and returns the png bytes.
+        Raises RendererBusy instead of queueing without bound."""
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise RendererBusy(f"{self.pending} charts already queued")
+        pool = self._get_pool()
+        self.pending += 1
+        self.stats["peak_pending"] = max(
+            self.stats["peak_pending"], self.pending)
+        try:
+            async with self._slots:
+                loop = asyncio.get_event_loop()
+                png, seconds = await loop.run_in_executor(
+                    pool, function, *args)
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.stats["rendered"] += 1
+        self.render_times.add(seconds)
+        return png
+
+    def report(self) -> str:
+        """Returns a one line summary of the renderer counters."""
+        times = ", ".join(f"p{p}={ms:.0f}ms"
+                          for p, ms in self.render_times.percentiles().items())
+        counters = ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        return f"{self.pending} pending, {counters}, render {times}"
+
+    def close(self) -> None:
+        """Stops the worker processes without waiting for queued charts."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        return
@@ -0,0 +1,210 @@
+import asyncio
+from collections import deque
+from time import monotonic, perf_counter
+
+# Resilience layer for the crypto cogs' upstream APIs. Every call to an
+# endpoint runs under a latency budget, is hedged with a second request once it
+# is slower than the endpoint's usual p95, and is refused right away while the
+# upstream's circuit breaker is open.
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class LatencyTracker:
+    """Keeps the last `size` latencies of an endpoint, in seconds."""
+
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        return
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        return
+
+    def percentile(self, percent: float):
+        """Returns the percentile in seconds, or None without samples."""
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        index = min(len(samples) - 1, int(len(samples) * percent / 100))
+        return samples[index]
+
+    def percentiles(self, *percents) -> dict:
+        """Returns the requested percentiles in milliseconds."""
+        samples = sorted(self.samples)
+        result = dict()
+        for percent in percents or (50, 95, 99):
+            if not samples:
+                result[percent] = 0.0
+                continue
+            index = min(len(samples) - 1, int(len(samples) * percent / 100))
+            result[percent] = samples[index] * 1000.0
+        return result
+
+
+class CircuitBreaker:
+    """Opens after `threshold` failures in a row and refuses calls for
+    `reset_after` seconds. Then a single trial call is let through: success
+    closes the breaker and failure opens it again."""
+
+    def __init__(self, name, threshold=5, reset_after=30.0, logger=None):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.logger = logger
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self.stats = {"opened": 0, "rejected": 0}
+        return
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if monotonic() - self.opened_at < self.reset_after:
+            return "open"
+        return "half-open"
+
+    def before_call(self) -> None:
+        """Raises CircuitOpen unless a call may go through now."""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half-open" and not self._trial_running:
+            self._trial_running = True
+            return
+        self.stats["rejected"] += 1
+        retry_in = max(0.0, self.opened_at + self.reset_after - monotonic())
+        raise CircuitOpen(
+            f"{self.name} is failing, not retrying for {retry_in:.0f}s")
+
+    def record_success(self) -> None:
+        if self.opened_at is not None and self.logger is not None:
+            self.logger.info("%s recovered, circuit closed.", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        return
+
+    def record_cancelled(self) -> None:
+        """Lets another trial call through if this one was abandoned."""
+        self._trial_running = False
+        return
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        trial_failed = self._trial_running
+        self._trial_running = False
+        if trial_failed or (self.opened_at is None
+                            and self.failures >= self.threshold):
+            self.opened_at = monotonic()
+            self.stats["opened"] += 1
+            if self.logger is not None:
+                self.logger.warning("%s failed %s times in a row, circuit "
+                                    "open for %.0fs.", self.name,
+                                    self.failures, self.reset_after)
+        return
+
+
+class Upstream:
+    """Runs the calls to one endpoint.
+
+    Each call gets at most `budget` seconds. Once `min_samples` latencies are
+    known, a call still running after the p95 latency gets a hedged duplicate
+    and whichever answers first wins; hedges are capped at `hedge_ratio` of
+    all calls so a slow upstream doesn't see double the traffic. Failures and
+    blown budgets count against the breaker, which may be shared by several
+    endpoints of the same host."""
+
+    def __init__(self, name, budget, breaker=None, hedge_ratio=0.1,
+                 min_samples=20, min_hedge_delay=0.05):
+        self.name = name
+        self.budget = budget
+        self.breaker = breaker or CircuitBreaker(name)
+        self.hedge_ratio = hedge_ratio
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.latency = LatencyTracker()
+        self.stats = {
+            "calls": 0,
+            "failures": 0,
+            "over_budget": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+        return
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None if the call shouldn't be
+        hedged at all."""
+        if len(self.latency) < self.min_samples:
+            return None
+        if self.stats["hedges"] >= self.stats["calls"] * self.hedge_ratio:
+            return None
+        delay = max(self.latency.percentile(95), self.min_hedge_delay)
+        return delay if delay < self.budget else None
+
+    async def call(self, factory):
+        """Awaits factory(), a function returning a new coroutine for each
+        attempt, and returns its result. Raises CircuitOpen without calling
+        factory while the breaker is open and asyncio.TimeoutError once the
+        budget is spent."""
+        self.breaker.before_call()
+        self.stats["calls"] += 1
+        start = perf_counter()
+        try:
+            result = await asyncio.wait_for(self._hedged(factory), self.budget)
+        except asyncio.CancelledError:
+            # The caller gave up, which says nothing about the upstream
+            self.breaker.record_cancelled()
+            raise
+        except asyncio.TimeoutError:
+            self.stats["over_budget"] += 1
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            self.stats["failures"] += 1
+            self.breaker.record_failure()
+            raise
+        self.latency.add(perf_counter() - start)
+        self.breaker.record_success()
+        return result
+
+    async def _hedged(self, factory):
+        first = asyncio.ensure_future(factory())
+        tasks = {first}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.stats["hedges"] += 1
+                    tasks.add(asyncio.ensure_future(factory()))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def report(self) -> str:
+        """Returns a one line summary with the tail latencies."""
+        latency = self.latency.percentiles(50, 95, 99)
+        counters = ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        return (f"{self.name}: " + ", ".join(
+            f"p{p}={ms:.0f}ms" for p, ms in latency.items())
+            + f", {counters}, circuit {self.breaker.state}")
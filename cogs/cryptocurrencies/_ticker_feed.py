@@ -0,0 +1,261 @@
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+import aiohttp
+import numpy as np
+from cogs.cryptocurrencies._candle_store import CANDLE_DTYPE
+
+# Coinbase websocket ticker feed. Every tick for a watched product lands in a
+# fixed-size ring buffer and the latest 24 hour stats are kept in memory, so
+# price commands can answer without an upstream request and charts can build
+# their newest candles from the buffered ticks. Each tick is also handed on
+# to on_tick, e.g. for alerts.
+
+DEFAULT_WS_URL = "wss://ws-feed.exchange.coinbase.com"
+TICK_DTYPE = np.dtype([("time", "<f8"), ("price", "<f8"), ("size", "<f8")])
+# Seconds after subscribing before the buffered ticks are trusted to be
+# complete. Covers the subscription taking effect and clock skew against
+# the exchange's tick times.
+COVERAGE_MARGIN = 2.0
+
+
+class RingBuffer:
+    """Keeps the last `capacity` ticks of one product in a preallocated
+    structured array. Appends never allocate."""
+
+    def __init__(self, capacity=4096):
+        self._ticks = np.zeros(capacity, dtype=TICK_DTYPE)
+        self._next = 0
+        self._count = 0
+        return
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def full(self) -> bool:
+        """Whether appends now overwrite the oldest ticks."""
+        return self._count == len(self._ticks)
+
+    def append(self, timestamp: float, price: float, size: float) -> None:
+        self._ticks[self._next] = (timestamp, price, size)
+        self._next = (self._next + 1) % len(self._ticks)
+        self._count = min(self._count + 1, len(self._ticks))
+        return
+
+    def oldest(self):
+        """Returns the oldest tick, or None if the buffer is empty."""
+        if not self._count:
+            return None
+        return self._ticks[self._next if self.full else 0]
+
+    def latest(self):
+        """Returns the newest tick, or None if the buffer is empty."""
+        if not self._count:
+            return None
+        return self._ticks[self._next - 1]
+
+    def ticks(self, since=None) -> np.ndarray:
+        """Returns a copy of the buffered ticks oldest first, optionally only
+        those at or after the unix time since."""
+        if not self.full:
+            ticks = self._ticks[:self._count].copy()
+        else:
+            ticks = np.concatenate(
+                (self._ticks[self._next:], self._ticks[:self._next]))
+        if since is not None:
+            ticks = ticks[np.searchsorted(ticks["time"], since):]
+        return ticks
+
+
+def ticks_to_candles(ticks: np.ndarray, granularity: int) -> np.ndarray:
+    """Merges time sorted ticks into candles of granularity seconds, shaped
+    like the candle store's. Like Coinbase, candles without trades are left
+    out."""
+    if not len(ticks):
+        return np.empty(0, dtype=CANDLE_DTYPE)
+    buckets = (ticks["time"] // granularity).astype(np.int64) * granularity
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    prices = ticks["price"]
+    candles = np.empty(len(starts), dtype=CANDLE_DTYPE)
+    candles["time"] = buckets[starts]
+    candles["low"] = np.minimum.reduceat(prices, starts)
+    candles["high"] = np.maximum.reduceat(prices, starts)
+    candles["open"] = prices[starts]
+    candles["close"] = prices[np.r_[starts[1:] - 1, len(prices) - 1]]
+    candles["volume"] = np.add.reduceat(ticks["size"], starts)
+    return candles
+
+
+def _parse_time(value: str) -> float:
+    """Parses Coinbase's ISO 8601 timestamps, falling back to now."""
+    try:
+        value = value.replace("Z", "+00:00")
+        return datetime.fromisoformat(value).timestamp()
+    except (AttributeError, ValueError):
+        return time.time()
+
+
+class TickerFeed:
+    """Subscribes to the ticker channel for a watchlist of products and
+    reconnects with backoff whenever the connection drops or goes quiet.
+    on_tick(product, price, timestamp) is called for every tick if given."""
+
+    def __init__(self, products, session_getter, logger, url=DEFAULT_WS_URL,
+                 capacity=4096, max_age=30.0, on_tick=None):
+        self.url = url
+        self.products = list(dict.fromkeys(products))
+        self.session_getter = session_getter
+        self.logger = logger
+        self.capacity = capacity
+        # Stats older than this many seconds are not served from memory
+        self.max_age = max_age
+        self.on_tick = on_tick
+        self.buffers = {product: RingBuffer(capacity)
+                        for product in self.products}
+        # product -> unix time since which every tick is buffered, for the
+        # products subscribed on the current connection
+        self._complete_since = dict()
+        # product -> (receive time, stats dict shaped like the REST stats)
+        self._stats = dict()
+        self._task = None
+        self._socket = None
+        self.stats = {"ticks": 0, "connects": 0, "disconnects": 0}
+        return
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, loop=None) -> None:
+        """Starts the feed on loop, or the current event loop."""
+        if not self.running:
+            loop = loop or asyncio.get_event_loop()
+            self._task = loop.create_task(self._run())
+        return
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        return
+
+    async def watch(self, products) -> None:
+        """Adds products to the watchlist, subscribing right away if the
+        feed is connected."""
+        new = [p for p in dict.fromkeys(products) if p not in self.buffers]
+        for product in new:
+            self.products.append(product)
+            self.buffers[product] = RingBuffer(self.capacity)
+        if new and self._socket is not None and not self._socket.closed:
+            await self._subscribe(self._socket, new)
+        return
+
+    def latest_stats(self, product: str):
+        """Returns 24 hour stats from the feed, or None if the product isn't
+        watched or hasn't ticked within max_age seconds."""
+        entry = self._stats.get(product)
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            return None
+        return entry[1]
+
+    def candles(self, product: str, granularity: int, since: int):
+        """Returns the candles from the unix time since on, built from the
+        buffered ticks. Returns None unless every tick since then is in the
+        buffer: the feed must have been subscribed to product since before
+        then, without dropping, and the buffer must not have overwritten
+        ticks that recent."""
+        buffer = self.buffers.get(product)
+        complete_since = self._complete_since.get(product)
+        if buffer is None or complete_since is None or \
+                since < complete_since + COVERAGE_MARGIN:
+            return None
+        if buffer.full and buffer.oldest()["time"] > since:
+            return None
+        return ticks_to_candles(buffer.ticks(since), granularity)
+
+    async def _subscribe(self, socket, products) -> None:
+        await socket.send_json({
+            "type": "subscribe",
+            "product_ids": list(products),
+            # Heartbeats keep quiet products from looking like a dead feed
+            "channels": ["ticker", "heartbeat"],
+        })
+        now = time.time()
+        for product in products:
+            self._complete_since[product] = now
+        return
+
+    async def _run(self) -> None:
+        """Connects, subscribes and reads ticks until cancelled."""
+        delay = 1.0
+        while True:
+            try:
+                async with self.session_getter().ws_connect(
+                    self.url, heartbeat=30.0
+                ) as socket:
+                    self._socket = socket
+                    self.stats["connects"] += 1
+                    self.logger.info("Ticker feed connected to %s.", self.url)
+                    await self._subscribe(socket, self.products)
+                    while True:
+                        # A feed without heartbeats for a minute is dead
+                        message = await socket.receive(timeout=60.0)
+                        if message.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        self._handle(json.loads(message.data))
+                        delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning("Ticker feed error: %r", e)
+            finally:
+                self._socket = None
+                # Ticks missed while reconnecting leave holes
+                self._complete_since.clear()
+            self.stats["disconnects"] += 1
+            # Back off with jitter so restarts don't reconnect in lockstep
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            delay = min(delay * 2, 60.0)
+
+    def _handle(self, message: dict) -> None:
+        if message.get("type") == "error":
+            self.logger.warning("Ticker feed: %s", message.get("message"))
+            return
+        if message.get("type") != "ticker":
+            return
+        product = message.get("product_id")
+        buffer = self.buffers.get(product)
+        if buffer is None:
+            return
+        try:
+            price = float(message["price"])
+            size = float(message.get("last_size") or 0)
+        except (KeyError, TypeError, ValueError):
+            return
+        timestamp = _parse_time(message.get("time"))
+        buffer.append(timestamp, price, size)
+        self.stats["ticks"] += 1
+        self._stats[product] = (time.monotonic(), {
+            "open": message.get("open_24h"),
+            "high": message.get("high_24h"),
+            "low": message.get("low_24h"),
+            "volume": message.get("volume_24h"),
+            "last": message["price"],
+            "volume_30day": message.get("volume_30d"),
+        })
+        if self.on_tick is not None:
+            self.on_tick(product, price, timestamp)
+        return
+
+    def report(self) -> str:
+        """Returns a one line summary of the feed counters."""
+        state = "connected" if self._socket is not None else "disconnected"
+        counters = ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        return f"{state}, {len(self.products)} products, {counters}"
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import os
+import re
+import time
+from discord.ext import commands, tasks
+from cogs.cryptocurrencies._alerts import ABOVE, BELOW, DOWN, UP, AlertEngine
+from cogs.cryptocurrencies._coinbase import CoinbaseError
+
+# Each user may keep this many alerts at once
+ALERTS_PER_USER = 25
+# Alerts triggered within this many seconds go out as one message per channel
+ALERT_BATCH_SECONDS = 2.0
+# Alerts live in this namespace of bot.db, keyed by alert id
+ALERTS_NAMESPACE = "alerts"
+# Alerts were kept in this file before they moved to bot.db
+LEGACY_ALERTS_PATH = os.path.join("cogs", "cryptocurrencies", "alerts.json")
+# Products with alerts but no streaming feed are polled this often
+ALERT_POLL_SECONDS = 30.0
+DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text: str):
+    """Parses durations like 30m, 1h or 2d into seconds, or returns None."""
+    match = DURATION.match(text.lower())
+    if match is None:
+        return None
+    return int(float(match.group(1)) * DURATION_UNITS[match.group(2)])
+
+
+def parse_amount(text: str):
+    """Parses 70000, 70,000, 70k, 1.5m or 5% into a float. Percentages
+    become fractions. Returns None if the text isn't a number."""
+    text = text.lower().replace(",", "").lstrip("$")
+    scale = 1.0
+    if text.endswith("%"):
+        text, scale = text[:-1], 0.01
+    elif text.endswith("k"):
+        text, scale = text[:-1], 1e3
+    elif text.endswith("m"):
+        text, scale = text[:-1], 1e6
+    try:
+        return float(text) * scale
+    except ValueError:
+        return None
+
+
+def describe(alert: dict) -> str:
+    """Returns a short human description of an alert."""
+    if alert["kind"] in (ABOVE, BELOW):
+        return f"{alert['product']} {alert['kind']} {alert['value']:,.8g}"
+    return (f"{alert['product']} {alert['kind']} {alert['value']:.2%} "
+            f"within {alert['window'] // 60}m")
+
+
+# Cog that lets users register price alerts for the crypto cog's products
+class AlertsCmd(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # Clusters share the saved alerts, so ids are numbered per cluster
+        self.engine = AlertEngine(id_step=bot.cluster_count,
+                                  id_offset=bot.cluster_id)
+        # user id -> ids of that user's alerts
+        self._by_user = dict()
+        # channel id -> lines waiting to be sent
+        self._outbox = dict()
+        self._flush_task = None
+        self._loaded = self.bot.loop.create_task(self.__load())
+        self.poll_prices.start()
+        return
+
+    def cog_unload(self):
+        """Stops polling. Changes are already queued in bot.db."""
+        self.poll_prices.cancel()
+        return
+
+    async def __load(self) -> None:
+        """Loads the saved alerts of the guilds this process serves, moving
+        them over from the old json file the first time."""
+        records = list((await self.bot.db.items(ALERTS_NAMESPACE)).values())
+        if not records and os.path.exists(LEGACY_ALERTS_PATH):
+            try:
+                with open(LEGACY_ALERTS_PATH, "r", encoding="utf-8") as file:
+                    records = json.load(file)
+            except (OSError, ValueError) as e:
+                self.bot.warning("Could not read %s: %s",
+                                 LEGACY_ALERTS_PATH, e)
+            else:
+                for record in records:
+                    self.bot.db.set(ALERTS_NAMESPACE, record["id"], record)
+                await self.bot.db.flush()
+                try:
+                    os.replace(
+                        LEGACY_ALERTS_PATH, f"{LEGACY_ALERTS_PATH}.migrated")
+                except FileNotFoundError:
+                    # Another cluster migrated the same file meanwhile and
+                    # wrote the same records
+                    pass
+        for record in records:
+            # Other clusters evaluate and notify the alerts of their guilds
+            if self.bot.owns_guild(record.get("guild_id")):
+                self.__add(record)
+            else:
+                self.engine.reserve(record["id"])
+        self.bot.info("Loaded %s price alerts.", len(self.engine))
+        return
+
+    def __add(self, alert: dict) -> dict:
+        alert = self.engine.add(alert)
+        self._by_user.setdefault(alert["user_id"], set()).add(alert["id"])
+        return alert
+
+    def __forget(self, alert: dict) -> None:
+        ids = self._by_user.get(alert["user_id"], set())
+        ids.discard(alert["id"])
+        if not ids:
+            self._by_user.pop(alert["user_id"], None)
+        self.bot.db.delete(ALERTS_NAMESPACE, alert["id"])
+        return
+
+    @commands.Cog.listener()
+    async def on_crypto_tick(self, product, price, timestamp):
+        """Evaluates every price the crypto cog sees."""
+        triggered = self.engine.evaluate(product, price, timestamp)
+        if not triggered:
+            return
+        for alert in triggered:
+            self.__forget(alert)
+            line = f"<@{alert['user_id']}> {describe(alert)} " \
+                   f"triggered at {price:,.8g}."
+            self._outbox.setdefault(alert["channel_id"], list()).append(line)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self.bot.loop.create_task(self.__flush())
+        return
+
+    async def __flush(self) -> None:
+        """Sends the queued notifications, one message per channel."""
+        await asyncio.sleep(ALERT_BATCH_SECONDS)
+        outbox, self._outbox = self._outbox, dict()
+        for channel_id, lines in outbox.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                self.bot.warning("Alert channel %s is gone.", channel_id)
+                continue
+            try:
+                await self.bot.send_message(channel, "\n".join(lines))
+            except Exception as e:
+                self.bot.warning("Could not send alerts: %r", e)
+        return
+
+    @tasks.loop(seconds=ALERT_POLL_SECONDS)
+    async def poll_prices(self):
+        """Makes sure every product with alerts gets prices: streamed ones
+        are added to the feed's watchlist and the rest are polled."""
+        crypto = self.bot.get_cog("CryptoCmd")
+        products = self.engine.products()
+        if crypto is None or not products:
+            return
+        if crypto.ticker_feed is not None:
+            await crypto.ticker_feed.watch(products)
+        await asyncio.gather(
+            *(crypto.get_quote(product) for product in products),
+            return_exceptions=True)
+        return
+
+    @poll_prices.before_loop
+    async def before_poll_prices(self):
+        await self.bot.wait_until_ready()
+        return
+
+    @commands.command()
+    async def alert(self, ctx, symbol, kind, amount, *window):
+        """Alerts you when a price crosses a level or moves by a percentage,
+        e.g. $alert BTC above 70k or $alert ETH down 5% in 1h"""
+        kind = kind.lower()
+        value = parse_amount(amount)
+        if kind not in (ABOVE, BELOW, UP, DOWN) or value is None \
+                or value <= 0:
+            await ctx.send("Use `$alert BTC above 70000` or "
+                           "`$alert ETH down 5% in 1h`.")
+            return
+        if kind in (ABOVE, BELOW) and amount.endswith("%"):
+            await ctx.send(f"{kind.capitalize()} takes a price, e.g. "
+                           f"`$alert BTC {kind} 70k`. Use up or down for "
+                           f"percentages, e.g. `$alert BTC up 5% in 1h`.")
+            return
+        seconds = 0
+        if kind in (UP, DOWN):
+            words = [w for w in window if w.lower() != "in"] or ["1h"]
+            seconds = parse_duration(words[0])
+            if seconds is None or not 60 <= seconds <= 7 * 86400:
+                await ctx.send("Pick a window between 1m and 7d, e.g. 1h.")
+                return
+            if not amount.endswith("%"):
+                value /= 100.0  # "down 5 in 1h" means 5%
+        # Unknown products would be polled, and fail, for as long as the
+        # alert lives
+        product = f"{symbol.upper()}-USD"
+        crypto = self.bot.get_cog("CryptoCmd")
+        if crypto is None:
+            await ctx.send("Price alerts need the crypto commands loaded.")
+            return
+        try:
+            listed = await crypto.product_exists(product)
+        except CoinbaseError:
+            await ctx.send("Coinbase can't be reached to check the symbol. "
+                           "Try again later.")
+            return
+        if not listed:
+            await ctx.send(f"Coinbase doesn't list {product}.")
+            return
+        # Saved alerts must be in before new ones are numbered
+        await asyncio.shield(self._loaded)
+        if len(self._by_user.get(ctx.author.id, ())) >= ALERTS_PER_USER:
+            await ctx.send(f"You already have {ALERTS_PER_USER} alerts.")
+            return
+        alert = self.__add({
+            "product": product,
+            "kind": kind,
+            "value": value,
+            "window": seconds,
+            "user_id": ctx.author.id,
+            "channel_id": ctx.channel.id,
+            "guild_id": ctx.guild.id if ctx.guild else None,
+            "created": time.time(),
+        })
+        self.bot.db.set(ALERTS_NAMESPACE, alert["id"], alert)
+        await ctx.send(f"Alert #{alert['id']} set: {describe(alert)}.")
+        return
+
+    @commands.command()
+    async def alerts(self, ctx):
+        """Lists your price alerts"""
+        mine = [self.engine.alerts[alert_id]
+                for alert_id in sorted(self._by_user.get(ctx.author.id, ()))]
+        if not mine:
+            await ctx.send("You have no price alerts.")
+            return
+        msg = "\n".join(f"#{a['id']}: {describe(a)}" for a in mine)
+        await self.bot.send_message(ctx, msg)
+        return
+
+    @commands.command()
+    async def alert_remove(self, ctx, alert_id: int):
+        """Removes one of your price alerts by its number"""
+        alert = self.engine.alerts.get(alert_id)
+        if alert is None or alert["user_id"] != ctx.author.id:
+            await ctx.send(f"You have no alert #{alert_id}.")
+            return
+        self.engine.remove(alert_id)
+        self.__forget(alert)
+        await ctx.send(f"Removed alert #{alert_id}: {describe(alert)}.")
+        return
+
+
+# setup command for the cog
+def setup(bot):
+    bot.add_cog(AlertsCmd(bot))
+    return
@@ -1,17 +1,64 @@
-import aiohttp
-import cbpro
+import asyncio
 import discord
 import os
-import matplotlib.pyplot as plt
-import mplfinance as mpf
+import time
 import numpy as np
-import pandas as pd
 from io import BytesIO
 from dotenv import load_dotenv, find_dotenv
-from requests import Request, Session
-from discord.ext import commands
+from discord.ext import commands, tasks
+from cogs.cryptocurrencies._candle_store import CandleStore, UnknownProduct
+from cogs.cryptocurrencies._chart_cache import ChartCache
+from cogs.cryptocurrencies._coinbase import CoinbaseClient, CoinbaseError
+from cogs.cryptocurrencies._indicators import (
+    bucket_edges,
+    downsample_line,
+    downsample_ohlc,
+    ema,
+    sma,
+    vwap
+)
+from cogs.cryptocurrencies._logo_index import LogoIndex
+from cogs.cryptocurrencies._quote_cache import QuoteCache
+from cogs.cryptocurrencies._render import (
+    ChartRenderer,
+    RendererBusy,
+    render_candlesticks,
+    render_price_line
+)
+from cogs.cryptocurrencies._ticker_feed import DEFAULT_WS_URL, TickerFeed
 
-### Embed messages will be handled by the DiscordBot class in the future ###
+# $chart ranges as (seconds shown, candle granularity in seconds)
+CHART_RANGES = {
+    "1h": (3600, 60),
+    "6h": (21600, 300),
+    "1d": (86400, 300),
+    "1w": (604800, 3600),
+    "1m": (2592000, 3600),
+    "3m": (7776000, 21600),
+    "1y": (31536000, 86400),
+}
+# $cbpro with several symbols fetches at most QUOTE_FANOUT at a time and
+# gives up on the stragglers after QUOTE_DEADLINE seconds
+QUOTE_MAX_SYMBOLS = 25
+QUOTE_FANOUT = 8
+QUOTE_DEADLINE = 4.0
+# Longer ranges are merged down to this many candles before drawing
+CHART_MAX_CANDLES = 120
+# Extra candles loaded before a range so moving averages start warmed up
+INDICATOR_WARMUP = 50
+# Upstream tail latencies are logged this often
+UPSTREAM_REPORT_SECONDS = 300
+# Coinbase's product list is fetched again after this many seconds
+PRODUCTS_FRESH_SECONDS = 3600.0
+
+
+def _format_age(seconds: float) -> str:
+    """Formats an age like 45s, 12m or 3h."""
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds // 60:.0f}m"
+    return f"{seconds // 3600:.0f}h"
 
 # Cryptocurrency cog
 
@@ -19,15 +66,40 @@ from discord.ext import commands
 class CryptoCmd(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # One line per quote request, sampled by the bot's LOG_SAMPLING
+        self.request_log = self.bot.get_logger("crypto.requests")
         # Open a coinbase client for grabbing coinbase crypto price
-        self.coinbase_client = cbpro.PublicClient()
+        self.coinbase_client = CoinbaseClient(
+            session_getter=lambda: self.bot.http_session, logger=self.bot)
+        # Charts are rendered off the event loop in worker processes
+        self.renderer = ChartRenderer()
+        # Rendered charts are reused until the next candle starts
+        self.chart_cache = ChartCache()
+        # key -> future of the chart being rendered and uploaded for it
+        self._rendering = dict()
+        # Cache 24 hour stats so bursts of the same request share one call
+        self.quote_cache = QuoteCache(self._fetch_quote)
+        # Coinbase's product ids, to check symbols against before keeping
+        # them around, e.g. in price alerts
+        self.product_cache = QuoteCache(
+            self._fetch_products, fresh_for=PRODUCTS_FRESH_SECONDS,
+            stale_for=PRODUCTS_FRESH_SECONDS)
         # Default coinmarketcap api keys are sandbox keys. They don't work as
         # well as a real key, often returning incorrect data.
         self.cmc_api_key = "b54bcf4d-1bca-4e8e-9a24-22ff2c3d462c"
-        self.cmc_api_url = "https://sandbox-api.coinmarketcap.com/v1/\
-            cryptocurrency/info"
-        # Create dictionary to store data from coinmarketcap to reduce api calls
-        self.logo_url_dict = dict()
+        self.cmc_api_url = ("https://sandbox-api.coinmarketcap.com/v1/"
+                            "cryptocurrency/info")
+        # Symbols whose logos are fetched in bulk when the cog loads
+        prefetch = "BTC,ETH,USDT,USDC,SOL,ADA,XRP,DOGE,DOT,LTC,LINK,MATIC"
+        logo_index_path = os.path.join(
+            "cogs", "cryptocurrencies", "logo_index.json")
+        candle_store_path = os.path.join("cogs", "cryptocurrencies", "candles")
+        # Optional websocket feed answering quotes and the newest chart
+        # candles for a watchlist from memory
+        streaming = "false"
+        watchlist = "BTC,ETH"
+        ws_url = DEFAULT_WS_URL
+        cmc_budget = 3.0
         # Load optional environment variables.
         self.bot.debug("Loading crypto.env")
         if load_dotenv(find_dotenv(filename="crypto.env")):
@@ -35,31 +107,267 @@ class CryptoCmd(commands.Cog):
                 "CMC_API_KEY", default=self.cmc_api_key)
             self.cmc_api_url = os.getenv(
                 "CMC_API_URL", default=self.cmc_api_url)
+            prefetch = os.getenv("CMC_PREFETCH", default=prefetch)
+            logo_index_path = os.getenv(
+                "LOGO_INDEX_PATH", default=logo_index_path)
+            candle_store_path = os.getenv(
+                "CANDLE_STORE_PATH", default=candle_store_path)
+            streaming = os.getenv("CBPRO_STREAMING", default=streaming)
+            watchlist = os.getenv("CBPRO_WATCHLIST", default=watchlist)
+            ws_url = os.getenv("CBPRO_WS_URL", default=ws_url)
+            self.coinbase_client.api_url = os.getenv(
+                "CBPRO_API_URL", default=self.coinbase_client.api_url)
+            for endpoint, upstream in self.coinbase_client.upstreams.items():
+                upstream.budget = float(os.getenv(
+                    f"CBPRO_{endpoint.upper()}_BUDGET",
+                    default=upstream.budget))
+            cmc_budget = float(os.getenv("CMC_BUDGET", default=cmc_budget))
+            self.quote_cache.fresh_for = float(os.getenv(
+                "QUOTE_FRESH_SECONDS", default=self.quote_cache.fresh_for))
+            self.quote_cache.stale_for = float(os.getenv(
+                "QUOTE_STALE_SECONDS", default=self.quote_cache.stale_for))
+            self.renderer.workers = int(os.getenv(
+                "CHART_WORKERS", default=self.renderer.workers))
+            self.chart_cache.max_bytes = int(os.getenv(
+                "CHART_CACHE_BYTES", default=self.chart_cache.max_bytes))
             image_path_string = os.getcwd() + "\\cogs\\cryptocurrencies\\"
             self.crypto_down_image = self.crypto_up_image = image_path_string
             self.crypto_up_image += os.getenv("CRYPTO_UP", default="")
             self.crypto_down_image += os.getenv("CRYPTO_DOWN", default="")
-            return
-        self.bot.warning("crypto.env file not loading???")
+        else:
+            self.bot.warning("crypto.env file not loading???")
+        self.ticker_feed = None
+        if streaming.lower() in ("1", "true", "yes"):
+            self.ticker_feed = TickerFeed(
+                [f"{s.strip().upper()}-USD"
+                 for s in watchlist.split(",") if s.strip()],
+                session_getter=lambda: self.bot.http_session,
+                logger=self.bot,
+                url=ws_url,
+                on_tick=self._dispatch_tick
+            )
+            self.ticker_feed.start(self.bot.loop)
+        # Charts read candles from disk and only download what's missing.
+        # The newest candles of streamed products come from the buffered
+        # ticks. Clusters each keep their own, as they would append to the
+        # same files otherwise.
+        self.candle_store = CandleStore(
+            self.coinbase_client, self.bot.cluster_path(candle_store_path),
+            logger=self.bot,
+            recent=self.ticker_feed.candles if self.ticker_feed else None)
+        # Persistent coinmarketcap logo index to reduce api calls
+        self.logo_index = LogoIndex(
+            logo_index_path,
+            session_getter=lambda: self.bot.http_session,
+            api_url=self.cmc_api_url,
+            api_key=self.cmc_api_key,
+            logger=self.bot,
+            budget=cmc_budget
+        )
+        self.logo_index.load()
+        self.bot.loop.create_task(self.logo_index.prefetch(
+            s.strip().upper() for s in prefetch.split(",") if s.strip()))
+        self.log_upstream_latency.start()
+        self.bot.metrics.add_collector("crypto", self._collect_metrics)
+        self.bot.metrics.describe(
+            "crypto_upstream_latency_seconds", "gauge",
+            "Latency quantiles of the recent calls to each upstream.")
+        self.bot.metrics.describe(
+            "crypto_upstream_circuit_open", "gauge",
+            "1 while the upstream's circuit breaker is not closed.")
+        return
+
+    def cog_unload(self):
+        """Closes the coinbase connection pool, the ticker feed and the chart
+        workers when the cog is unloaded."""
+        self.bot.metrics.remove_collector("crypto")
+        self.log_upstream_latency.cancel()
+        self.bot.loop.create_task(self.coinbase_client.close())
+        if self.ticker_feed is not None:
+            self.bot.loop.create_task(self.ticker_feed.stop())
+        self.renderer.close()
         return
 
     @commands.command()
-    async def cbpro(self, ctx, arg="BTC"):
-        """Returns USD pair for given coinbase ticker symbol"""
-        arg = arg.upper()  # Set the argument string for API's.
+    async def cbpro(self, ctx, *args):
+        """Returns USD pairs for one or more coinbase ticker symbols"""
+        symbols = list(dict.fromkeys(arg.upper() for arg in args)) or ["BTC"]
+        if len(symbols) == 1:
+            await self._send_quote(ctx, symbols[0])
+            return
+        if len(symbols) > QUOTE_MAX_SYMBOLS:
+            await ctx.send(f"Ask for at most {QUOTE_MAX_SYMBOLS} symbols.")
+            return
+        await self.bot.send_message(ctx, await self._quote_table(symbols))
+        return
+
+    def _dispatch_tick(self, product: str, price: float,
+                       timestamp: float) -> None:
+        """Lets other cogs, like the price alerts, see every new price via
+        an on_crypto_tick(product, price, timestamp) listener."""
+        self.bot.dispatch("crypto_tick", product, price, timestamp)
+        return
+
+    async def _fetch_quote(self, product: str) -> dict:
+        """Fetches 24 hour stats from coinbase for the quote cache."""
+        cb_data = await self.coinbase_client.get_product_24hr_stats(product)
+        if "last" in cb_data:
+            self._dispatch_tick(product, float(cb_data["last"]), time.time())
+        return cb_data
+
+    async def _fetch_products(self, _) -> frozenset:
+        """Fetches the ids of every Coinbase product for the product cache."""
+        products = await self.coinbase_client.get_products()
+        if not isinstance(products, list):
+            raise CoinbaseError(f"Unexpected product list: {products!r:.100}")
+        return frozenset(product.get("id") for product in products)
+
+    async def product_exists(self, product: str) -> bool:
+        """Returns whether Coinbase lists product, e.g. BTC-USD. Raises
+        CoinbaseError if the product list can't be fetched and there is no
+        earlier one to fall back on."""
+        try:
+            products = await self.product_cache.get("products")
+        except CoinbaseError:
+            entry = self.product_cache.fallback("products")
+            if entry is None:
+                raise
+            products = entry[1]
+        return product in products
+
+    async def get_quote(self, product: str) -> dict:
+        """Returns the 24 hour stats of a product, from the ticker feed when
+        it is streaming that product and from the quote cache otherwise."""
+        if self.ticker_feed is not None:
+            stats = self.ticker_feed.latest_stats(product)
+            if stats is not None:
+                return stats
+        return await self.quote_cache.get(product)
+
+    async def _get_quote_or_stale(self, product: str):
+        """Returns (stats, age). age is None for a current quote. While
+        coinbase is failing, the last good quote is returned instead with
+        its age in seconds so callers can mark it as stale. Raises
+        CoinbaseError if there is no quote to fall back on."""
+        try:
+            return await self.get_quote(product), None
+        except CoinbaseError:
+            entry = self.quote_cache.fallback(product)
+            if entry is None:
+                raise
+            age, cb_data = entry
+            return cb_data, age
+
+    def _upstreams(self) -> list:
+        return [*self.coinbase_client.upstreams.values(),
+                self.logo_index.upstream]
+
+    def _collect_metrics(self) -> list:
+        """Returns upstream latencies and counters as metric samples for the
+        bot's Prometheus export."""
+        samples = list()
+        for upstream in self._upstreams():
+            labels = {"upstream": upstream.name}
+            for percent in (50, 95, 99):
+                seconds = upstream.latency.percentile(percent)
+                if seconds is not None:
+                    samples.append((
+                        "crypto_upstream_latency_seconds",
+                        {**labels, "quantile": percent / 100}, seconds))
+            for key, value in upstream.stats.items():
+                samples.append(
+                    (f"crypto_upstream_{key}_total", labels, value))
+            samples.append(("crypto_upstream_circuit_open", labels,
+                            int(upstream.breaker.state != "closed")))
+        for key, value in self.quote_cache.stats.items():
+            samples.append(
+                (f"crypto_quote_cache_{key}_total", dict(), value))
+        return samples
+
+    @tasks.loop(seconds=UPSTREAM_REPORT_SECONDS)
+    async def log_upstream_latency(self):
+        """Logs the tail latency of every upstream that has been called."""
+        for upstream in self._upstreams():
+            if upstream.stats["calls"]:
+                self.bot.info(upstream.report())
+        return
+
+    async def _quote_table(self, symbols: list) -> str:
+        """Fetches the quotes for every symbol concurrently and returns them
+        as a table. At most QUOTE_FANOUT requests run at once and anything
+        still missing after QUOTE_DEADLINE seconds is reported as such."""
+        fanout = asyncio.Semaphore(QUOTE_FANOUT)
+
+        async def fetch(symbol):
+            async with fanout:
+                return await self._get_quote_or_stale(f"{symbol}-USD")
+
+        fetches = [asyncio.ensure_future(fetch(symbol)) for symbol in symbols]
+        _, pending = await asyncio.wait(fetches, timeout=QUOTE_DEADLINE)
+        # The quote cache shields its upstream fetches, so cancelling here
+        # still lets late quotes land in the cache for the next request.
+        for task in pending:
+            task.cancel()
+        rows = list()
+        for symbol, task in zip(symbols, fetches):
+            if task in pending:
+                rows.append(f"{symbol:<6} timed out")
+                continue
+            if task.exception() is not None:
+                rows.append(f"{symbol:<6} unavailable")
+                continue
+            cb_data, age = task.result()
+            if not all(key in cb_data for key in ("last", "open")):
+                rows.append(f"{symbol:<6} not found")
+                continue
+            last = float(cb_data["last"])
+            change = (last / float(cb_data["open"]) - 1.0) * 100.0
+            volume = float(cb_data.get("volume", 0.0))
+            row = (f"{symbol:<6} {last:>14,.4f} {change:>+8.2f}% "
+                   f"{volume:>14,.2f}")
+            if age is not None:
+                row += f" (stale, {_format_age(age)} old)"
+            rows.append(row)
+        header = f"{'Pair':<6} {'Last (USD)':>14} {'24h':>9} {'Volume':>14}"
+        return "```\n" + "\n".join([header] + rows) + "\n```"
+
+    async def _send_quote(self, ctx, arg: str) -> None:
+        """Sends the embed with the 24 hour stats of a single symbol."""
         title = f"{arg}-USD"  # Set the title for an embed
-        self.bot.info(f"Searching for {title}-USD on cbpro.")
+        self.request_log.debug("Searching for %s on cbpro.", title)
+        # Collect data needed to generate embed. The logo lookup runs
+        # alongside the quote so a slow CMC doesn't hold the reply back.
+        logo_lookup = asyncio.ensure_future(self.logo_index.lookup(arg))
+        try:
+            cb_data, age = await self._get_quote_or_stale(title)
+            embed_message, file = self._quote_embed(title, cb_data, age)
+            await logo_lookup
+        except CoinbaseError as e:
+            self.bot.warning("%s", e)
+            await ctx.send("Coinbase is not responding. Try again later.")
+            return
+        finally:
+            # Cancelling only stops this wait, the CMC batch is shared
+            logo_lookup.cancel()
+        # If an image url was found, use it for the thumbnail
+        logo_url = self.logo_index.get(arg)
+        if logo_url is not None:
+            embed_message.set_thumbnail(url=logo_url)
+        # Send the embed to discord, paginated if coinbase sent a lot
+        await self.bot.send_embed(ctx, embed_message, file=file)
+        return
+
+    def _quote_embed(self, title: str, cb_data: dict, age) -> tuple:
+        """Returns (embed, file) showing a quote, file being the image for
+        big moves or None."""
         file = None
-        # Collect data needed to generate embed.
-        if arg not in self.logo_url_dict.keys():
-            await self._try_cmc_lookup(arg)
-        cb_data = self.coinbase_client.get_product_24hr_stats(title)
         # Generate an embed object
-        embed_message = discord.Embed(
-            title=title,
-            type="rich",
-            colour=self.bot.embed_color,
-        )
+        embed_message = self.bot.embed_template().new(
+            title=title if age is None else f"{title} (stale)")
+        if age is not None:
+            embed_message.set_footer(
+                text=f"Coinbase is not responding. This quote is "
+                     f"{_format_age(age)} old.")
         # Dynamically set up "author name" based on price
         if all(keys in cb_data for keys in ("last", "open")):
             percent_gain = round(
@@ -90,38 +398,30 @@ class CryptoCmd(commands.Cog):
             embed_message.add_field(
                 name=f"**{key.capitalize()}**",
                 value=f"{cb_data[key]}")
-        # If an image url was found, use it for the thumbnail
-        if arg in self.logo_url_dict.keys():
-            embed_message.set_thumbnail(url=self.logo_url_dict[arg])
-        # Send the embed to discord
-        await ctx.send(file=file, embed=embed_message)
-        return
+        return embed_message, file
 
-    # Tries to find coinmarketcap data for the argument and put it in dictionary
-
-    async def _try_cmc_lookup(self, arg):
-        """Tries to find coinmarketcap data for the argument and puts the data
-        into a dictionary to use later."""
-        self.bot.info(f"Looking for {arg} on coinmarketcap.")
-        # Set the headers and parameters for the request.
-        headers = {
-            "Accepts": "application/json",
-            "X-CMC_PRO_API_KEY": self.cmc_api_key
-        }
-        parameters = {"symbol": arg}
-        # Request data from coinmarketcap. If found, add it to dictionary
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    url=self.cmc_api_url,
-                    headers=headers,
-                    params=parameters
-                ) as response:
-                    json_data = await response.json()
-                    self.logo_url_dict[arg] = json_data["data"][arg]["logo"]
-                    self.bot.info(f"{arg} logo added to dictionary.")
-        except Exception as e:
-            self.bot.exception(e)
+    @commands.command()
+    @commands.is_owner()
+    async def crypto_stats(self, ctx):
+        """Shows quote cache and coinbase client counters"""
+        latency = self.coinbase_client.latency.percentiles(50, 95, 99)
+        msg = f"Quote cache: {self.quote_cache.report()}\n"
+        msg += f"Logo index: {len(self.logo_index.entries)} logos, "
+        msg += f"{len(self.logo_index.missing)} unknown, "
+        msg += ", ".join(
+            f"{k}={v}" for k, v in self.logo_index.stats.items()) + "\n"
+        msg += "Coinbase: " + ", ".join(
+            f"{k}={v}" for k, v in self.coinbase_client.stats.items())
+        msg += ", latency " + ", ".join(
+            f"p{p}={ms:.0f}ms" for p, ms in latency.items()) + "\n"
+        msg += f"Charts: {self.renderer.report()}\n"
+        msg += f"Chart cache: {self.chart_cache.report()}\n"
+        msg += f"Candle store: {self.candle_store.report()}"
+        for upstream in self._upstreams():
+            msg += f"\n{upstream.report()}"
+        if self.ticker_feed is not None:
+            msg += f"\nTicker feed: {self.ticker_feed.report()}"
+        await ctx.send(msg)
         return
 
     @commands.command()
@@ -129,30 +429,140 @@ class CryptoCmd(commands.Cog):
         """ Plot the 24 hour market price of a cryptocurrency (in USD). """
         arg = arg.upper()  # Set the argument string for API
         title = f"{arg}-USD"  # Set the title for an embed
-        rates = self.coinbase_client.get_product_historic_rates(
-            title, granularity=300
-        )
-        if type(rates) == dict:  # if the argument is invalid
-            await ctx.send(f"No data found for {arg}.")
+        granularity = 300
+        # Charts only change when a new candle starts
+        key = (title, granularity, int(time.time()) // granularity)
+        await self._send_chart(ctx, key, lambda: self._render_price_chart(
+            ctx, arg, title, granularity))
+        return
+
+    @commands.command()
+    async def chart(self, ctx, arg="BTC", chart_range="1d"):
+        """Draws candlesticks with SMA, EMA and VWAP for a range from 1h to
+        1y (1h, 6h, 1d, 1w, 1m, 3m, 1y)"""
+        arg = arg.upper()
+        chart_range = chart_range.lower()
+        if chart_range not in CHART_RANGES:
+            await ctx.send(f"Range must be one of: {', '.join(CHART_RANGES)}")
+            return
+        title = f"{arg}-USD"
+        granularity = CHART_RANGES[chart_range][1]
+        key = (title, chart_range, int(time.time()) // granularity)
+        await self._send_chart(ctx, key, lambda: self._render_candle_chart(
+            ctx, arg, title, chart_range))
+        return
+
+    async def _send_chart(self, ctx, key, render) -> None:
+        """Sends the chart cached under key. On a miss, render() is awaited
+        for the png, which may be None if there is nothing to send. Misses
+        for a key that is being rendered wait for that render and its
+        upload instead of repeating them."""
+        rendering = self._rendering.get(key)
+        if rendering is not None:
+            # Shielded so a cancelled caller doesn't fail the others
+            chart = await asyncio.shield(rendering)
+        else:
+            chart = self.chart_cache.get(key)
+        if chart is not None and chart.url is not None:
+            # Already uploaded, so point an embed at the attachment instead
+            embed_message = discord.Embed()
+            embed_message.set_image(url=chart.url)
+            await self.bot.send_embed(ctx, embed_message)
             return
-        rates = np.array(rates)
-        x = rates[:, 0][:-13]
-        y = rates[:, (3, 4)][:-13].mean(1)
-        fig = plt.figure()
-        plt.plot(x, y)
-        plt.title(title.split("-")[0])
-        plt.xlabel("Last 24 Hours")
-        plt.ylabel("USD")
-        # plt.legend(["Low", "High"])
-        plt.xticks([])
-        plt.tight_layout()
-
-        plot_binary = BytesIO()
-        fig.savefig(plot_binary, format='png')
-        plot_binary.seek(0)
+        if chart is not None:
+            await self._upload_chart(ctx, chart)
+            return
+        # Nothing to share, or the shared render produced nothing and only
+        # told its own caller why, so this caller renders for itself
+        rendering = self.bot.loop.create_future()
+        self._rendering[key] = rendering
+        try:
+            png = await render()
+            if png is not None:
+                chart = self.chart_cache.put(key, png)
+                await self._upload_chart(ctx, chart)
+        finally:
+            if self._rendering.get(key) is rendering:
+                del self._rendering[key]
+            rendering.set_result(chart)
+        return
+
+    async def _upload_chart(self, ctx, chart) -> None:
+        """Sends the png of chart and remembers its attachment url."""
+        plot_binary = BytesIO(chart.png)
         file = discord.File(fp=plot_binary, filename="plot.png")
-        await ctx.send(file=file)
+        message = await ctx.send(file=file)
         plot_binary.close()
+        if message.attachments:
+            chart.url = message.attachments[0].url
+        return
+
+    async def _load_candles(self, ctx, arg, title, granularity, start):
+        """Returns the candles from start until now, or None after telling
+        the user why there are none."""
+        try:
+            candles = await self.candle_store.get(title, granularity, start)
+        except CoinbaseError as e:
+            self.bot.warning("%s", e)
+            await ctx.send("Coinbase is not responding. Try again later.")
+            return None
+        except UnknownProduct:  # if the argument is invalid
+            await ctx.send(f"No data found for {arg}.")
+            return None
+        if not len(candles):
+            await ctx.send(f"No data found for {arg}.")
+            return None
+        return candles
+
+    async def _render(self, ctx, function, *args):
+        """Renders a chart off the event loop. Returns the png bytes, or None
+        after telling the user the renderer is busy."""
+        try:
+            return await self.renderer.render(function, *args)
+        except RendererBusy as e:
+            self.bot.warning("%s", e)
+            await ctx.send("Too many charts are being drawn. Try again soon.")
+            return None
+
+    async def _render_price_chart(self, ctx, arg, title, granularity):
+        """Renders the last 24 hours of mean prices as a line chart."""
+        candles = await self._load_candles(
+            ctx, arg, title, granularity, int(time.time()) - 86400)
+        if candles is None:
+            return None
+        x = candles["time"]
+        y = (candles["low"] + candles["high"]) / 2.0
+        return await self._render(
+            ctx, render_price_line, x, y, arg, "Last 24 Hours", "USD")
+
+    async def _render_candle_chart(self, ctx, arg, title, chart_range):
+        """Renders candlesticks with indicator overlays for chart_range."""
+        seconds, granularity = CHART_RANGES[chart_range]
+        range_start = int(time.time()) - seconds
+        # Load extra candles so the moving averages are warmed up on screen
+        candles = await self._load_candles(
+            ctx, arg, title, granularity,
+            range_start - INDICATOR_WARMUP * granularity)
+        if candles is None:
+            return None
+        closes = candles["close"]
+        first = np.searchsorted(candles["time"], range_start)
+        overlays = {
+            "SMA 20": sma(closes, 20)[first:],
+            "EMA 50": ema(closes, 50)[first:],
+        }
+        candles = candles[first:]
+        if not len(candles):
+            await ctx.send(f"No data found for {arg}.")
+            return None
+        overlays["VWAP"] = vwap(candles)
+        # Merge candles so render time doesn't grow with the range
+        edges = bucket_edges(len(candles), CHART_MAX_CANDLES)
+        candles = downsample_ohlc(candles, edges)
+        overlays = {label: downsample_line(values, edges)
+                    for label, values in overlays.items()}
+        return await self._render(ctx, render_candlesticks, candles,
+                                  overlays, f"{arg} ({chart_range})")
 
 
 # setup command for the cog
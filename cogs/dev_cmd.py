@@ -1,11 +1,21 @@
+import asyncio
 import discord
+import threading
+from io import BytesIO
+from time import perf_counter
 from discord.ext.commands.errors import (
     ExtensionNotLoaded,
     ExtensionNotFound,
     ExtensionFailed,
     NoEntryPointError
 )
-from discord.ext import commands
+from discord.ext import commands, tasks
+from cogs._profiling import CallProfiler, MemoryTracker, StackSampler
+from gateway import cache_report
+
+# $profile runs for at most this many seconds, however many commands it waits
+# for
+PROFILE_MAX_SECONDS = 600
 
 
 # Cog used for reloading updated cogs while bot is running
@@ -13,18 +23,45 @@ class DevCmd(commands.Cog):
     # Initializes the cog.
     def __init__(self, bot):
         self.bot = bot
+        # Channel that $watch_cogs reports automatic reloads to
+        self._watch_channel = None
+        # The profiler $profile is running, if any
+        self._profiler = None
+        # Commands $profile still waits for, and the event set once none are
+        # left
+        self._commands_left = 0
+        self._commands_done = asyncio.Event()
+        self.memory_tracker = MemoryTracker()
+        # Owner commands that run on every cluster
+        self.bot.ipc.register("reload_all", self.__reload_all_here)
+        self.bot.ipc.register("stats", self.__stats_here)
+        return
+
+    def cog_unload(self):
+        """Stops watching the cogs tree. stop() rather than cancel() lets
+        the watcher finish reporting when it is reloading this very cog.
+        Profilers stop too, as nothing could report them anymore."""
+        self.bot.ipc.unregister("reload_all")
+        self.bot.ipc.unregister("stats")
+        self.watch_cogs_loop.stop()
+        if self._profiler is not None:
+            self._profiler.stop()
+        if self.memory_tracker.running:
+            self.memory_tracker.stop()
         return
 
     def __reload_extension(self, extension: str) -> str:
         """Helper function that reloads the given extension. Returns a string
         with info about whether the extension reloaded properly or not."""
+        start = perf_counter()
         try:
             self.bot.reload_extension(extension)
         except (ExtensionNotLoaded, ExtensionNotFound,
                 ExtensionFailed, NoEntryPointError) as error:
             msg = f"For {extension}:\n{error}"
         else:
-            msg = f"{extension} successfully reloaded."
+            msg = (f"{extension} successfully reloaded in "
+                   f"{(perf_counter() - start) * 1000:.0f} ms.")
         return msg
 
     def __unload_extension(self, extension: str) -> str:
@@ -41,23 +78,25 @@ class DevCmd(commands.Cog):
     @commands.command()
     @commands.is_owner()
     async def reload(self, ctx, arg):
-        """Reloads a single extension"""
-        self.bot.warning(f"Reloading {arg} extension.")
-        # Search extension list for the argument
-        for extension in self.bot.extensions.keys():
-            if extension.endswith(arg):
-                msg = self.__reload_extension(extension)
-                break
-        else:  # No break statement happened --> arg wasn't in extension list
+        """Reloads a single extension, e.g. crypto_cmd or
+        cryptocurrencies.crypto_cmd"""
+        self.bot.warning("Reloading %s extension.", arg)
+        # Search extension list for the argument, matching whole name parts
+        # so "cmd" doesn't pick whichever extension ending in cmd comes first
+        matches = [extension for extension in self.bot.extensions.keys()
+                   if extension == arg or extension.endswith(f".{arg}")]
+        if len(matches) == 1:
+            msg = self.__reload_extension(matches[0])
+        elif matches:
+            msg = f"{arg} is ambiguous: {', '.join(matches)}"
+        else:
             msg = f"{arg} was not found in the loaded extension list."
         self.bot.info(msg)
         await ctx.send(msg)
         return
 
-    @commands.command()
-    @commands.is_owner()
-    async def reload_all(self, ctx):
-        """Reloads all currently running extensions"""
+    async def __reload_all_here(self) -> str:
+        """Reloads every extension of this cluster."""
         self.bot.warning("Reloading all extensions.")
         msg = ""
         # Iterate through all extensions in bot's extension list and reload them
@@ -66,7 +105,67 @@ class DevCmd(commands.Cog):
             msg += self.__reload_extension(extension) + "\n"
         msg = msg[:-1]  # get rid of trailing newline
         self.bot.info(msg)
-        await ctx.send(msg)
+        return msg
+
+    async def __on_every_cluster(self, name: str) -> dict:
+        """Runs an IPC handler on every cluster. Returns cluster id -> its
+        reply, with clusters that failed replying the error text."""
+        replies = await self.bot.ipc.broadcast(name)
+        return {cluster_id: f"{reply}" if isinstance(reply, Exception)
+                else reply for cluster_id, reply in replies.items()}
+
+    @commands.command()
+    @commands.is_owner()
+    async def reload_all(self, ctx):
+        """Reloads all currently running extensions, on every cluster"""
+        replies = await self.__on_every_cluster("reload_all")
+        if len(replies) == 1:
+            msg = replies[0]
+        else:
+            msg = "\n".join(f"Cluster {cluster_id}:\n{reply}"
+                            for cluster_id, reply in replies.items())
+        await self.bot.send_message(ctx, msg)
+        return
+
+    @commands.command()
+    @commands.is_owner()
+    async def reload_changed(self, ctx):
+        """Reloads only the extensions whose files, or the files they
+        import, changed since they were loaded"""
+        self.bot.warning("Reloading changed extensions.")
+        start = perf_counter()
+        results = self.bot.reload_changed_extensions()
+        if not results:
+            await ctx.send("No extensions changed.")
+            return
+        results.append(f"Done in {(perf_counter() - start) * 1000:.0f} ms.")
+        await self.bot.send_message(ctx, "\n".join(results))
+        return
+
+    @commands.command()
+    @commands.is_owner()
+    async def watch_cogs(self, ctx, seconds: float = 2.0):
+        """Reloads changed extensions automatically, checking every few
+        seconds. $watch_cogs 0 stops watching"""
+        if seconds <= 0:
+            self.watch_cogs_loop.stop()
+            self._watch_channel = None
+            await ctx.send("Stopped watching the cogs folder.")
+            return
+        self._watch_channel = ctx.channel
+        self.watch_cogs_loop.change_interval(seconds=max(seconds, 0.5))
+        if not self.watch_cogs_loop.is_running():
+            self.watch_cogs_loop.start()
+        await ctx.send(f"Watching the cogs folder every {seconds:g}s. "
+                       "Changes to this cog stop the watcher.")
+        return
+
+    @tasks.loop(seconds=2.0)
+    async def watch_cogs_loop(self):
+        results = self.bot.reload_changed_extensions()
+        if results and self._watch_channel is not None:
+            await self.bot.send_message(
+                self._watch_channel, "\n".join(results))
         return
 
     @commands.command()
@@ -80,9 +179,158 @@ class DevCmd(commands.Cog):
             msg += "\n"
         # Reset the extensions
         self.bot.load_all_extensions()
+        await self.bot.load_deferred_extensions()
         for extension in self.bot.extensions.keys():
             msg += f"{extension} loaded.\n"
-        await ctx.send(msg[:-1])
+        await self.bot.send_message(ctx, msg[:-1])
+        return
+
+    @commands.command()
+    @commands.is_owner()
+    async def load_times(self, ctx):
+        """Shows how long each extension took to load"""
+        await self.bot.send_message(
+            ctx, f"```\n{self.bot.extension_report()}\n```")
+        return
+
+    async def __stats_here(self) -> dict:
+        """Returns this cluster's guilds, shards and report."""
+        msg = self.bot.metrics.report()
+        msg += f"\nOutbound: {self.bot.outbound.report()}"
+        msg += f"\nDatabase: {self.bot.db.report()}"
+        msg += f"\nLogs: {self.bot.log_pipeline.report()}"
+        if self.bot.cluster_count > 1:
+            msg += f"\nIPC: {self.bot.ipc.report()}"
+        return {
+            "guilds": len(self.bot.guilds),
+            "shards": sorted(self.bot.shard_ids or self.bot.shards),
+            "report": msg,
+        }
+
+    @commands.command()
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """Shows command latencies, event loop lag and the bot's queues, for
+        every cluster"""
+        replies = await self.__on_every_cluster("stats")
+        if len(replies) == 1:
+            reply = replies[0]
+            msg = reply["report"] if isinstance(reply, dict) else reply
+            await self.bot.send_message(ctx, f"```\n{msg}\n```")
+            return
+        answered = [reply for reply in replies.values()
+                    if isinstance(reply, dict)]
+        msg = (f"{sum(reply['guilds'] for reply in answered)} guilds on "
+               f"{sum(len(reply['shards']) for reply in answered)} shards, "
+               f"{len(answered)}/{len(replies)} clusters answering")
+        for cluster_id, reply in replies.items():
+            if isinstance(reply, dict):
+                shards = reply["shards"] or ["none"]
+                msg += (f"\n\nCluster {cluster_id}, shards {shards[0]}-"
+                        f"{shards[-1]}, {reply['guilds']} guilds:\n"
+                        f"{reply['report']}")
+            else:
+                msg += f"\n\nCluster {cluster_id}: {reply}"
+        await self.bot.send_message(ctx, f"```\n{msg}\n```")
+        return
+
+    # Dispatched by DiscordBot.invoke whether the command failed or not.
+    # Errors are left to DiscordBot.on_command_error, which logs them.
+    @commands.Cog.listener()
+    async def on_command_finished(self, ctx):
+        if self._commands_left > 0:
+            self._commands_left -= 1
+            if self._commands_left == 0:
+                self._commands_done.set()
+        return
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx, mode="sample", amount: float = 30.0,
+                      unit="seconds"):
+        """Profiles the bot for some seconds or commands and sends the
+        hotspots, e.g. $profile sample 30 or $profile calls 20 commands.
+        sample is cheap, calls is exact but slows the bot down meanwhile."""
+        if mode not in ("sample", "calls") or unit not in (
+                "s", "seconds", "commands"):
+            await ctx.send("Use `$profile sample 30` or "
+                           "`$profile calls 20 commands`.")
+            return
+        if self._profiler is not None:
+            await ctx.send("A profile is already running.")
+            return
+        if mode == "sample":
+            # This runs on the event loop's thread, which is what to sample
+            self._profiler = StackSampler(threading.get_ident())
+        else:
+            self._profiler = CallProfiler()
+        if unit == "commands":
+            self._commands_left = max(1, int(amount))
+            self._commands_done.clear()
+            what = f"the next {self._commands_left} commands"
+        else:
+            amount = min(max(amount, 1.0), PROFILE_MAX_SECONDS)
+            what = f"{amount:.0f} seconds"
+        self.bot.warning("Profiling (%s) for %s.", mode, what)
+        await ctx.send(f"Profiling ({mode}) for {what}.")
+        start = perf_counter()
+        self._profiler.start()
+        try:
+            if unit == "commands":
+                await asyncio.wait_for(
+                    self._commands_done.wait(), PROFILE_MAX_SECONDS)
+            else:
+                await asyncio.sleep(amount)
+        except asyncio.TimeoutError:
+            pass  # Report what was seen until the limit
+        finally:
+            profiler, self._profiler = self._profiler, None
+            self._commands_left = 0
+            profiler.stop()
+        elapsed = perf_counter() - start
+        files = [discord.File(BytesIO(profiler.report().encode()),
+                              filename=f"profile-{mode}.txt")]
+        if mode == "sample":
+            files.append(discord.File(BytesIO(profiler.collapsed().encode()),
+                                      filename="profile-stacks.txt"))
+        else:
+            files.append(discord.File(BytesIO(profiler.dump()),
+                                      filename="profile.pstats"))
+        await ctx.send(f"Profiled {elapsed:.1f} seconds.", files=files)
+        return
+
+    @commands.command()
+    @commands.is_owner()
+    async def memory(self, ctx, action="diff", top: int = 25):
+        """Finds memory growth with tracemalloc: $memory start takes a
+        baseline, $memory diff shows what grew since and $memory stop ends
+        tracing, which slows allocations while it runs. $memory caches
+        estimates what discord.py's caches hold, per cache and per guild"""
+        loop = asyncio.get_event_loop()
+        if action == "start":
+            # Snapshots walk every traced block, so keep them off the loop
+            await loop.run_in_executor(None, self.memory_tracker.start)
+            await ctx.send("Tracing allocations. Use `$memory diff` later.")
+        elif action == "diff":
+            if not self.memory_tracker.running:
+                await ctx.send("Not tracing. Use `$memory start` first.")
+                return
+            report = await loop.run_in_executor(
+                None, self.memory_tracker.diff, top)
+            await ctx.send("Memory growth since `$memory start`:", file=(
+                discord.File(BytesIO(report.encode()), filename="memory.txt")))
+        elif action == "stop":
+            self.memory_tracker.stop()
+            await ctx.send("Stopped tracing allocations.")
+        elif action == "caches":
+            # The caches change under a thread, so measure on the loop. The
+            # report samples, which keeps this short.
+            report = cache_report(self.bot, top)
+            await ctx.send("Estimated cache memory:", file=(
+                discord.File(BytesIO(report.encode()), filename="caches.txt")))
+        else:
+            await ctx.send("Use `$memory start`, `$memory diff`, "
+                           "`$memory stop` or `$memory caches`.")
         return
 
     @commands.command()
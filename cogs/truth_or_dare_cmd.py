@@ -219,7 +219,8 @@ class TruthOrDareCmd(commands.Cog):
                 while self.players[ctx.guild.id][0] == ctx.author:
                     shuffle(self.players[ctx.guild.id])
             self.last_roll[ctx.guild.id] = ctx.author
-            message = f"{self.players[0].mention}, truth or dare?"
+            player = self.players[ctx.guild.id][0]
+            message = f"{player.mention}, truth or dare?"
             await ctx.send(message)
 
     @tod_roll.error
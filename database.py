@@ -0,0 +1,228 @@
+import asyncio
+import json
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Embedded store shared by every cog through bot.db. SQLite runs in WAL mode
+# on a single dedicated thread, so statements never block the event loop and
+# the one connection never needs locking. Writes are queued and committed in
+# batches, one transaction each, so command handlers don't wait on the disk.
+
+KV_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID
+"""
+KV_GET = "SELECT value FROM kv WHERE namespace = ? AND key = ?"
+KV_ITEMS = "SELECT key, value FROM kv WHERE namespace = ?"
+KV_SET = "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)"
+KV_DELETE = "DELETE FROM kv WHERE namespace = ? AND key = ?"
+# Marks a cached key that is known not to exist
+_MISSING = object()
+
+
+class Database:
+    """Async facade over one SQLite connection.
+
+    write() queues a statement and returns at once. Queued statements are
+    committed flush_interval seconds later, or as soon as max_batch are
+    waiting, and runs of the same statement go through executemany so
+    SQLite prepares them once. Reads run after every write queued before
+    them, so a cog always reads what it wrote. await flush() when a write
+    must be on disk before going on.
+
+    get(), set() and delete() are a json key-value store on top, namespaced
+    per cog, with an LRU read-through cache of cache_size keys. Cached values
+    are shared, so change a value by set()ing it again, not in place."""
+
+    def __init__(self, path, logger, flush_interval=0.05, max_batch=1000,
+                 cache_size=1024):
+        self.path = path
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="database")
+        self._connection = None
+        # (sql, params) tuples waiting for the next batch
+        self._pending = list()
+        self._flush_handle = None
+        self._last_batch = None
+        # (namespace, key) -> value or _MISSING
+        self._cache = OrderedDict()
+        self.stats = {
+            "writes": 0,
+            "batches": 0,
+            "largest_batch": 0,
+            "failed_writes": 0,
+            "reads": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+        }
+        return
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens the connection. Only ever called on the database thread."""
+        if self._connection is None:
+            # isolation_level=None leaves transactions to _write_batch
+            self._connection = sqlite3.connect(
+                self.path, isolation_level=None, cached_statements=256)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only syncs at checkpoints and stays crash safe
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(KV_SCHEMA)
+        return self._connection
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    def write(self, sql: str, params=()) -> None:
+        """Queues a write for the next batch without waiting for it."""
+        self._pending.append((sql, params))
+        self.stats["writes"] += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                self.flush_interval, self._flush)
+        return
+
+    def _flush(self) -> asyncio.Future:
+        """Hands the queued writes to the database thread and returns the
+        future of that batch, or of the last one if nothing was queued."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending:
+            batch, self._pending = self._pending, list()
+            loop = asyncio.get_event_loop()
+            self._last_batch = loop.run_in_executor(
+                self._executor, self._write_batch, batch)
+            self._last_batch.add_done_callback(self._batch_done)
+        return self._last_batch
+
+    def _batch_done(self, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error("Database batch failed: %r", future.exception())
+        return
+
+    def _write_batch(self, batch: list) -> None:
+        """Commits a batch in one transaction. If the transaction fails, the
+        statements are retried one by one so one bad write can't take the
+        rest of the batch down with it."""
+        connection = self._connect()
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(
+            self.stats["largest_batch"], len(batch))
+        try:
+            connection.execute("BEGIN")
+            index = 0
+            while index < len(batch):
+                # Group runs of one statement so it is prepared once
+                sql = batch[index][0]
+                end = index
+                while end < len(batch) and batch[end][0] == sql:
+                    end += 1
+                connection.executemany(
+                    sql, [params for _, params in batch[index:end]])
+                index = end
+            connection.execute("COMMIT")
+            return
+        except sqlite3.Error:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+        for sql, params in batch:
+            try:
+                connection.execute(sql, params)
+            except sqlite3.Error as e:
+                self.stats["failed_writes"] += 1
+                self.logger.error("Database write failed: %s\n%s", e, sql)
+        return
+
+    async def flush(self) -> None:
+        """Waits until every write queued so far is committed."""
+        batch = self._flush()
+        if batch is not None:
+            await asyncio.shield(batch)
+        return
+
+    def _read(self, sql: str, params, many: bool):
+        cursor = self._connect().execute(sql, params)
+        return cursor.fetchall() if many else cursor.fetchone()
+
+    async def fetchone(self, sql: str, params=()):
+        """Runs a query after the queued writes and returns its first row."""
+        self._flush()
+        self.stats["reads"] += 1
+        return await self._run(self._read, sql, params, False)
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        """Runs a query after the queued writes and returns every row."""
+        self._flush()
+        self.stats["reads"] += 1
+        return await self._run(self._read, sql, params, True)
+
+    def _cache_put(self, namespace: str, key: str, value) -> None:
+        self._cache[(namespace, key)] = value
+        self._cache.move_to_end((namespace, key))
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return
+
+    async def get(self, namespace: str, key, default=None):
+        """Returns the value stored under key, or default."""
+        key = str(key)
+        if (namespace, key) in self._cache:
+            self.stats["cache_hits"] += 1
+            self._cache.move_to_end((namespace, key))
+            value = self._cache[(namespace, key)]
+            return default if value is _MISSING else value
+        self.stats["cache_misses"] += 1
+        row = await self.fetchone(KV_GET, (namespace, key))
+        # A set() while the read was running is newer than the row
+        if (namespace, key) in self._cache:
+            value = self._cache[(namespace, key)]
+        else:
+            value = _MISSING if row is None else json.loads(row[0])
+            self._cache_put(namespace, key, value)
+        return default if value is _MISSING else value
+
+    def set(self, namespace: str, key, value) -> None:
+        """Stores a json serializable value under key. The cache sees it
+        right away and the disk with the next batch."""
+        key = str(key)
+        self.write(KV_SET, (namespace, key, json.dumps(value)))
+        self._cache_put(namespace, key, value)
+        return
+
+    def delete(self, namespace: str, key) -> None:
+        """Removes key if it exists."""
+        key = str(key)
+        self.write(KV_DELETE, (namespace, key))
+        self._cache_put(namespace, key, _MISSING)
+        return
+
+    async def items(self, namespace: str) -> dict:
+        """Returns every key and value stored in namespace."""
+        rows = await self.fetchall(KV_ITEMS, (namespace,))
+        return {key: json.loads(value) for key, value in rows}
+
+    async def close(self) -> None:
+        """Commits the queued writes and closes the connection."""
+        await self.flush()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=True)
+        return
+
+    def report(self) -> str:
+        """Returns a one line summary of the database counters."""
+        counters = ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        return f"{len(self._pending)} writes queued, {counters}"
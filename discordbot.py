@@ -1,67 +1,175 @@
 import logging
-from logging.handlers import QueueHandler, QueueListener
-from queue import Queue
 from atexit import register
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from time import perf_counter
+import ast
+import asyncio
+import hashlib
+import importlib
+import json
 import os
 import sys
 from dotenv import load_dotenv
+import aiohttp
 import discord
 from discord.ext import commands
 from discord.ext.commands.errors import (
+    ExtensionError,
     ExtensionNotFound,
     ExtensionAlreadyLoaded,
     ExtensionFailed,
     NoEntryPointError
 )
+from cluster import ClusterIPC, cluster_path
+from database import Database
+from embeds import EmbedPages, EmbedPaginator, EmbedTemplate
+from gateway import (
+    cache_counts,
+    declared,
+    describe_options,
+    lean_options,
+    missing_intents,
+    read_declarations
+)
+from logs import LogPipeline
+from metrics import Metrics
+from outbound import OutboundScheduler
+
+# Chatty debug loggers, relative to the bot's logger, and the one in n of
+# their debug records that is kept
+LOG_SAMPLING = {"crypto.requests": 10}
 
 
-class DiscordBot(commands.Bot):
-    def __init__(self, command_prefix="$"):
-        self.__make_logger(verbose=True)
+class DiscordBot(commands.AutoShardedBot):
+    def __init__(self, command_prefix="$", http_pool_size=100,
+                 http_pool_per_host=20, http_dns_ttl=300,
+                 http_keepalive=30.0, slow_extension_seconds=0.25,
+                 extension_times_path="extension_times.json",
+                 database_path="bot.db", log_path="bot.log",
+                 log_queue_size=10000, log_max_bytes=10 * 1024 * 1024,
+                 log_backups=5, log_rotate_when=None,
+                 log_sampling=LOG_SAMPLING, metrics_path="metrics.prom",
+                 shard_ids=None, shard_count=None, cluster_id=0,
+                 cluster_count=1, ipc_port=None, ipc_secret=None,
+                 lean=False):
+        # Clusters run a range of shards each, with their own log, metrics
+        # and extension times files. Without clustering, one process runs
+        # as many shards as discord recommends.
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
+        log_path = cluster_path(log_path, cluster_id, cluster_count)
+        metrics_path = cluster_path(metrics_path, cluster_id, cluster_count)
+        extension_times_path = cluster_path(
+            extension_times_path, cluster_id, cluster_count)
+        self.__make_logger(
+            log_path, verbose=True, queue_size=log_queue_size,
+            max_bytes=log_max_bytes, backups=log_backups,
+            when=log_rotate_when, sampling=log_sampling)
         self.info("Initializing the DiscordBot.")
-        super().__init__(command_prefix)
-        self.__load_database()
-        # embed color handling will be changed when send_embed() is implemented
-        self.embed_color = discord.Color.blue()
+        # Lean mode asks the gateway only for what the cogs declare they
+        # need, see gateway.py. Otherwise discord.py's defaults apply.
+        self.lean = lean
+        options = self.__lean_options() if lean else dict()
+        super().__init__(command_prefix, shard_ids=shard_ids,
+                         shard_count=shard_count, **options)
+        # Lets owner commands reach every cluster
+        self.ipc = ClusterIPC(cluster_id, cluster_count, logger=self,
+                              port=ipc_port, secret=ipc_secret)
+        self.__load_database(database_path)
+        # Command timings, loop lag and cog numbers, exported for Prometheus
+        self.metrics = Metrics(logger=self, path=metrics_path)
+        self.metrics.add_collector("bot", self.__collect_metrics)
+        for name, kind, help_text in (
+                ("discordbot_guilds", "gauge", "Guilds this process serves."),
+                ("discordbot_extensions", "gauge", "Loaded extensions."),
+                ("discordbot_cache_items", "gauge",
+                 "Objects in each of discord.py's caches."),
+                ("discordbot_gateway_latency_seconds", "gauge",
+                 "Heartbeat latency of each shard."),
+                ("discordbot_log_dropped_total", "counter",
+                 "Log records dropped because the queue was full.")):
+            self.metrics.describe(name, kind, help_text)
+        # The shared HTTP session is created on first use from inside the
+        # event loop. These settings tune its connection pool.
+        self._http_session = None
+        self.http_pool_options = {
+            "limit": http_pool_size,
+            "limit_per_host": http_pool_per_host,
+            "ttl_dns_cache": http_dns_ttl,
+            "keepalive_timeout": http_keepalive,
+        }
+        self.http_stats = {
+            "requests": 0,
+            "pool_hits": 0,
+            "pool_misses": 0,
+            "pool_waits": 0,
+        }
+        # Long or bursty text goes out through per-channel paced queues
+        self.outbound = OutboundScheduler(logger=self)
+        # name -> EmbedTemplate, the styling send_embed() gives embeds. Cogs
+        # may add their own.
+        self.embed_templates = {
+            "default": EmbedTemplate(colour=discord.Color.blue()),
+        }
+        # Tasks turning the pages of paginated embeds
+        self._paginators = set()
+        # Extensions that took longer than slow_extension_seconds to load last
+        # time are loaded after the gateway connects instead of before.
+        self.slow_extension_seconds = slow_extension_seconds
+        self.extension_times_path = extension_times_path
+        # extension -> (seconds to load, number of modules it imported)
+        self.extension_times = dict()
+        self._deferred_extensions = list()
+        self._late_extensions = set()
+        # Set while reloading so load errors reach commands.Bot's rollback
+        self.__reloading = False
+        # module name -> sha1 of the source that is loaded, for every module
+        # in the cogs tree, and the stat results the hashes were made from
+        self.source_hashes = dict()
+        self._source_index = dict()
         self.load_all_extensions()
         return
 
-    def __make_logger(self, filename="bot.log", verbose=False) -> None:
-        """Creates a logger with a queue handler and a queue listener. Other
-        handlers are added as desired. This allows the addition of blocking
-        handlers to be handled in their own thread."""
+    def __make_logger(self, filename="bot.log", verbose=False,
+                      **options) -> None:
+        """Creates a logger with a bounded queue handler and a queue
+        listener. The listener thread does the blocking work: formatting,
+        writing json lines to a rotating, gzipped file and readable text to
+        the console. options go to LogPipeline."""
         # Set logging level based on whether verbose is set or not
         logging_level = logging.DEBUG if verbose else logging.WARNING
         # Create the logger instance
         self._logger = logging.getLogger(__name__)
         self._logger.setLevel(logging_level)
-        # Create the queue and add a queue handler to the logger
-        que = Queue(-1)  # -1 means no size limit
-        self._logger.addHandler(QueueHandler(que))
-        # Set the format for logs
-        formatter = logging.Formatter(
-            "%(asctime)s:%(name)s:%(levelname)s:\n\t%(message)s\n"
-        )
-        # Build a list of output handlers.
-        handlers = list()
-        handlers.append(logging.StreamHandler())
-        handlers.append(logging.FileHandler(filename))
-        # Add more handlers as necessary. . .
-        # Format the handlers
-        for handler in handlers:
-            handler.setFormatter(formatter)
-        # Build the queue listener with the output handlers, start
-        # the listener, and atexit.register the listener's stop function
-        listener = QueueListener(que, *handlers)
-        listener.start()
-        register(listener.stop)
-        self.info(f"Logger successfully built with handlers: {handlers}")
-        return
-
-    def __load_database(self) -> None:
-        """Not yet implemented"""
-        self.warning("Database is not yet implemented.")
+        self.log_pipeline = LogPipeline(self._logger, filename, **options)
+        # Start the listener and atexit.register its stop function
+        self.log_pipeline.start()
+        register(self.log_pipeline.stop)
+        self.info("Logger successfully built with handlers: %s",
+                  self.log_pipeline.handlers)
+        return
+
+    def __lean_options(self) -> dict:
+        """Returns the Client options for lean mode, from the needs every
+        extension in the cogs tree declares, deferred ones included."""
+        declarations = list()
+        for item in sorted(Path("cogs").glob("**/*.py")):
+            try:
+                declarations += read_declarations(item).values()
+            except (SyntaxError, ValueError) as e:
+                # load_extension reports broken files
+                self.warning("Could not read the gateway needs of %s: %s",
+                             item, e)
+        options = lean_options(declarations)
+        self.info("Lean gateway mode, %s", describe_options(options))
+        return options
+
+    def __load_database(self, path: str) -> None:
+        """Creates the database cogs share through self.db. The file is
+        opened on the database thread by the first statement."""
+        self.info("Using database %s.", path)
+        self.db = Database(path, logger=self)
         return
 
     def __load_token(self) -> str:
@@ -77,9 +185,43 @@ class DiscordBot(commands.Bot):
         self.info("DISCORD_TOKEN found.")
         return token
 
+    @property
+    def http_session(self) -> aiohttp.ClientSession:
+        """Returns the HTTP session shared by every cog. Cogs should borrow
+        this session instead of opening their own and must never close it."""
+        if self._http_session is None or self._http_session.closed:
+            self.info("Opening HTTP session: %s", self.http_pool_options)
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(self.__on_http_request)
+            trace_config.on_connection_reuseconn.append(self.__on_pool_hit)
+            trace_config.on_connection_create_end.append(self.__on_pool_miss)
+            trace_config.on_connection_queued_start.append(self.__on_pool_wait)
+            self._http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**self.http_pool_options),
+                trace_configs=[trace_config]
+            )
+        return self._http_session
+
+    async def __on_http_request(self, session, context, params) -> None:
+        self.http_stats["requests"] += 1
+        return
+
+    async def __on_pool_hit(self, session, context, params) -> None:
+        self.http_stats["pool_hits"] += 1
+        return
+
+    async def __on_pool_miss(self, session, context, params) -> None:
+        self.http_stats["pool_misses"] += 1
+        return
+
+    async def __on_pool_wait(self, session, context, params) -> None:
+        self.http_stats["pool_waits"] += 1
+        return
+
     def load_all_extensions(self) -> None:
         """Finds all .py files within the cogs folder tree and loads them as
-        extensions."""
+        extensions. Extensions that were slow to load last time are held back
+        for load_deferred_extensions() so they don't delay connecting."""
         self.info("Loading all extensions from cogs folder.")
         folder_path = Path("cogs")
         if folder_path.exists():
@@ -87,26 +229,374 @@ class DiscordBot(commands.Bot):
         else:
             self.warning("No cogs folder exists.")
             return
-        for item in folder_path.glob("**/*.py"):
+        last_times = self.__read_extension_times()
+        self.__forget_changed_helpers()
+        for item in sorted(folder_path.glob("**/*.py")):
+            # Modules starting with an underscore are helpers, not extensions
+            if item.name.startswith("_"):
+                continue
             # Generate the extension name in the proper format and load it
-            path = item.relative_to(folder_path.parent)
-            extension = str(path).replace("\\", ".")[:-3]  # [:-3] strips ".py"
+            path = item.relative_to(folder_path.parent).with_suffix("")
+            extension = ".".join(path.parts)
+            if last_times.get(extension, 0.0) > self.slow_extension_seconds:
+                self._deferred_extensions.append(extension)
+                continue
             self.load_extension(extension)
-        if not self.extensions:
+        if self._deferred_extensions:
+            self.info("Deferring slow extensions until connected: %s",
+                      ', '.join(self._deferred_extensions))
+        elif not self.extensions:
             self.warning("No extensions are loaded.")
         self.info("Loading extensions is complete.")
+        self.info(self.extension_report())
+        self.__save_extension_times()
+        return
+
+    async def load_deferred_extensions(self) -> None:
+        """Loads the extensions load_all_extensions() held back. Their
+        imports run in worker threads first, all at once, so the event loop
+        keeps answering while the heavy modules load."""
+        deferred, self._deferred_extensions = self._deferred_extensions, list()
+        if not deferred:
+            return
+        self.info("Loading deferred extensions: %s", ', '.join(deferred))
+        with ThreadPoolExecutor(max_workers=len(deferred)) as pool:
+            prewarm_times = await asyncio.gather(*(
+                self.loop.run_in_executor(pool, self.__prewarm, extension)
+                for extension in deferred))
+        for extension, prewarm in zip(deferred, prewarm_times):
+            self.load_extension(extension, prewarm)
+            self._late_extensions.add(extension)
+        self.info(self.extension_report())
+        self.__save_extension_times()
+        return
+
+    @staticmethod
+    def __prewarm(extension: str):
+        """Imports an extension's module so that the modules it depends on
+        are cached. Returns (seconds, modules imported). Errors are left for
+        load_extension to report."""
+        modules = len(sys.modules)
+        start = perf_counter()
+        try:
+            importlib.import_module(extension)
+        except Exception:
+            pass
+        return perf_counter() - start, len(sys.modules) - modules
+
+    @staticmethod
+    def __is_helper(module: str) -> bool:
+        """Modules starting with an underscore are helpers, not extensions"""
+        return module.rsplit(".", 1)[-1].startswith("_")
+
+    @staticmethod
+    def __parse_imports(module: str, source: bytes) -> set:
+        """Returns the names of every module imported by source, including
+        names passed to lazy_import(). Imported names that aren't modules
+        are harmless extras."""
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            return set()
+        imports = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imports.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                if node.level:  # Resolve relative imports
+                    package = module.rsplit(".", node.level)[0]
+                    base = f"{package}.{base}" if base else package
+                imports.add(base)
+                imports.update(f"{base}.{alias.name}" for alias in node.names)
+            elif (isinstance(node, ast.Call)
+                  and getattr(node.func, "id", None) == "lazy_import"
+                  and node.args and isinstance(node.args[0], ast.Constant)):
+                imports.add(node.args[0].value)
+        return imports
+
+    def __scan_sources(self) -> dict:
+        """Returns module name -> (sha1, imported modules) for every module
+        in the cogs tree. Files are only read again when their size or
+        modification time changed since the last scan."""
+        index = dict()
+        for item in Path("cogs").glob("**/*.py"):
+            module = ".".join(item.with_suffix("").parts)
+            try:
+                stat = item.stat()
+                key = (stat.st_mtime_ns, stat.st_size)
+                entry = self._source_index.get(module)
+                if entry is None or entry[0] != key:
+                    source = item.read_bytes()
+                    entry = (key, hashlib.sha1(source).hexdigest(),
+                             self.__parse_imports(module, source))
+            except OSError:
+                continue  # Deleted mid scan, the next scan catches it
+            index[module] = entry
+        self._source_index = index
+        return {module: entry[1:] for module, entry in index.items()}
+
+    def __forget_changed_helpers(self) -> None:
+        """Drops helper modules whose source changed from sys.modules, so
+        the extensions loaded next import them fresh."""
+        sources = self.__scan_sources()
+        for module, (digest, _) in sources.items():
+            if (self.__is_helper(module)
+                    and self.source_hashes.get(module) != digest):
+                sys.modules.pop(module, None)
+        self.source_hashes = {module: digest
+                              for module, (digest, _) in sources.items()}
+        return
+
+    def __record_source(self, module: str) -> None:
+        """Remembers the hash of the source an extension was loaded from."""
+        path = Path(*module.split(".")).with_suffix(".py")
+        try:
+            self.source_hashes[module] = hashlib.sha1(
+                path.read_bytes()).hexdigest()
+        except OSError:
+            pass
         return
 
-    def load_extension(self, extension: str) -> None:
+    def reload_changed_extensions(self) -> list:
+        """Reloads only the extensions whose source changed since they were
+        loaded, or that import a module whose source changed, directly or
+        through other modules. Changed helpers are imported fresh. Loads new
+        extension files and unloads deleted ones. Everything else keeps its
+        state. Returns one line per extension with the time it took."""
+        sources = self.__scan_sources()
+        changed = {module for module in sources.keys() | self.source_hashes
+                   if sources.get(module, (None,))[0]
+                   != self.source_hashes.get(module)}
+        if not changed:
+            return list()
+        # Walk the import graph backwards to find every dependent
+        dependents = dict()
+        for module, (_, imports) in sources.items():
+            for imported in imports & sources.keys():
+                dependents.setdefault(imported, set()).add(module)
+        affected = set(changed)
+        stack = list(changed)
+        while stack:
+            for dependent in dependents.get(stack.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    stack.append(dependent)
+        for module in affected:
+            if self.__is_helper(module):
+                sys.modules.pop(module, None)
+                if module in sources:
+                    self.source_hashes[module] = sources[module][0]
+                else:
+                    self.source_hashes.pop(module, None)
+        results = list()
+        for module in sorted(affected):
+            if (self.__is_helper(module)
+                    or module in self._deferred_extensions):
+                continue
+            start = perf_counter()
+            try:
+                if module not in sources:
+                    super().unload_extension(module)
+                    action = "unloaded"
+                elif module in self.extensions:
+                    self.reload_extension(module)
+                    action = "reloaded"
+                else:
+                    super().load_extension(module)
+                    action = "loaded"
+            except ExtensionError as error:
+                # A failed reload keeps the old code, so keep the old hash
+                self.exception("In %s:\n%s", module, error)
+                results.append(f"{module} failed: {error}")
+                continue
+            if module in sources:
+                self.source_hashes[module] = sources[module][0]
+            else:
+                self.source_hashes.pop(module, None)
+            results.append(f"{module} {action} in "
+                           f"{(perf_counter() - start) * 1000:.0f} ms.")
+        for line in results:
+            self.info(line)
+        return results
+
+    def load_extension(self, extension: str, prewarm=(0.0, 0)) -> None:
         """Loads the given extension while handling errors by providing
-        feedback to the logger and ignoring invalid extension names"""
+        feedback to the logger and ignoring invalid extension names. The time
+        it takes is recorded in extension_times, plus any prewarm time."""
+        modules = len(sys.modules)
+        start = perf_counter()
         try:
             super().load_extension(extension)
         except (ExtensionNotFound, ExtensionAlreadyLoaded,
                 ExtensionFailed, NoEntryPointError) as error:
-            self.exception(f"In {extension}:\n{error}")
-        else:
-            self.info(f"{extension} loaded successfully.")
+            if self.__reloading:
+                raise
+            self.exception("In %s:\n%s", extension, error)
+            return
+        self.__record_source(extension)
+        self.__check_intents(extension)
+        seconds = perf_counter() - start + prewarm[0]
+        imported = len(sys.modules) - modules + prewarm[1]
+        self.extension_times[extension] = (seconds, imported)
+        self.info("%s loaded successfully in %.0f ms (%s new modules).",
+                  extension, seconds * 1000, imported)
+        return
+
+    def __check_intents(self, extension: str) -> None:
+        """Warns if the cogs of an extension need intents lean mode didn't
+        ask for, e.g. because they were declared at runtime."""
+        if not self.lean:
+            return
+        declarations = [declared(cog) for cog in self.cogs.values()
+                        if type(cog).__module__ == extension]
+        missing = missing_intents(declarations, self.intents)
+        if missing:
+            self.warning("%s needs intents lean mode didn't ask for: %s. "
+                         "Restart the bot.", extension, ', '.join(missing))
+        return
+
+    def reload_extension(self, extension: str) -> None:
+        """Reloads an extension and remembers the source it now runs, so
+        reload_changed_extensions() doesn't reload it again. If the new
+        code fails to load, the old code keeps running and the error is
+        raised."""
+        self.__reloading = True
+        try:
+            super().reload_extension(extension)
+        finally:
+            self.__reloading = False
+        self.__record_source(extension)
+        return
+
+    def extension_report(self) -> str:
+        """Returns the load time of every extension, slowest first. Modules
+        shared by several extensions count towards whichever loaded first,
+        so counts are approximate for extensions prewarmed together."""
+        rows = sorted(self.extension_times.items(),
+                      key=lambda item: item[1][0], reverse=True)
+        lines = [f"{'Extension':<36} {'Load':>8} {'Modules':>8}"]
+        for extension, (seconds, imported) in rows:
+            note = " (deferred)" if extension in self._late_extensions else ""
+            lines.append(f"{extension:<36} {seconds * 1000:>5.0f} ms "
+                         f"{imported:>8}{note}")
+        for extension in self._deferred_extensions:
+            lines.append(f"{extension:<36} {'pending':>8}")
+        total = sum(seconds for seconds, _ in self.extension_times.values())
+        lines.append(f"{'Total':<36} {total * 1000:>5.0f} ms")
+        return "\n".join(lines)
+
+    def __read_extension_times(self) -> dict:
+        """Returns extension -> seconds from the last run, if recorded."""
+        path = self.extension_times_path
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError) as e:
+            self.warning("Could not read %s: %s", path, e)
+            return dict()
+
+    def __save_extension_times(self) -> None:
+        """Records how long each extension took so the next start knows
+        which ones to defer."""
+        times = self.__read_extension_times()
+        times.update({extension: round(seconds, 4) for extension, (
+            seconds, _) in self.extension_times.items()})
+        path = self.extension_times_path
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(times, file, indent=4, sort_keys=True)
+        except OSError as e:
+            self.warning("Could not save extension load times: %s", e)
+        return
+
+    def __collect_metrics(self) -> list:
+        """Returns the bot's own counters as metric samples."""
+        samples = list()
+        for group, stats in (("http", self.http_stats),
+                             ("db", self.db.stats),
+                             ("outbound", self.outbound.stats)):
+            for key, value in stats.items():
+                # Every counter only grows except the biggest batch seen
+                suffix = "" if key == "largest_batch" else "_total"
+                samples.append((f"discordbot_{group}_{key}{suffix}", dict(),
+                                value))
+        samples.append(("discordbot_log_dropped_total", dict(),
+                        self.log_pipeline.handler.dropped))
+        samples.append(("discordbot_extensions", dict(), len(self.extensions)))
+        samples.append(("discordbot_guilds", dict(), len(self.guilds)))
+        for cache, items in cache_counts(self).items():
+            samples.append(("discordbot_cache_items", {"cache": cache},
+                            items))
+        for key, value in self.ipc.stats.items():
+            samples.append((f"discordbot_ipc_{key}_total", dict(), value))
+        if self.is_ready():
+            for shard_id, latency in self.latencies:
+                samples.append(("discordbot_gateway_latency_seconds",
+                                {"shard": shard_id}, latency))
+        return samples
+
+    async def invoke(self, ctx) -> None:
+        """Invokes a command like commands.Bot does and records how long it
+        took, and whether it failed, in metrics. Then dispatches
+        on_command_finished, which cogs can listen to for every command
+        that ran, failed or not."""
+        start = perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            if ctx.command is not None:
+                self.metrics.observe_command(
+                    ctx.command.qualified_name, perf_counter() - start,
+                    ctx.command_failed)
+                self.dispatch("command_finished", ctx)
+        return
+
+    async def on_command_error(self, ctx, error) -> None:
+        """Counts the error in metrics and logs it, with its traceback
+        unless the user got the command wrong. commands.Bot's handler only
+        prints to stderr, and not at all once any cog listens to
+        on_command_error, so it isn't called. Commands and cogs with error
+        handlers of their own are left to them."""
+        command = ctx.command.qualified_name if ctx.command else "unknown"
+        self.metrics.count_error(command, type(error).__name__)
+        if hasattr(ctx.command, "on_error"):
+            return
+        if ctx.cog is not None and commands.Cog._get_overridden_method(
+                ctx.cog.cog_command_error) is not None:
+            return
+        if isinstance(error, (commands.UserInputError,
+                              commands.CommandNotFound,
+                              commands.CheckFailure)):
+            self.info("%s in %s: %s", type(error).__name__, command, error)
+            return
+        self.error("Ignoring exception in command %s:", command,
+                   exc_info=(type(error), error, error.__traceback__))
+        return
+
+    def cluster_path(self, path: str) -> str:
+        """Returns the name this cluster should use for a file other
+        clusters would write too, like a cache."""
+        return cluster_path(path, self.cluster_id, self.cluster_count)
+
+    def owns_guild(self, guild_id) -> bool:
+        """Returns whether guild_id is on one of this process's shards, so
+        cogs can keep state only for the guilds they serve. A guild_id of
+        None, for direct messages, belongs to shard 0."""
+        if self.shard_ids is None:
+            return True
+        shard_id = 0 if guild_id is None else \
+            (guild_id >> 22) % self.shard_count
+        return shard_id in self.shard_ids
+
+    async def start(self, *args, **kwargs) -> None:
+        """Starts the metrics tasks and the IPC server, then logs in and
+        connects."""
+        self.metrics.start(self.loop)
+        await self.ipc.start()
+        await super().start(*args, **kwargs)
         return
 
     def run(self) -> None:
@@ -115,63 +605,107 @@ class DiscordBot(commands.Bot):
         super().run(self.__load_token())
         return
 
+    async def close(self) -> None:
+        """Closes the bot, then the shared HTTP session and the database once
+        no cog can use them anymore."""
+        self.outbound.close()
+        self.metrics.close()
+        await self.ipc.close()
+        for task in self._paginators:
+            task.cancel()
+        await super().close()
+        if self._http_session is not None and not self._http_session.closed:
+            self.info("Closing shared HTTP session: %s", self.http_stats)
+            await self._http_session.close()
+        self.info("Closing database: %s", self.db.report())
+        await self.db.close()
+        self.info("Closing log pipeline: %s", self.log_pipeline.report())
+        return
+
     async def on_connect(self):
-        """Logs successful discord connection"""
+        """Logs successful discord connection, then loads the extensions that
+        were held back so they didn't delay it."""
         self.info("Successfully connected to discord.")
+        await self.load_deferred_extensions()
         return
 
     async def on_ready(self):
         """Logs that bot has logged in."""
-        self.info(f"Logged in to discord as {self.user}.")
+        self.info("Logged in to discord as %s.", self.user)
         return
 
     async def send_message(self, ctx, msg) -> None:
         """Sends a message to discord. If the message is too long, it breaks it
-        up into several smaller messages. This should be used in place of
-        ctx.send() whenever the length of the message may be greater than 2000
-        characters long."""
-        if len(msg) <= 2000:
-            await ctx.send(msg)
-            return
-        message_slices = [msg[i:i+2000] for i in range(0, len(msg), 2000)]
-        for message in message_slices:
-            await ctx.send(message)
+        up into several smaller messages at line and code block boundaries.
+        This should be used in place of ctx.send() whenever the length of the
+        message may be greater than 2000 characters long. Messages to the
+        same channel are queued, merged while they wait and paced to stay
+        within discord's rate limits."""
+        await self.outbound.send(ctx, msg)
         return
 
-    async def send_embed(self, ctx, embed) -> None:
+    def embed_template(self, name="default") -> EmbedTemplate:
+        """Returns the named embed template, or the default one."""
+        return self.embed_templates.get(name, self.embed_templates["default"])
+
+    async def send_embed(self, ctx, embed, file=None, template="default",
+                         timeout=120.0) -> discord.Message:
         """Sends an embed in a standardized way so that all cogs produce
-        embeds with a consistent style."""
-        # Not yet implemented
-        pass
+        embeds with a consistent style. The template's styling fills in
+        whatever the embed doesn't set. Embeds over discord's 25 field or
+        6000 character limits are split into pages, and the author of ctx
+        can turn them with reactions for timeout seconds. Returns the
+        message."""
+        pages = EmbedPages(self.embed_template(template).apply(embed))
+        message = await ctx.send(file=file, embed=pages.page(0))
+        if len(pages) > 1:
+            author = getattr(ctx, "author", None)
+            paginator = EmbedPaginator(
+                self, message, pages, timeout=timeout,
+                user_id=author.id if author is not None else None)
+            task = self.loop.create_task(paginator.run())
+            self._paginators.add(task)
+            task.add_done_callback(self._paginators.discard)
+        return message
 
-    def debug(self, msg: str) -> None:
+    def get_logger(self, name: str) -> logging.Logger:
+        """Returns a child of the bot's logger, e.g. get_logger("crypto")
+        for one named discordbot.crypto. Its records go through the bot's
+        pipeline, and LOG_SAMPLING can thin out its debug records."""
+        return self._logger.getChild(name)
+
+    # The methods below take %-style arguments, e.g. info("%s joined", name),
+    # which are only merged into the message if the level is enabled, and
+    # then on the listener thread. extra= adds fields to the json line.
+    # Call sites pass these arguments instead of f-strings, including the
+    # helpers that are handed the bot as their logger=.
+
+    def debug(self, msg: str, *args, **kwargs) -> None:
         """Generates a logger debug message."""
-        self._logger.debug(msg)
+        self._logger.debug(msg, *args, **kwargs)
         return
 
-    def info(self, msg: str) -> None:
+    def info(self, msg: str, *args, **kwargs) -> None:
         """Generates a logger info message."""
-        self._logger.info(msg)
+        self._logger.info(msg, *args, **kwargs)
         return
 
-    def warning(self, msg: str) -> None:
+    def warning(self, msg: str, *args, **kwargs) -> None:
         """Generates a logger warning message."""
-        self._logger.warning(msg)
+        self._logger.warning(msg, *args, **kwargs)
         return
 
-    def error(self, msg: str) -> None:
+    def error(self, msg: str, *args, **kwargs) -> None:
         """Generates a logger error message."""
-        self._logger.error(msg)
+        self._logger.error(msg, *args, **kwargs)
         return
 
-    def critical(self, msg: str) -> None:
+    def critical(self, msg: str, *args, **kwargs) -> None:
         """Generates a logger critical message."""
-        self._logger.critical(msg)
+        self._logger.critical(msg, *args, **kwargs)
         return
 
-    def exception(self, msg: str) -> None:
+    def exception(self, msg: str, *args, **kwargs) -> None:
         """Generates a logger exception message."""
-        self._logger.exception(msg)
+        self._logger.exception(msg, *args, **kwargs)
         return
-
-# TODO: Implement send_embed()
@@ -0,0 +1,209 @@
+import asyncio
+import discord
+from outbound import split_message
+
+# Embed pipeline used by DiscordBot.send_embed. Templates hold the styling
+# shared by a family of embeds so every cog's embeds look alike. Embeds over
+# discord's limits are laid out as pages. Only the page being viewed is built,
+# and users turn pages with reactions.
+
+TITLE_LIMIT = 256
+DESCRIPTION_LIMIT = 4096
+FIELD_COUNT_LIMIT = 25
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+FOOTER_LIMIT = 2048
+AUTHOR_LIMIT = 256
+TOTAL_LIMIT = 6000
+# Room kept free in every footer for a page counter like " • Page 12/30"
+PAGE_MARKER_ROOM = 24
+PREVIOUS_PAGE = "◀"
+NEXT_PAGE = "▶"
+
+
+def _clip(text: str, limit: int) -> str:
+    """Shortens text to limit characters, marking the cut with an
+    ellipsis."""
+    text = str(text)
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _copy(data: dict) -> dict:
+    """Copies an embed dict deep enough that the copy can be changed."""
+    return {key: dict(value) if isinstance(value, dict) else value
+            for key, value in data.items()}
+
+
+class EmbedTemplate:
+    """Styling shared by a family of embeds: colour, footer, author and
+    thumbnail, clipped to discord's limits once when the template is
+    made."""
+
+    def __init__(self, colour=None, footer=None, footer_icon=None,
+                 author=None, author_icon=None, thumbnail=None):
+        self.colour = colour
+        # Keyword arguments for the embed's set_footer(), set_author() and
+        # set_thumbnail(), or None for parts the template doesn't style
+        self.footer = self.author = self.thumbnail = None
+        if footer is not None:
+            self.footer = {"text": _clip(footer, FOOTER_LIMIT)}
+            if footer_icon is not None:
+                self.footer["icon_url"] = footer_icon
+        if author is not None:
+            self.author = {"name": _clip(author, AUTHOR_LIMIT)}
+            if author_icon is not None:
+                self.author["icon_url"] = author_icon
+        if thumbnail is not None:
+            self.thumbnail = {"url": thumbnail}
+        return
+
+    def new(self, title=None, description=None,
+            url=None) -> discord.Embed:
+        """Returns a new embed with this styling."""
+        embed = discord.Embed(
+            title=discord.Embed.Empty if title is None else title,
+            description=(discord.Embed.Empty if description is None
+                         else description),
+            url=discord.Embed.Empty if url is None else url)
+        return self.apply(embed)
+
+    def apply(self, embed: discord.Embed) -> discord.Embed:
+        """Gives embed this styling wherever it doesn't set its own and
+        returns it."""
+        if self.colour is not None and embed.colour is discord.Embed.Empty:
+            embed.colour = self.colour
+        if self.footer is not None and not embed.footer:
+            embed.set_footer(**self.footer)
+        if self.author is not None and not embed.author:
+            embed.set_author(**self.author)
+        if self.thumbnail is not None and not embed.thumbnail:
+            embed.set_thumbnail(**self.thumbnail)
+        return embed
+
+
+class EmbedPages:
+    """Lays an embed out as pages that each fit discord's limits.
+
+    The description is split between lines across as many pages as it
+    needs and the fields follow, at most 25 a page. Title, author and
+    footer repeat on every page and the footer gets a page counter. Texts
+    longer than their own limits are clipped. Laying out only measures the
+    texts; page() builds a page when it is needed."""
+
+    def __init__(self, embed: discord.Embed):
+        data = embed.to_dict()
+        fields = data.pop("fields", list())
+        description = data.pop("description", "")
+        if "title" in data:
+            data["title"] = _clip(data["title"], TITLE_LIMIT)
+        if "author" in data and "name" in data["author"]:
+            data["author"]["name"] = _clip(
+                data["author"]["name"], AUTHOR_LIMIT)
+        footer = data.get("footer", dict()).get("text", "")
+        self._footer = _clip(footer, FOOTER_LIMIT - PAGE_MARKER_ROOM)
+        self._base = data
+        self._fields = [{
+            "name": _clip(field["name"], FIELD_NAME_LIMIT),
+            "value": _clip(field["value"], FIELD_VALUE_LIMIT),
+            "inline": field.get("inline", True),
+        } for field in fields]
+        # Characters every page spends before its description and fields
+        fixed = (len(data.get("title", ""))
+                 + len(data.get("author", dict()).get("name", ""))
+                 + len(self._footer) + PAGE_MARKER_ROOM)
+        width = min(DESCRIPTION_LIMIT, TOTAL_LIMIT - fixed)
+        # Pages as [description, first field, end field]
+        self._pages = [[chunk, 0, 0] for chunk in split_message(
+            description or "", width)] or [[None, 0, 0]]
+        size = fixed + len(self._pages[-1][0] or "")
+        for index, field in enumerate(self._fields):
+            field_size = len(field["name"]) + len(field["value"])
+            page = self._pages[-1]
+            if (page[2] - page[1] >= FIELD_COUNT_LIMIT
+                    or size + field_size > TOTAL_LIMIT):
+                page = [None, index, index]
+                self._pages.append(page)
+                size = fixed
+            page[2] = index + 1
+            size += field_size
+        return
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def page(self, index: int) -> discord.Embed:
+        """Builds the embed for page index, counting from zero."""
+        description, first, end = self._pages[index]
+        data = _copy(self._base)
+        if description is not None:
+            data["description"] = description
+        if end > first:
+            data["fields"] = self._fields[first:end]
+        footer = self._footer
+        if len(self._pages) > 1:
+            marker = f"Page {index + 1}/{len(self._pages)}"
+            footer = f"{footer} • {marker}" if footer else marker
+        if footer:
+            data.setdefault("footer", dict())["text"] = footer
+        return discord.Embed.from_dict(data)
+
+
+class EmbedPaginator:
+    """Shows EmbedPages in one message whose page is turned when user_id,
+    or anyone if it is None, adds or removes one of the arrow reactions.
+    Watching stops after timeout seconds without a turn."""
+
+    def __init__(self, bot, message: discord.Message, pages: EmbedPages,
+                 user_id=None, timeout=120.0):
+        self.bot = bot
+        self.message = message
+        self.pages = pages
+        self.user_id = user_id
+        self.timeout = timeout
+        self.index = 0
+        return
+
+    def _is_turn(self, payload) -> bool:
+        return (payload.message_id == self.message.id
+                and payload.user_id != self.bot.user.id
+                and (self.user_id is None or payload.user_id == self.user_id)
+                and str(payload.emoji) in (PREVIOUS_PAGE, NEXT_PAGE))
+
+    async def _next_turn(self):
+        """Waits for an arrow to be added or removed, so turning pages works
+        in DMs and without the permission to remove reactions. Returns the
+        arrow, or None after the timeout. Raw events arrive whether or not
+        the message is still in the message cache."""
+        waits = [asyncio.ensure_future(self.bot.wait_for(
+            event, check=self._is_turn, timeout=self.timeout))
+            for event in ("raw_reaction_add", "raw_reaction_remove")]
+        try:
+            done, _ = await asyncio.wait(
+                waits, return_when=asyncio.FIRST_COMPLETED)
+            return str(done.pop().result().emoji)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            for wait in waits:
+                wait.cancel()
+
+    async def run(self) -> None:
+        """Adds the arrows and turns pages until the timeout."""
+        try:
+            for emoji in (PREVIOUS_PAGE, NEXT_PAGE):
+                await self.message.add_reaction(emoji)
+            while True:
+                emoji = await self._next_turn()
+                if emoji is None:
+                    break
+                step = 1 if emoji == NEXT_PAGE else -1
+                self.index = (self.index + step) % len(self.pages)
+                await self.message.edit(embed=self.pages.page(self.index))
+        except discord.HTTPException as e:
+            self.bot.warning("Could not turn embed pages: %s", e)
+            return
+        try:
+            await self.message.clear_reactions()
+        except discord.HTTPException:
+            pass  # Not allowed here, the arrows just stay
+        return
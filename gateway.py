@@ -0,0 +1,234 @@
+import ast
+import random
+import sys
+from pathlib import Path
+from types import FunctionType, MethodType, ModuleType
+import discord
+from discord.state import ConnectionState
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+# Lean gateway mode for DiscordBot, and what discord.py's caches cost.
+#
+# Cogs declare what they need from the gateway as class attributes:
+#     gateway_intents = ("members",)  # Intents flag names, beyond the core
+#     message_cache = 500  # Messages to keep for on_message_edit and friends
+# In lean mode the bot only asks for those intents, caches members only if
+# an intent keeps them up to date, never chunks guilds at startup and keeps
+# only as many messages as the most demanding cog asked for. Declarations
+# are read from the source, before the client exists and without importing
+# slow extensions, so they must be literals.
+
+# What the bot itself needs: the guild cache, messages to read commands from
+# and reactions to turn embed pages
+CORE_INTENTS = ("guilds", "guild_messages", "dm_messages", "guild_reactions",
+                "dm_reactions")
+# The class attributes cogs declare their needs with
+DECLARATIONS = ("gateway_intents", "message_cache")
+# Intents flags that stand for a pair of others, e.g. messages
+_ALIASES = ("messages", "reactions", "typing")
+# Objects other caches own. Sizes stop at them so nothing is counted twice.
+_OWNED_ELSEWHERE = (discord.Guild, discord.abc.GuildChannel, discord.Member,
+                    discord.User, discord.ClientUser, discord.Emoji,
+                    discord.Role, discord.Message, ConnectionState,
+                    discord.Client, type, ModuleType, FunctionType,
+                    MethodType)
+# Items measured per cache; bigger caches are extrapolated from a sample
+SAMPLE_SIZE = 200
+
+
+def read_declarations(path: Path) -> dict:
+    """Returns class name -> {attribute: value} for the classes in a source
+    file that declare gateway needs. Raises ValueError for declarations
+    that aren't literals and SyntaxError for broken files."""
+    tree = ast.parse(path.read_bytes(), filename=str(path))
+    declarations = dict()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for statement in node.body:
+            if not isinstance(statement, ast.Assign):
+                continue
+            for target in statement.targets:
+                if isinstance(target, ast.Name) and \
+                        target.id in DECLARATIONS:
+                    declarations.setdefault(node.name, dict())[target.id] = \
+                        ast.literal_eval(statement.value)
+    return declarations
+
+
+def declared(cog) -> dict:
+    """Returns the gateway needs a loaded cog declares."""
+    return {name: getattr(cog, name) for name in DECLARATIONS
+            if hasattr(cog, name)}
+
+
+def needed_intents(declarations) -> discord.Intents:
+    """Returns the core intents plus every intent in the declarations."""
+    intents = discord.Intents.none()
+    for name in CORE_INTENTS:
+        setattr(intents, name, True)
+    for declaration in declarations:
+        for name in declaration.get("gateway_intents", ()):
+            if name not in discord.Intents.VALID_FLAGS:
+                raise ValueError(f"Unknown intent: {name}")
+            setattr(intents, name, True)
+    return intents
+
+
+def missing_intents(declarations, intents: discord.Intents) -> list:
+    """Returns the declared intents that intents doesn't have."""
+    needed = needed_intents(declarations)
+    return [name for name, value in needed if value
+            and name not in _ALIASES and not getattr(intents, name)]
+
+
+def lean_options(declarations) -> dict:
+    """Returns the Client options lean mode uses for the declarations."""
+    declarations = list(declarations)
+    intents = needed_intents(declarations)
+    messages = max([declaration.get("message_cache", 0)
+                    for declaration in declarations] + [0])
+    return {
+        "intents": intents,
+        # Members are cached only while an intent keeps them up to date
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": False,
+        # None turns the message cache off
+        "max_messages": messages or None,
+    }
+
+
+def describe_options(options: dict) -> str:
+    """Returns a one line summary of lean_options()."""
+    intents = ", ".join(name for name, value in options["intents"]
+                        if value and name not in _ALIASES)
+    flags = ", ".join(name for name, value in options["member_cache_flags"]
+                      if value) or "none"
+    return (f"intents: {intents}; member cache: {flags}; chunking: "
+            f"{options['chunk_guilds_at_startup']}; message cache: "
+            f"{options['max_messages'] or 'off'}")
+
+
+def owned_size(obj, seen=None) -> int:
+    """Returns the bytes of obj and of everything it references that no
+    other cache owns, like its strings, dicts and slots."""
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        children = list()
+        if isinstance(item, dict):
+            children += item.keys()
+            children += item.values()
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            children += item
+        elif not isinstance(item, (str, bytes, int, float)):
+            children += vars(item).values() if hasattr(item, "__dict__") \
+                else ()
+            for cls in type(item).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    value = getattr(item, name, None)
+                    if value is not None:
+                        children.append(value)
+        stack += [child for child in children
+                  if not isinstance(child, _OWNED_ELSEWHERE)]
+    return total
+
+
+def _average_size(items: list) -> float:
+    """Returns the mean owned size of items, from a sample if there are
+    many."""
+    if not items:
+        return 0.0
+    sample = items if len(items) <= SAMPLE_SIZE else \
+        random.sample(items, SAMPLE_SIZE)
+    return sum(owned_size(item) for item in sample) / len(sample)
+
+
+def cache_counts(bot) -> dict:
+    """Returns the number of objects in each of discord.py's caches."""
+    return {
+        "guilds": len(bot.guilds),
+        "channels": sum(len(guild.channels) for guild in bot.guilds),
+        "members": sum(len(guild.members) for guild in bot.guilds),
+        "roles": sum(len(guild.roles) for guild in bot.guilds),
+        "emojis": len(bot.emojis),
+        "users": len(bot.users),
+        "messages": len(bot.cached_messages),
+    }
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else \
+                f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} GiB"
+
+
+def cache_report(bot, top=10) -> str:
+    """Returns the estimated memory of each cache and of the largest
+    guilds. Sizes are what the cached objects own, extrapolated from
+    samples of up to SAMPLE_SIZE objects per cache. Blocking."""
+    guilds = list(bot.guilds)
+    items = {
+        "guilds": guilds,
+        "channels": [c for guild in guilds for c in guild.channels],
+        "members": [m for guild in guilds for m in guild.members],
+        "roles": [r for guild in guilds for r in guild.roles],
+        "emojis": list(bot.emojis),
+        "users": list(bot.users),
+        "messages": list(bot.cached_messages),
+    }
+    averages = {name: _average_size(objects)
+                for name, objects in items.items()}
+    lines = [f"{'Cache':<10} {'Items':>8} {'Total':>11} {'Per item':>10}"]
+    total = 0.0
+    for name, objects in items.items():
+        size = averages[name] * len(objects)
+        total += size
+        lines.append(f"{name:<10} {len(objects):>8} "
+                     f"{_format_bytes(size):>11} "
+                     f"{_format_bytes(averages[name]):>10}")
+    lines.append(f"{'total':<10} {'':>8} {_format_bytes(total):>11}")
+    # Messages per guild, to charge each guild for its share of the cache
+    messages = dict()
+    for message in items["messages"]:
+        guild_id = message.guild.id if message.guild else None
+        messages[guild_id] = messages.get(guild_id, 0) + 1
+
+    def guild_size(guild) -> float:
+        return (averages["guilds"]
+                + len(guild.channels) * averages["channels"]
+                + len(guild.members) * averages["members"]
+                + len(guild.roles) * averages["roles"]
+                + len(guild.emojis) * averages["emojis"]
+                + messages.get(guild.id, 0) * averages["messages"])
+
+    if guilds:
+        sizes = sorted(((guild_size(guild), guild) for guild in guilds),
+                       key=lambda pair: pair[0], reverse=True)
+        lines.append("")
+        lines.append(f"Per guild: {_format_bytes(total / len(guilds))} on "
+                     f"average, {_format_bytes(averages['members'])} per "
+                     f"cached member")
+        for size, guild in sizes[:top]:
+            lines.append(f"{_format_bytes(size):>11}  {guild.name} "
+                         f"({guild.id}): {len(guild.members)} members "
+                         f"cached of {guild.member_count}, "
+                         f"{len(guild.channels)} channels")
+    if resource is not None:
+        # Kibibytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        lines.append("")
+        lines.append(f"Peak resident memory: {_format_bytes(peak)}")
+    return "\n".join(lines)
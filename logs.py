@@ -0,0 +1,233 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler
+)
+from queue import Full, Queue
+
+# Logging pipeline behind DiscordBot's debug() to exception() methods. Callers
+# only build a record and put it on a bounded queue; merging the message with
+# its arguments, json encoding, writing and compressing rotated files all
+# happen on the listener thread. A full queue drops records instead of making
+# the event loop wait, and chatty debug loggers can be sampled.
+
+# Attributes every LogRecord has. Anything else was passed in with extra= and
+# is written out as a field of its own.
+_RECORD_ATTRIBUTES = frozenset(
+    vars(logging.makeLogRecord(dict()))) | {"message", "asctime"}
+# Arguments of these types can't change before the listener formats them
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one json object per line, with the time, level,
+    logger, message, any extra fields and the traceback, if there is one."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(
+                record.created, timezone.utc).isoformat(
+                timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only one in every n records at or below level from chatty
+    loggers. rates maps logger names to n, and a name covers its children.
+    Kept records get a sample_rate field so readers can scale counts up."""
+
+    def __init__(self, rates: dict, level=logging.DEBUG):
+        super().__init__()
+        self.rates = dict(rates)
+        self.level = level
+        # logger name -> n, resolved once per name
+        self._rate_of = dict()
+        # logger name -> records seen
+        self._seen = dict()
+        self.sampled_out = 0
+        return
+
+    def _rate(self, name: str) -> int:
+        rate = self._rate_of.get(name)
+        if rate is None:
+            rate = 1
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = max(1, int(self.rates[prefix]))
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._rate_of[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.level:
+            return True
+        rate = self._rate(record.name)
+        if rate == 1:
+            return True
+        seen = self._seen.get(record.name, 0)
+        self._seen[record.name] = seen + 1
+        if seen % rate:
+            self.sampled_out += 1
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Puts records on a bounded queue without ever blocking. Records that
+    don't fit are dropped and counted, and a warning saying how many went
+    missing is queued once there is room again."""
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self._unreported = 0
+        return
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Leaves formatting to the listener thread unless an argument is
+        mutable and could change before the listener gets to it."""
+        args = record.args
+        if args:
+            values = args.values() if isinstance(args, dict) else args
+            if not all(isinstance(value, _IMMUTABLE) for value in values):
+                record.msg = record.getMessage()
+                record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.queue.full():  # Cheaper than letting put_nowait raise
+                raise Full
+            if self._unreported:
+                self.queue.put_nowait(self._drop_notice(record.name))
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            self._unreported += 1
+        return
+
+    def _drop_notice(self, name: str) -> logging.LogRecord:
+        return logging.makeLogRecord({
+            "name": name,
+            "levelno": logging.WARNING,
+            "levelname": "WARNING",
+            "msg": "Dropped %d log records, the log queue was full.",
+            "args": (self._unreported,),
+            "dropped": self._unreported,
+        })
+
+    def report_dropped(self, name: str) -> None:
+        """Queues the warning about dropped records now, waiting for room
+        if need be. Used when nothing else will be logged."""
+        if self._unreported:
+            self.queue.put(self._drop_notice(name))
+            self._unreported = 0
+        return
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room, as the thread may still be draining a full queue
+        self.queue.put(self._sentinel)
+        return
+
+    def stop(self) -> None:
+        """Writes out what is still queued and stops, if it was started."""
+        if self._thread is not None:
+            super().stop()
+        return
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    """Compresses a rotated log file. Runs on the listener thread."""
+    with open(source, "rb") as file, gzip.open(dest, "wb") as archive:
+        shutil.copyfileobj(file, archive)
+    os.remove(source)
+    return
+
+
+def make_file_handler(filename: str, max_bytes=10 * 1024 * 1024, backups=5,
+                      when=None) -> logging.Handler:
+    """Returns a handler writing to filename that rotates it once it holds
+    max_bytes or, if when is given, on that schedule (e.g. "midnight"). The
+    last `backups` rotated files are kept, gzipped."""
+    if when:
+        handler = TimedRotatingFileHandler(
+            filename, when=when, backupCount=backups, encoding="utf-8",
+            delay=True)
+    else:
+        handler = RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backups,
+            encoding="utf-8", delay=True)
+    handler.namer = lambda name: f"{name}.gz"
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+class LogPipeline:
+    """Wires a logger to a bounded queue whose listener thread writes json
+    lines to a rotating file and readable text to the console."""
+
+    def __init__(self, logger: logging.Logger, filename: str,
+                 queue_size=10000, max_bytes=10 * 1024 * 1024, backups=5,
+                 when=None, sampling=None):
+        self.logger = logger
+        self.queue = Queue(queue_size)
+        self.handler = BoundedQueueHandler(self.queue)
+        # Sampling names are relative to the logger, e.g. "crypto.requests"
+        self.sampler = SamplingFilter({
+            f"{logger.name}.{name}": rate
+            for name, rate in (sampling or dict()).items()})
+        self.handler.addFilter(self.sampler)
+        logger.addHandler(self.handler)
+        # Children log through the parent's handler, not the root's
+        logger.propagate = False
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(
+            "%(asctime)s:%(name)s:%(levelname)s:\n\t%(message)s\n"))
+        self.file_handler = make_file_handler(
+            filename, max_bytes=max_bytes, backups=backups, when=when)
+        self.file_handler.setFormatter(JsonFormatter())
+        self.handlers = [console, self.file_handler]
+        self.listener = _Listener(
+            self.queue, *self.handlers, respect_handler_level=True)
+        return
+
+    def start(self) -> None:
+        self.listener.start()
+        return
+
+    def stop(self) -> None:
+        """Writes out what is still queued and stops the listener."""
+        if self.listener._thread is not None:
+            self.handler.report_dropped(self.logger.name)
+        self.listener.stop()
+        return
+
+    def report(self) -> str:
+        """Returns a one line summary of the pipeline counters."""
+        return (f"{self.queue.qsize()}/{self.queue.maxsize} queued, "
+                f"dropped={self.handler.dropped}, "
+                f"sampled_out={self.sampler.sampled_out}")
@@ -1,11 +1,113 @@
+"""Runs the bot.
+
+By default one process runs every shard discord recommends. With
+--clusters, shards are split into ranges and each range runs in a process
+of its own, started and restarted by this launcher.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import secrets
+import sys
+import time
+from dotenv import load_dotenv
+from cluster import recommended_shards, shard_ranges
 from discordbot import DiscordBot
 
+# Seconds discord wants between identifies of the same concurrency bucket
+IDENTIFY_SECONDS = 5.0
+# A cluster that dies is restarted after this many seconds
+RESTART_SECONDS = 10.0
 
-def main() -> None:
-    bot = DiscordBot()
+
+def run_cluster(cluster_id: int, shard_ids: list, shard_count: int,
+                clusters: int, ipc_port: int, ipc_secret: str,
+                lean: bool) -> None:
+    """Runs one cluster. The entry point of the launcher's processes."""
+    bot = DiscordBot(shard_ids=shard_ids, shard_count=shard_count,
+                     cluster_id=cluster_id, cluster_count=clusters,
+                     ipc_port=ipc_port, ipc_secret=ipc_secret, lean=lean)
     bot.run()
     return
 
 
+def launch(clusters: int, shard_count, ipc_port: int, lean=False) -> None:
+    """Starts the clusters, staggered so their shards don't identify at
+    once, and restarts any that exit until interrupted."""
+    logger = logging.getLogger("launcher")
+    max_concurrency = 1
+    if shard_count is None:
+        load_dotenv()
+        token = os.getenv("DISCORD_TOKEN")
+        if token is None:
+            logger.critical("No DISCORD_TOKEN found in .env. Cannot run bot.")
+            sys.exit()
+        shard_count, max_concurrency = asyncio.run(recommended_shards(token))
+    ranges = shard_ranges(shard_count, clusters)
+    secret = secrets.token_hex(16)
+    # The bot isn't safe to fork once imported, so start clean interpreters
+    context = multiprocessing.get_context("spawn")
+    processes = dict()
+
+    def start(cluster_id: int) -> None:
+        process = context.Process(
+            target=run_cluster, name=f"cluster-{cluster_id}", args=(
+                cluster_id, ranges[cluster_id], shard_count, len(ranges),
+                ipc_port, secret, lean))
+        process.start()
+        processes[cluster_id] = process
+        logger.info("Started cluster %d with shards %d-%d as pid %d.",
+                    cluster_id, ranges[cluster_id][0], ranges[cluster_id][-1],
+                    process.pid)
+        return
+
+    try:
+        for cluster_id, shard_ids in enumerate(ranges):
+            start(cluster_id)
+            time.sleep(IDENTIFY_SECONDS * len(shard_ids) / max_concurrency)
+        while True:
+            time.sleep(RESTART_SECONDS)
+            for cluster_id, process in processes.items():
+                if not process.is_alive():
+                    logger.warning("Cluster %d exited with code %s, "
+                                   "restarting it.", cluster_id,
+                                   process.exitcode)
+                    start(cluster_id)
+    except KeyboardInterrupt:
+        logger.info("Stopping the clusters.")
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+    return
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clusters", type=int, default=1,
+                        help="processes to split the shards between")
+    parser.add_argument("--shards", type=int,
+                        help="total shards, by default what discord "
+                             "recommends")
+    parser.add_argument("--ipc-port", type=int, default=8765,
+                        help="cluster n answers IPC on this port plus n")
+    parser.add_argument("--lean", action="store_true",
+                        help="only ask the gateway for the intents and "
+                             "caches the cogs declare")
+    args = parser.parse_args()
+    if args.clusters <= 1:
+        bot = DiscordBot(shard_count=args.shards, lean=args.lean)
+        bot.run()
+        return
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s:%(name)s:%(levelname)s:\n\t%(message)s\n")
+    launch(args.clusters, args.shards, args.ipc_port, args.lean)
+    return
+
+
 if __name__ == "__main__":
     main()
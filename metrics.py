@@ -0,0 +1,252 @@
+import asyncio
+import os
+from bisect import bisect_left
+from time import perf_counter
+
+# Bot wide instrumentation behind bot.metrics. Commands are timed by
+# DiscordBot.invoke, a background task measures how late the event loop runs
+# its callbacks, and cogs add collectors for their own numbers, like upstream
+# latencies. Everything is rendered in the Prometheus text format and written
+# to a file every few seconds for a textfile collector to scrape.
+
+# Upper bounds, in seconds, of the histogram buckets
+COMMAND_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+               2.5)
+
+
+def _labels(labels: dict) -> str:
+    """Renders labels as {name="value",...}, escaped for Prometheus."""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Counts observations in fixed buckets, like a Prometheus histogram.
+    Observing is a bisect and an increment, whatever the traffic."""
+
+    def __init__(self, buckets=COMMAND_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket plus one for anything above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        return
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+        return
+
+    def percentile(self, percent: float) -> float:
+        """Estimates a percentile in seconds by interpolating inside the
+        bucket it falls in. Returns 0.0 without observations."""
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[index - 1] if index else 0.0
+                high = (self.buckets[index] if index < len(self.buckets)
+                        else self.max)
+                return min(low + (high - low) * (rank - seen) / count,
+                           self.max)
+            seen += count
+        return self.max
+
+    def samples(self, name: str, labels: dict) -> list:
+        """Returns the _bucket, _sum and _count lines of this histogram."""
+        lines = list()
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket"
+                         f"{_labels({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} "
+                     f"{self.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum!r}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+class Metrics:
+    """Command latencies and errors, event loop lag and whatever the
+    registered collectors report.
+
+    A collector is a function returning (name, labels, value) samples. Cogs
+    add theirs with add_collector() and remove them when unloaded, and may
+    describe() the families they report."""
+
+    def __init__(self, logger, path="metrics.prom", prefix="discordbot",
+                 export_interval=15.0, lag_interval=0.5,
+                 lag_warning=0.25):
+        self.logger = logger
+        self.path = path
+        self.prefix = prefix
+        self.export_interval = export_interval
+        self.lag_interval = lag_interval
+        self.lag_warning = lag_warning
+        # (command, "ok" or "error") -> Histogram
+        self.commands = dict()
+        # (command, error type) -> count
+        self.errors = dict()
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        # name -> function returning samples
+        self.collectors = dict()
+        # family name -> (type, help) of collector samples
+        self.descriptions = dict()
+        self._tasks = list()
+        return
+
+    def observe_command(self, command: str, seconds: float,
+                        failed: bool) -> None:
+        key = (command, "error" if failed else "ok")
+        histogram = self.commands.get(key)
+        if histogram is None:
+            histogram = self.commands[key] = Histogram()
+        histogram.observe(seconds)
+        return
+
+    def count_error(self, command: str, error: str) -> None:
+        key = (command, error)
+        self.errors[key] = self.errors.get(key, 0) + 1
+        return
+
+    def add_collector(self, name: str, collector) -> None:
+        self.collectors[name] = collector
+        return
+
+    def remove_collector(self, name: str) -> None:
+        self.collectors.pop(name, None)
+        return
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        """Sets the # TYPE and # HELP lines of a family collectors report.
+        Families without a description are counters if their name ends in
+        _total and gauges otherwise."""
+        self.descriptions[name] = (kind, help_text)
+        return
+
+    def start(self, loop) -> None:
+        """Starts the lag monitor and the periodic export on loop."""
+        if not self._tasks:
+            self._tasks = [loop.create_task(self._watch_loop()),
+                           loop.create_task(self._export_forever())]
+        return
+
+    async def _watch_loop(self) -> None:
+        """Sleeps lag_interval at a time. However much later than that the
+        loop wakes it up is time a callback held the loop."""
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, perf_counter() - start - self.lag_interval)
+            self.loop_lag.observe(lag)
+            if lag > self.lag_warning:
+                self.logger.warning(
+                    "Event loop was blocked for %.0f ms.", lag * 1000)
+
+    async def _export_forever(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.export_interval)
+            try:
+                await loop.run_in_executor(None, self._write, self.render())
+            except Exception as e:
+                self.logger.warning("Could not write %s: %r", self.path, e)
+
+    def _write(self, text: str) -> None:
+        """Replaces the file in one step so scrapers never read half of
+        it."""
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temporary, self.path)
+        return
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text format."""
+        name = f"{self.prefix}_command_seconds"
+        lines = [f"# HELP {name} Time taken by commands.",
+                 f"# TYPE {name} histogram"]
+        for (command, status), histogram in sorted(self.commands.items()):
+            lines += histogram.samples(
+                name, {"command": command, "status": status})
+        name = f"{self.prefix}_command_errors_total"
+        lines += [f"# HELP {name} Commands that failed, by error.",
+                  f"# TYPE {name} counter"]
+        for (command, error), count in sorted(self.errors.items()):
+            lines.append(f"{name}"
+                         f"{_labels({'command': command, 'error': error})} "
+                         f"{count}")
+        name = f"{self.prefix}_loop_lag_seconds"
+        lines += [f"# HELP {name} How late the event loop ran a timer.",
+                  f"# TYPE {name} histogram"]
+        lines += self.loop_lag.samples(name, dict())
+        # family name -> (collector name, sample lines). Collectors may
+        # report a family in several places, e.g. once per upstream, but
+        # its samples must be written together under one header.
+        families = dict()
+        for collector_name, collector in list(self.collectors.items()):
+            try:
+                samples = list(collector())
+            except Exception as e:
+                self.logger.warning(
+                    "Metrics collector %s failed: %r", collector_name, e)
+                continue
+            for sample, labels, value in samples:
+                family = families.setdefault(sample, (collector_name, list()))
+                family[1].append(
+                    f"{sample}{_labels(labels)} {_number(value)}")
+        for name, (collector_name, samples) in families.items():
+            kind, help_text = self.descriptions.get(name, (None, None))
+            kind = kind or ("counter" if name.endswith("_total") else "gauge")
+            help_text = help_text or \
+                f"Reported by the {collector_name} collector."
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> str:
+        """Returns a table of the command latencies and the loop lag."""
+        lines = [f"{'Command':<20} {'Calls':>6} {'Errors':>6} {'p50':>8} "
+                 f"{'p95':>8} {'p99':>8}"]
+        names = sorted({command for command, _ in self.commands})
+        for command in names:
+            ok = self.commands.get((command, "ok"), Histogram())
+            failed = self.commands.get((command, "error"), Histogram())
+            # Percentiles of the successful calls, the failures are often
+            # instant check failures
+            timing = ok if ok.count else failed
+            lines.append(
+                f"{command:<20} {ok.count + failed.count:>6} "
+                f"{failed.count:>6} " + " ".join(
+                    f"{timing.percentile(p) * 1000:>5.0f} ms"
+                    for p in (50, 95, 99)))
+        lag = self.loop_lag
+        lines.append(
+            f"Loop lag: p50={lag.percentile(50) * 1000:.1f} ms, "
+            f"p99={lag.percentile(99) * 1000:.1f} ms, "
+            f"max={lag.max * 1000:.1f} ms over {lag.count} checks")
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = list()
+        return
@@ -0,0 +1,229 @@
+import asyncio
+import re
+from collections import deque
+from time import monotonic
+
+# Outbound message scheduler used by DiscordBot.send_message. Every channel
+# gets its own queue drained by one task. Text queued while an earlier send is
+# still in flight is merged into as few messages as possible, split on line
+# and code block boundaries, and paced by buckets that mirror discord's rate
+# limits so bursts wait here instead of running into 429s.
+
+MESSAGE_LIMIT = 2000
+# Opening or closing line of a fenced code block, e.g. ```py
+FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def _cut(line: str, width: int) -> list:
+    """Cuts a line longer than width at spaces, or anywhere if it has no
+    spaces where they are needed."""
+    pieces = list()
+    while len(line) > width:
+        cut = line.rfind(" ", 0, width + 1)
+        if cut <= 0:
+            cut = width
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip(" ")
+    pieces.append(line)
+    return pieces
+
+
+def split_message(text: str, limit=MESSAGE_LIMIT) -> list:
+    r"""Splits text into messages of at most limit characters. Splits fall
+    between lines where possible and a code block that spans a split is
+    closed at the end of one message and reopened, with its language, at
+    the start of the next. Discord refuses blank messages, so there are
+    none among them, and whitespace left around a split is dropped:
+
+    >>> [len(chunk) for chunk in split_message("a" * 2000 + "\n")]
+    [2000]
+    >>> split_message(" " * 2500), split_message("\n" * 2500)
+    ([], [])
+    >>> split_message("a\n" + " " * 2500 + "\nb", limit=10)
+    ['a', 'b']
+    """
+    if len(text) <= limit:
+        return [text] if text.strip() else list()
+    chunks = list()
+    current = list()
+    size = 0
+    fence = None  # Opening line of the code block we are inside of
+    for raw_line in text.split("\n"):
+        # Inside a code block, leave room for reopening and closing it
+        width = limit - len(fence) - 5 if fence else limit
+        for line in _cut(raw_line, width):
+            # Room for closing the block if the message ends inside one
+            inside = (fence is None) == bool(FENCE.match(line))
+            closing = 4 if inside else 0
+            if current and size + 1 + len(line) + closing > limit:
+                if fence:
+                    current.append(fence[:3])
+                chunks.append("\n".join(current))
+                current = [fence] if fence else list()
+                size = len(fence) if fence else 0
+            size += len(line) + (1 if current else 0)
+            current.append(line)
+            if FENCE.match(line):
+                fence = None if fence else line.strip()
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk.rstrip().lstrip("\n") for chunk in chunks
+            if chunk.strip()]
+
+
+class RateBucket:
+    """Allows at most `rate` requests in any window of `per` seconds. Unlike
+    a bucket that refills continuously, this never lets a sixth message
+    through a 5 per 5 seconds limit early, which discord would reject. The
+    window is stretched by `slack` to absorb jitter in request latency."""
+
+    def __init__(self, rate: int, per: float, slack=0.05):
+        self.rate = rate
+        self.per = per * (1.0 + slack)
+        # Times of the last `rate` requests
+        self._times = deque(maxlen=rate)
+        return
+
+    @property
+    def full(self) -> bool:
+        """True if a whole burst could go out right now."""
+        return not self._times or monotonic() - self._times[-1] >= self.per
+
+    async def acquire(self) -> float:
+        """Waits for room in the window and claims it. Returns how many
+        seconds were spent waiting."""
+        waited = 0.0
+        while len(self._times) == self.rate:
+            wait = self._times[0] + self.per - monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+        self._times.append(monotonic())
+        return waited
+
+
+class _Channel:
+    __slots__ = ("queue", "task", "bucket")
+
+    def __init__(self, rate: int, per: float):
+        # (destination, text, future) waiting to be sent
+        self.queue = deque()
+        self.task = None
+        self.bucket = RateBucket(rate, per)
+        return
+
+
+class OutboundScheduler:
+    """Queues text per channel and sends it paced by rate limits.
+
+    Discord allows 5 messages per 5 seconds in a channel and 50 requests a
+    second per bot. Each channel has a bucket for the first limit and all of
+    them share one for the second."""
+
+    def __init__(self, logger, channel_rate=5, channel_per=5.0,
+                 global_rate=50, global_per=1.0, limit=MESSAGE_LIMIT):
+        self.logger = logger
+        self.channel_rate = channel_rate
+        self.channel_per = channel_per
+        self.limit = limit
+        self.global_bucket = RateBucket(global_rate, global_per)
+        # channel id -> _Channel
+        self._channels = dict()
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "coalesced": 0,
+            "paced_seconds": 0.0,
+            "failed": 0,
+        }
+        return
+
+    @staticmethod
+    def _channel_id(destination) -> int:
+        """Contexts send to their channel, anything else is the channel."""
+        return getattr(destination, "channel", destination).id
+
+    def send(self, destination, text: str) -> asyncio.Future:
+        """Queues text for destination, anything with an async send(), and
+        returns a future that resolves once all of it has been sent or
+        raises what sending it raised."""
+        key = self._channel_id(destination)
+        channel = self._channels.get(key)
+        if channel is None:
+            if len(self._channels) >= 1000:
+                self._prune()
+            channel = _Channel(self.channel_rate, self.channel_per)
+            self._channels[key] = channel
+        future = asyncio.get_event_loop().create_future()
+        channel.queue.append((destination, text, future))
+        self.stats["queued"] += 1
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.ensure_future(self._drain(channel))
+        return future
+
+    def _prune(self) -> None:
+        """Forgets idle channels whose buckets have refilled."""
+        for key in [key for key, channel in self._channels.items()
+                    if not channel.queue and channel.bucket.full]:
+            del self._channels[key]
+        return
+
+    def _take(self, channel: _Channel):
+        """Pops the next item plus the queued items after it, up to ten
+        messages worth of text, so they can be packed into as few messages
+        as possible. Returns (destination, text, futures)."""
+        destination, text, future = channel.queue.popleft()
+        futures = [future]
+        while channel.queue and (
+                len(text) + len(channel.queue[0][1]) < 10 * self.limit):
+            _, more, future = channel.queue.popleft()
+            text += "\n" + more
+            futures.append(future)
+            self.stats["coalesced"] += 1
+        return destination, text, futures
+
+    async def _drain(self, channel: _Channel) -> None:
+        while channel.queue:
+            destination, text, futures = self._take(channel)
+            try:
+                for chunk in split_message(text, self.limit):
+                    self.stats["paced_seconds"] += (
+                        await channel.bucket.acquire()
+                        + await self.global_bucket.acquire())
+                    await destination.send(chunk)
+                    self.stats["sent"] += 1
+            except asyncio.CancelledError:
+                for future in futures:
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                self.logger.warning("Could not send a message: %r", e)
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+        return
+
+    def close(self) -> None:
+        """Drops everything still queued."""
+        for channel in self._channels.values():
+            if channel.task is not None:
+                channel.task.cancel()
+            for _, _, future in channel.queue:
+                future.cancel()
+        self._channels.clear()
+        return
+
+    def report(self) -> str:
+        """Returns a one line summary of the scheduler counters."""
+        waiting = sum(len(c.queue) for c in self._channels.values())
+        counters = ", ".join(
+            f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in self.stats.items())
+        return f"{waiting} waiting in {len(self._channels)} channels, " \
+               f"{counters}"